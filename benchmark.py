@@ -0,0 +1,13 @@
+#!/usr/bin/env python2.7
+# -*- coding=UTF-8 -*-
+
+from argparse import ArgumentParser
+
+from cas import benchmark
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='benchmarks of CAS Python SDK hot paths, '
+                                        'uploads and downloads run against a local mock server')
+    benchmark.add_arguments(parser)
+    benchmark.main(parser.parse_args())
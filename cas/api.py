@@ -1,16 +1,30 @@
 # -*- coding=UTF-8 -*-
 
+import copy
+import io
+
 from cas.client import CASClient
+from cas.conf import client_conf
 from cas.response import CASResponse
 from cas.exceptions.cas_server_error import CASServerError
+from cas.utils.cache import TTLCache
+from cas.utils.pagination import iter_items
+from cas.utils.pagination import list_all
 
 
 class CasAPI(object):
     """
     高层次抽象的API，所有直接暴露接口的返回结果均为CASResponse类型
     """
-    def __init__(self, client):
+    def __init__(self, client, cache=None):
+        """
+        :param cache: describe与list结果的缓存，默认为TTLCache(DefaultMetadataCacheSize, DefaultMetadataCacheTTL)，
+                      传入TTLCache(ttl=0)可关闭缓存。写操作会使相关的缓存记录失效
+        """
         self.client = client
+        if cache is None:
+            cache = TTLCache(client_conf.DefaultMetadataCacheSize, client_conf.DefaultMetadataCacheTTL)
+        self.cache = cache
 
     def __getattr__(self, item):
         proxy_method = ('post_multipart', 'post_multipart_from_reader',
@@ -26,89 +40,141 @@ class CasAPI(object):
 
         def func(*args, **kwargs):
             http_response = CASClient.__getattribute__(self.client, item)(*args, **kwargs)
-            return CasAPI._create_response(http_response)
+            response = CasAPI._create_response(http_response)
+            if item.startswith('post_multipart'):
+                self._invalidate('parts', args[0], args[1])
+            else:
+                self._invalidate_vault(args[0])
+            return response
         return func
 
     @classmethod
-    def _create_response(cls, response):
+    def _create_response(cls, response, stream=False):
         if response.status / 100 == 2:
-            return CASResponse(response)
+            return CASResponse(response, stream)
         else:
             raise CASServerError(response)
 
+    def _cached(self, key, refresh, request, cacheable=None):
+        """
+        返回缓存结果的拷贝，调用方修改返回值或读取reader不影响缓存；refresh为True时忽略缓存重新请求
+        :param cacheable: 以响应为参数，返回False时不缓存该响应
+        """
+        response = None if refresh else self.cache.get(key)
+        if response is None:
+            response = request()
+            if cacheable is None or cacheable(response):
+                self.cache.put(key, response)
+        return CasAPI._copy_response(response)
+
+    @classmethod
+    def _copy_response(cls, response):
+        result = copy.copy(response)
+        result.update(copy.deepcopy(dict(response)))
+        if isinstance(response.reader, io.BytesIO):
+            result.reader = io.BytesIO(response.reader.getvalue())
+        return result
+
+    def _invalidate(self, *prefix):
+        self.cache.invalidate(lambda key: key[:len(prefix)] == prefix)
+
+    def _invalidate_vault(self, vault_name):
+        self._invalidate('vault', vault_name)
+        self._invalidate('vaults')
+
     def create_vault(self, vault_name):
         response = self.client.create_vault(vault_name)
-        return CasAPI._create_response(response)
+        response = CasAPI._create_response(response)
+        self._invalidate_vault(vault_name)
+        return response
 
-    def describe_vault(self, vault_name):
-        response = self.client.describe_vault(vault_name)
-        return CasAPI._create_response(response)
+    def describe_vault(self, vault_name, refresh=False):
+        return self._cached(('vault', vault_name), refresh, lambda: CasAPI._create_response(
+            self.client.describe_vault(vault_name)))
 
     def delete_vault(self, vault_name):
         response = self.client.delete_vault(vault_name)
-        return CasAPI._create_response(response)
+        response = CasAPI._create_response(response)
+        self._invalidate_vault(vault_name)
+        for kind in ('job', 'uploads', 'parts'):
+            self._invalidate(kind, vault_name)
+        return response
 
-    def list_vaults(self, marker=None, limit=None):
-        response = self.client.list_vaults(marker=marker, limit=limit)
-        return CasAPI._create_response(response)
+    def list_vaults(self, marker=None, limit=None, refresh=False):
+        return self._cached(('vaults', marker, limit), refresh, lambda: CasAPI._create_response(
+            self.client.list_vaults(marker=marker, limit=limit)))
 
-    def list_all_vaults(self):
-        response = self.list_vaults()
-        current_marker = response['Marker']
-        while current_marker:
-            tmp_response = self.list_vaults(marker=current_marker)
-            response['VaultList'].extend(tmp_response['VaultList'])
-            current_marker = tmp_response['Marker']
-        response['Marker'] = None
-        return response
+    def iter_vaults(self, limit=None, prefetch=True, refresh=False):
+        """
+        逐个返回vault信息，当前页处理时在后台预取下一页
+        """
+        return iter_items(lambda marker: self.list_vaults(marker=marker, limit=limit, refresh=refresh),
+                          'VaultList', prefetch)
+
+    def list_all_vaults(self, refresh=False):
+        return list_all(lambda marker: self.list_vaults(marker=marker, refresh=refresh), 'VaultList')
 
     def upload_archive(self, vault_name, content, etag, tree_tag, size=None, desc=None):
         response = self.client.upload_archive(vault_name, content, etag, tree_tag, size, desc)
-        return CasAPI._create_response(response)
+        response = CasAPI._create_response(response)
+        self._invalidate_vault(vault_name)
+        return response
 
     def delete_archive(self, vault_name, archive_id):
         response = self.client.delete_archive(vault_name,archive_id)
-        return CasAPI._create_response(response)
+        response = CasAPI._create_response(response)
+        self._invalidate_vault(vault_name)
+        return response
 
     def initiate_multipart_upload(self, vault_name, part_size, desc=None):
         response = self.client.initiate_multipart_upload(vault_name,part_size,desc)
-        return CasAPI._create_response(response)
+        response = CasAPI._create_response(response)
+        self._invalidate('uploads', vault_name)
+        return response
 
-    def list_multipart_uploads(self,vault_name, marker=None, limit=None):
-        response = self.client.list_multipart_uploads(vault_name, marker=marker, limit=limit)
-        return CasAPI._create_response(response)
+    def list_multipart_uploads(self, vault_name, marker=None, limit=None, refresh=False):
+        return self._cached(('uploads', vault_name, marker, limit), refresh, lambda: CasAPI._create_response(
+            self.client.list_multipart_uploads(vault_name, marker=marker, limit=limit)))
 
-    def list_all_multipart_uploads(self, vault_name):
-        response = self.list_multipart_uploads(vault_name)
-        marker = response['Marker']
-        while marker:
-            tmp_response = self.list_multipart_upload(vault_name,marker=marker)
-            response['UploadsList'].extend(tmp_response['UploadsList'])
-            marker = tmp_response['Marker']
-        response['Marker'] = None                   # 标识list已完整
-        return response
+    def iter_multipart_uploads(self, vault_name, limit=None, prefetch=True, refresh=False):
+        return iter_items(lambda marker: self.list_multipart_uploads(vault_name, marker=marker, limit=limit,
+                                                                     refresh=refresh),
+                          'UploadsList', prefetch)
+
+    def list_all_multipart_uploads(self, vault_name, refresh=False):
+        return list_all(lambda marker: self.list_multipart_uploads(vault_name, marker=marker, refresh=refresh),
+                        'UploadsList')
 
     def complete_multipart_upload(self, vault_name, upload_id, file_size, tree_etag):
         response = self.client.complete_multipart_upload(vault_name, upload_id, file_size, tree_etag)
-        return CasAPI._create_response(response)
+        response = CasAPI._create_response(response)
+        self._invalidate_upload(vault_name, upload_id)
+        return response
 
     def abort_multipart_upload(self, vault_name, upload_id):
         response = self.client.abort_multipart_upload(vault_name,upload_id)
-        return CasAPI._create_response(response)
+        response = CasAPI._create_response(response)
+        self._invalidate_upload(vault_name, upload_id)
+        return response
 
-    def list_parts(self, vault_name, upload_id, marker=None, limit=None):
-        response = self.client.list_parts(vault_name, upload_id, marker, limit)
-        return CasAPI._create_response(response)
+    def _invalidate_upload(self, vault_name, upload_id):
+        self._invalidate('uploads', vault_name)
+        self._invalidate('parts', vault_name, upload_id)
+        self._invalidate_vault(vault_name)
 
-    def list_all_parts(self, vault_name, upload_id):
-        response = self.list_parts(vault_name, upload_id)
-        marker = response['Marker']
-        while marker:
-            tmp_response = self.list_parts(vault_name, upload_id, marker=marker)
-            response['Parts'].extend(tmp_response['Parts'])
-            marker = tmp_response['Marker']
-        response['Marker'] = None
-        return response
+    def list_parts(self, vault_name, upload_id, marker=None, limit=None, refresh=False):
+        return self._cached(('parts', vault_name, upload_id, marker, limit), refresh,
+                            lambda: CasAPI._create_response(
+                                self.client.list_parts(vault_name, upload_id, marker, limit)))
+
+    def iter_parts(self, vault_name, upload_id, limit=None, prefetch=True, refresh=False):
+        return iter_items(lambda marker: self.list_parts(vault_name, upload_id, marker=marker, limit=limit,
+                                                         refresh=refresh),
+                          'Parts', prefetch)
+
+    def list_all_parts(self, vault_name, upload_id, refresh=False):
+        return list_all(lambda marker: self.list_parts(vault_name, upload_id, marker=marker, refresh=refresh),
+                        'Parts')
 
     def initiate_job(self, vault_name, job_type, archive_id=None, desc=None, byte_range=None, tier=None, marker=None, limit=None, start_date=None, end_date=None, bucket_endpoint=None, object_name=None):
         """
@@ -129,27 +195,35 @@ class CasAPI(object):
         response = self.client.initiate_job(vault_name, job_type, archive_id, desc, byte_range, tier, marker=marker, limit=limit, start_date=start_date, end_date=end_date, bucket_endpoint=bucket_endpoint, object_name=object_name)
         return CasAPI._create_response(response)
 
-    def describe_job(self, vault_name, job_id):
-        response = self.client.describe_job(vault_name, job_id)
-        return CasAPI._create_response(response)
+    def describe_job(self, vault_name, job_id, refresh=False):
+        """
+        只缓存已完成的任务，未完成任务的状态每次都重新查询
+        """
+        return self._cached(('job', vault_name, job_id), refresh, lambda: CasAPI._create_response(
+            self.client.describe_job(vault_name, job_id)), lambda response: response.get('Completed') is True)
 
-    def get_job_output(self, vault_name, job_id, byte_range=None):
-        response = self.client.get_job_output(vault_name, job_id, "bytes=%d-%d" % byte_range)
-        return CasAPI._create_response(response)
+    def get_job_output(self, vault_name, job_id, byte_range=None, stream=False):
+        """
+        :param byte_range: (start, end)，为None时读取全部输出
+        :param stream: 为True时不论Content-Type均不预先读取响应体，用于逐段读取较大的inventory输出
+        """
+        orange = None if byte_range is None else "bytes=%d-%d" % byte_range
+        response = self.client.get_job_output(vault_name, job_id, orange)
+        return CasAPI._create_response(response, stream)
 
-    def list_jobs(self, vault_name, completed=None, marker=None, limit=None, status_code=None):
-        response = self.client.list_jobs(vault_name, completed, marker, limit, status_code)
-        return CasAPI._create_response(response)
+    def list_jobs(self, vault_name, completed=None, marker=None, limit=None, status_code=None, refresh=False):
+        """
+        任务列表中的状态随时变化，不缓存；保留refresh参数与其它list接口一致
+        """
+        return CasAPI._create_response(self.client.list_jobs(vault_name, completed, marker, limit, status_code))
 
-    def list_all_jobs(self, vault_name):
-        response = self.list_jobs(vault_name)
-        marker = response['Marker']
-        while marker:
-            tmp_response = self.list_jobs(vault_name, marker=marker)
-            response['JobList'].extend(tmp_response['JobList'])
-            marker = tmp_response['Marker']
-        response['Marker'] = None                           # 标识已经全部列出
-        return response
+    def iter_jobs(self, vault_name, completed=None, status_code=None, limit=None, prefetch=True, refresh=False):
+        return iter_items(lambda marker: self.list_jobs(vault_name, completed=completed, marker=marker,
+                                                        limit=limit, status_code=status_code, refresh=refresh),
+                          'JobList', prefetch)
+
+    def list_all_jobs(self, vault_name, refresh=False):
+        return list_all(lambda marker: self.list_jobs(vault_name, marker=marker, refresh=refresh), 'JobList')
 
     def get_vault_access_policy(self, vault_name):
         response = self.client.get_vault_access_policy(vault_name)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import io
+import logging
+import sys
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from cas.conf import multi_task_conf
+from cas.conf.common_conf import MEGABYTE
+from cas.exceptions.cas_client_error import DownloadArchiveError
+from cas.exceptions.cas_server_error import CASServerError
+from cas.utils.file_utils import range_size
+from cas.utils.merkle import TreeHashGenerator
+
+log = logging.getLogger(__name__)
+
+
+class _Block(object):
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.data = None
+        self.exc_info = None
+
+
+class ArchiveReader(io.RawIOBase):
+    """
+    以只读、可seek的文件对象读取已完成任务的输出，按需对get_job_output发起Range请求
+    数据按block_size对齐分块，最近读取的块保存在LRU缓存中；顺序读取时在后台线程中预读后续的块
+    """
+
+    _BlockSize = multi_task_conf.ArchiveReader_BlockSize
+    _CacheBlocks = multi_task_conf.ArchiveReader_CacheBlocks
+    _Readahead = multi_task_conf.ArchiveReader_Readahead
+    _NumberThread = multi_task_conf.ArchiveReader_NumberThread
+    _NumRetry = multi_task_conf.Job_NumRetry
+
+    def __init__(self, job, block_size=None, cache_blocks=None, readahead=None, threads=None):
+        """
+        :param job: 已完成的archive-retrieval或inventory-retrieval任务
+        :param block_size: 每次请求的块大小，必须为1MB的整数倍，以便校验服务端返回的tree hash
+        :param cache_blocks: 缓存的最大块数，内存占用上限约为该值*block_size
+        :param readahead: 顺序读取时预读的块数，为0时不预读
+        :param threads: 预读线程数
+        """
+        super(ArchiveReader, self).__init__()
+        self.job = job
+        self.block_size = block_size or self._BlockSize
+        if self.block_size % MEGABYTE != 0:
+            raise ValueError('block size must be a multiple of 1MB: %d' % self.block_size)
+        self.cache_blocks = max(cache_blocks or self._CacheBlocks, 1)
+        self.readahead = self._Readahead if readahead is None else readahead
+        if job.action == 'InventoryRetrieval':
+            self.size = job.inventory_size
+        else:
+            self.size = range_size(job._parse_job_range())
+        self._num_blocks = (self.size + self.block_size - 1) // self.block_size
+        self._blocks = OrderedDict()        # index -> _Block，包括请求中的块
+        self._lock = threading.Lock()
+        self._pool = ThreadPool(processes=threads or self._NumberThread) if self.readahead > 0 else None
+        self._pos = 0
+        self._next_sequential = 0
+        self._run_start = 0         # 当前连续读取的起始位置
+
+    def __repr__(self):
+        return 'ArchiveReader: %s' % self.job.id
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('invalid whence: %r' % whence)
+        if pos < 0:
+            raise IOError('negative seek position %d' % pos)
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        """
+        尽量填满b，只有到达末尾时才返回比len(b)少的字节数
+        连续读取超过一个块后才开始预读，避免tarfile等跳跃读取小段头部时触发无用的预读
+        """
+        self._checkClosed()
+        if self._pos != self._next_sequential:
+            self._run_start = self._pos
+        total = 0
+        while total < len(b) and self._pos < self.size:
+            index, offset = divmod(self._pos, self.block_size)
+            data = self._get_block(index)
+            n = min(len(data) - offset, len(b) - total)
+            b[total:total + n] = data[offset:offset + n]
+            total += n
+            self._pos += n
+            if self._pos - self._run_start >= self.block_size:
+                self._prefetch(index + 1)
+        self._next_sequential = self._pos
+        return total
+
+    def close(self):
+        if not self.closed:
+            if self._pool is not None:
+                # 请求中的预读在后台完成后被丢弃
+                self._pool.close()
+            with self._lock:
+                self._blocks.clear()
+        super(ArchiveReader, self).close()
+
+    def _get_block(self, index):
+        with self._lock:
+            block = self._blocks.pop(index, None)
+            fetch = block is None
+            if fetch:
+                block = _Block()
+            self._blocks[index] = block
+            self._evict()
+        if fetch:
+            self._fetch(index, block)
+        block.ready.wait()
+        if block.exc_info is not None:
+            with self._lock:
+                if self._blocks.get(index) is block:
+                    del self._blocks[index]
+            raise block.exc_info[0], block.exc_info[1], block.exc_info[2]
+        return block.data
+
+    def _prefetch(self, start):
+        if self._pool is None:
+            return
+        with self._lock:
+            for index in xrange(start, min(start + self.readahead, self._num_blocks)):
+                if index not in self._blocks:
+                    block = _Block()
+                    self._blocks[index] = block
+                    self._pool.apply_async(self._fetch, (index, block))
+            self._evict()
+
+    def _evict(self):
+        """
+        淘汰最久未访问的已完成块，请求中的块不淘汰
+        """
+        if len(self._blocks) <= self.cache_blocks:
+            return
+        for index in [index for index, block in self._blocks.items() if block.ready.is_set()]:
+            del self._blocks[index]
+            if len(self._blocks) <= self.cache_blocks:
+                break
+
+    def _fetch(self, index, block):
+        start = index * self.block_size
+        byte_range = (start, min(start + self.block_size, self.size) - 1)
+        size = range_size(byte_range)
+        try:
+            for cnt in xrange(self._NumRetry):
+                try:
+                    response = self.job.vault.api.get_job_output(
+                        self.job.vault.name, self.job.id, byte_range=byte_range)
+                    data = ''.join(iter(lambda: response.read(MEGABYTE), ''))
+                    if len(data) != size:
+                        log.error('Range %d-%d incomplete read: %d' % (byte_range[0], byte_range[1], len(data)))
+                        continue
+                    tree_etag = response.get('x-cas-sha256-tree-hash')
+                    if tree_etag:
+                        generator = TreeHashGenerator()
+                        generator.update(data)
+                        if generator.generate().digest() != tree_etag:
+                            log.error('Range %d-%d invalid checksum, %s expected.' %
+                                      (byte_range[0], byte_range[1], tree_etag))
+                            continue
+                    block.data = data
+                    return
+                except CASServerError as e:
+                    if e.type == 'client':
+                        raise
+                    log.error('Range %d-%d read failed. Reason: %s' % (byte_range[0], byte_range[1], e))
+                except Exception as e:
+                    log.error('Range %d-%d read failed. Reason: %s' % (byte_range[0], byte_range[1], e))
+            raise DownloadArchiveError('Range %d-%d read failed' % byte_range)
+        except Exception:
+            block.exc_info = sys.exc_info()
+        finally:
+            block.ready.set()
@@ -0,0 +1,202 @@
+# -*- coding=UTF-8 -*-
+
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from cas.conf import client_conf
+from cas.conf.common_conf import MEGABYTE
+from cas.utils import http_utils
+from cas.utils.file_utils import compute_hash_from_file
+from cas.utils.merkle import MerkleTree
+from cas.utils.merkle import TreeHashGenerator
+
+
+def _rate(func, number):
+    begin = time.time()
+    for _ in xrange(number):
+        func()
+    elapsed = time.time() - begin
+    return number / elapsed if elapsed > 0 else float('inf')
+
+
+def bench_signing(number=20000):
+    """
+    对比每次重新派生sign_key的create_auth与缓存sign_key的Signer，结果为每秒签名次数
+    """
+    ak, sk, host = 'AKIDbenchmark', 'benchmarksecretkey', 'cas.ap-chengdu.myqcloud.com'
+    method, url = 'PUT', '/1250000000/vaults/benchmark/multipart-uploads/upload-id'
+    headers = {'Host': host,
+               'Content-Length': 64 * 1024 * 1024,
+               'x-cas-content-sha256': '0' * 64,
+               'x-cas-sha256-tree-hash': '0' * 64}
+    params = {'marker': 'next-marker', 'limit': 1000}
+    expire = client_conf.DefaultAuthTimeout
+    signer = http_utils.Signer(ak, sk, expire)
+
+    return {
+        'create_auth_per_sec': _rate(
+            lambda: http_utils.create_auth(ak, sk, host, method, url, headers, params, expire), number),
+        'signer_per_sec': _rate(
+            lambda: signer.sign(method, url, headers, params), number),
+    }
+
+
+def _throughput(func, nbytes, repeat=3):
+    """
+    取repeat次中最快的一次，结果为MB/s
+    """
+    best = None
+    for _ in xrange(repeat):
+        begin = time.time()
+        func()
+        elapsed = time.time() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return nbytes / float(MEGABYTE) / best if best > 0 else float('inf')
+
+
+def _make_file(directory, size):
+    path = os.path.join(directory, 'bench-%d.bin' % size)
+    with open(path, 'wb') as f:
+        block = os.urandom(MEGABYTE)
+        for pos in xrange(0, size, MEGABYTE):
+            f.write(block[:min(MEGABYTE, size - pos)])
+    return path
+
+
+def bench_hashing(size=256 * MEGABYTE, repeat=3):
+    """
+    compute_hash_from_file(读文件并计算sha256与tree hash)与TreeHashGenerator(内存数据)的吞吐，单位MB/s
+    """
+    directory = tempfile.mkdtemp(prefix='cas-bench-')
+    try:
+        path = _make_file(directory, size)
+        data = os.urandom(min(size, 64 * MEGABYTE))
+
+        def tree_hash():
+            generator = TreeHashGenerator()
+            generator.update(data)
+            generator.generate().digest()
+
+        return {
+            'size': size,
+            'compute_hash_from_file_mb_per_sec': _throughput(lambda: compute_hash_from_file(path), size, repeat),
+            'tree_hash_generator_mb_per_sec': _throughput(tree_hash, len(data), repeat),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_merkle(leaf_counts=(1, 16, 256, 4096, 65536), repeat=3):
+    """
+    MerkleTree.digest合并不同数目叶子的耗时，单位秒
+    """
+    result = {}
+    for count in leaf_counts:
+        leaves = [hashlib.sha256(str(i)).digest() for i in xrange(count)]
+        best = None
+        for _ in xrange(repeat):
+            begin = time.time()
+            MerkleTree(hash_list=list(leaves)).digest()
+            elapsed = time.time() - begin
+            best = elapsed if best is None else min(best, elapsed)
+        result[str(count)] = best
+    return result
+
+
+def bench_transfer(size=256 * MEGABYTE, threads=(1, 4, 16), part_sizes=(16 * MEGABYTE, 64 * MEGABYTE),
+                   latency=0, bandwidth=None):
+    """
+    对本地MockCASServer测量MultipartUpload.start与Job.download_to_file的端到端吞吐，单位MB/s
+    结果按 threads/part_size 组合列出；测量期间关闭两者每个分片开始前的随机等待
+    """
+    from cas.api import CasAPI
+    from cas.job import Job
+    from cas.mock_server import MockCASServer
+    from cas.multipart_upload import MultipartUpload
+    from cas.vault import Vault
+
+    directory = tempfile.mkdtemp(prefix='cas-bench-')
+    server = MockCASServer(latency=latency, bandwidth=bandwidth).start()
+    delays = MultipartUpload._StartupDelay, Job._StartupDelay
+    MultipartUpload._StartupDelay = Job._StartupDelay = None
+    try:
+        path = _make_file(directory, size)
+        output = os.path.join(directory, 'output.bin')
+        api = CasAPI(server.client())
+        vault = Vault.create(api, 'benchmark')
+        upload, download = [], []
+        for part_size in part_sizes:
+            for thread_num in threads:
+                begin = time.time()
+                response = api.initiate_multipart_upload(vault.name, part_size)
+                upload_id = response['x-cas-multipart-upload-id']
+                uploader = MultipartUpload(vault, api.describe_multipart(vault.name, upload_id), file_path=path)
+                archive_id = uploader.start(threads=thread_num)
+                upload.append({'threads': thread_num, 'part_size': part_size,
+                               'mb_per_sec': size / float(MEGABYTE) / (time.time() - begin)})
+
+                job = vault.retrieve_archive(archive_id)
+                begin = time.time()
+                job.download_to_file(output, block=False, part_size=part_size, threads=thread_num)
+                download.append({'threads': thread_num, 'part_size': part_size,
+                                 'mb_per_sec': size / float(MEGABYTE) / (time.time() - begin)})
+                os.remove(output)
+                vault.delete_archive(archive_id)
+        return {'size': size, 'latency': latency, 'bandwidth': bandwidth,
+                'multipart_upload': upload, 'download_to_file': download}
+    finally:
+        MultipartUpload._StartupDelay, Job._StartupDelay = delays
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run(number=20000, size=256 * MEGABYTE, threads=(1, 4, 16), part_sizes=(16 * MEGABYTE, 64 * MEGABYTE),
+        transfer=True, latency=0, bandwidth=None):
+    """
+    运行全部基准测试，返回可直接输出为JSON的结果，用于对比不同版本的SDK
+    """
+    result = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'signing': bench_signing(number),
+        'hashing': bench_hashing(size),
+        'merkle': bench_merkle(),
+    }
+    if transfer:
+        result['transfer'] = bench_transfer(size, threads, part_sizes, latency, bandwidth)
+    return result
+
+
+def add_arguments(parser):
+    """
+    benchmark.py与cascmd bench共用的参数
+    """
+    parser.add_argument('-n', '--number', type=int, default=20000, help='iterations of the signing benchmark')
+    parser.add_argument('--size', type=int, default=256, help='size in MB of data hashed and transferred')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16],
+                        help='thread counts of upload and download benchmarks')
+    parser.add_argument('--part-sizes', type=int, nargs='+', default=[16, 64],
+                        help='part sizes in MB of upload and download benchmarks')
+    parser.add_argument('--latency', type=float, default=0, help='delay in seconds of each request to the mock server')
+    parser.add_argument('--bandwidth', type=int, help='bandwidth limit in MB/s of the mock server')
+    parser.add_argument('--no-transfer', action='store_true', help='skip upload and download benchmarks')
+    parser.add_argument('-o', '--output', type=str, help='file JSON result written to, default to be stdout')
+
+
+def main(args):
+    result = run(args.number, args.size * MEGABYTE, args.threads, [p * MEGABYTE for p in args.part_sizes],
+                 not args.no_transfer, args.latency, args.bandwidth and args.bandwidth * MEGABYTE)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        json.dump(result, out, indent=2, sort_keys=True)
+        out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
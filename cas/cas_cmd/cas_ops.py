@@ -1,16 +1,22 @@
 # -*- coding=UTF-8 -*-
 
-import binascii
 import json
 import sys
 from collections import namedtuple
 
+from cas.api import CasAPI
 from cas.client import CASClient
 from cas.conf.common_conf import DEFAULT_NORMAL_UPLOAD_THRESHOLD
 from cas.conf.common_conf import MAX_PART_NUM
 from cas.conf.common_conf import RECOMMEND_MIN_PART_SIZE
 from cas.utils.file_utils import *
+from cas.utils.hash_cache import enable_hash_cache
 from cas.utils.http_utils import check_response
+from cas.utils.parallel_hash import ParallelTreeHasher
+from cas.utils.tracer import Tracer
+from cas.multipart_upload import MultipartUpload
+from cas.restore import RestorePipeline
+from cas.vault import Vault
 from cas.vault import parse_vault_name
 
 
@@ -21,6 +27,21 @@ class CASCMD(object):
     def __init__(self, auth_info):
         self.api = CASClient(auth_info.endpoint, auth_info.appid, auth_info.secretid, auth_info.secretkey)
 
+    @classmethod
+    def _enable_hash_cache(cls, args):
+        if getattr(args, 'hash_cache', None):
+            enable_hash_cache(args.hash_cache)
+
+    @classmethod
+    def _create_tracer(cls, args):
+        return Tracer() if getattr(args, 'trace', None) else None
+
+    @classmethod
+    def _save_trace(cls, tracer, args):
+        if tracer is not None:
+            tracer.save(args.trace)
+            print 'Trace written to %s, open it in chrome://tracing or https://ui.perfetto.dev' % args.trace
+
     @classmethod
     def _byte_humanize(cls, byte):
         if byte is None:
@@ -34,6 +55,17 @@ class CASCMD(object):
             byte = float(byte) / 1024
         return '%.2f %s' % (byte, unit)
 
+    @classmethod
+    def _print_progress(cls, completed, total):
+        percent = completed * 100 // total if total else 100
+        nbar = percent // 2
+        sys.stdout.write('\r[%s] %s%% %s / %s' % ('=' * nbar + '>' + ' ' * (50 - nbar), percent,
+                                                  cls._byte_humanize(completed),
+                                                  cls._byte_humanize(total)))
+        if completed >= total:
+            sys.stdout.write('\n')
+        sys.stdout.flush()
+
     @classmethod
     def _parse_size(cls, size):
         try:
@@ -103,10 +135,12 @@ class CASCMD(object):
             sys.exit(1)
         size = os.path.getsize(args.local_file)
         desc = args.desc or args.local_file[:128]
+        self._enable_hash_cache(args)
+        tracer = self._create_tracer(args)
 
         if (not args.part_size and size >= DEFAULT_NORMAL_UPLOAD_THRESHOLD) or \
                 (args.part_size and size > RECOMMEND_MIN_PART_SIZE):
-            resume = 0
+            vault = Vault(CasAPI(self.api), {'VaultName': parse_vault_name(args.vault)})
             if not args.upload_id:
                 partsize = self._parse_size(args.part_size)
                 if partsize:
@@ -132,47 +166,28 @@ class CASCMD(object):
                 Create = namedtuple('Namespace', ['vault', 'part_size', 'desc'])
                 cargs = Create(args.vault, partsize, desc)
                 upload_id = self.cmd_init_multipart_upload(cargs)
+                uploader = MultipartUpload(vault, {'MultipartUploadId': upload_id,
+                                                   'PartSizeInBytes': partsize},
+                                           file_path=args.local_file)
+                upload = lambda: uploader.start(threads=args.threads,
+                                                progress=self._print_progress, tracer=tracer)
             else:
                 upload_id = args.upload_id
-                vault_name = parse_vault_name(args.vault)
-                res = self.api.list_parts(vault_name, upload_id, None, None)
-                check_response(res)
-                rjson = json.loads(res.read(), 'UTF8')
-                plist = rjson['Parts']
-                partsize = rjson['PartSizeInBytes']
-                nparts = size // partsize
-                if size % partsize:
-                    nparts += 1
-                # 这里有个问题, 如果已上传的不是连续的, 那么就会漏掉中间的分块
-                if plist:
-                    resumebytes = max([int(x['RangeInBytes'].split('-')[1]) \
-                                       for x in plist]) + 1
-                    if resumebytes == size:
-                        resume = nparts
-                    else:
-                        resume = resumebytes // partsize
+                uploader = vault.get_multipart_uploader(upload_id)
                 print 'Resume last upload with partsize %s' % \
-                        self._byte_humanize(partsize)
-            Part = namedtuple('Namespace', ['vault', 'upload_id', 'local_file',
-                'start', 'end', 'etag', 'tree_etag'])
-            start = 0
-            etaglist = []
-            for i in range(nparts):
-                end = min(size, start+partsize)-1
-                etag, tree_etag = compute_hash_from_file(args.local_file, start,
-                                                         end-start+1)
-                pargs = Part(args.vault, upload_id, args.local_file, start,
-                             end, etag, tree_etag)
-                start += partsize
-                etaglist.append(binascii.unhexlify(tree_etag))
-                if i < resume: continue
-                print 'Uploading part %s...' % (i+1)
-                self.cmd_upload_part(pargs)
-            Complete = namedtuple('Namespace', ['vault', 'upload_id',
-                                                'size', 'tree_etag'])
-            etree = compute_combine_tree_etag_from_list(etaglist)
-            cargs = Complete(args.vault, upload_id, size, etree)
-            self.cmd_complete_multipart_upload(cargs)
+                        self._byte_humanize(uploader.part_size)
+                # 按服务端实际已上传的分片续传，不再假设已上传的分片是连续的
+                upload = lambda: uploader.resume(args.local_file, threads=args.threads,
+                                                 progress=self._print_progress, tracer=tracer)
+            try:
+                archive_id = upload()
+            except Exception, e:
+                sys.stderr.write('\n[Error]: %s\n' % e)
+                sys.stderr.write('Run again with --upload_id %s to resume\n' % upload_id)
+                sys.exit(1)
+            finally:
+                self._save_trace(tracer, args)
+            print 'Archive ID: %s' % archive_id
             return
         if size <= RECOMMEND_MIN_PART_SIZE and args.part_size:
             print 'test_utils smaller than 16MB, part-size will be ignored.'
@@ -262,7 +277,8 @@ class CASCMD(object):
         if not os.path.isfile(args.local_file):
             sys.stderr.write("Error: file '%s' not existed!\n" % args.local_file)
             sys.exit(1)
-        etag, tree_etag = compute_hash_from_file(args.local_file)
+        self._enable_hash_cache(args)
+        etag, tree_etag = ParallelTreeHasher(args.threads).hash(args.local_file)
         print "etag     :", etag
         print "tree_etag:", tree_etag
 
@@ -274,7 +290,8 @@ class CASCMD(object):
         end = self._parse_size(args.end)
         if end % (1024*1024) == 0: end -= 1
         size = end - start + 1
-        etag, tree_etag = compute_hash_from_file(args.local_file, start, size)
+        self._enable_hash_cache(args)
+        etag, tree_etag = ParallelTreeHasher(args.threads).hash(args.local_file, start, size)
         print "etag     :", etag
         print "tree_etag:", tree_etag
 
@@ -503,13 +520,20 @@ class CASCMD(object):
         if start is not None and size is not None:
             output_range = 'bytes=%s-%s' % (start, start+size-1)
 
-        if not args.force and os.path.exists(dst):
+        # 下载整个archive时按分片并行下载，断点记录在local_file.cas中
+        parallel = jtype == 'archive-retrieval' and output_range is None
+        if parallel and os.path.exists(dst) and os.path.exists(dst + '.cas'):
+            print 'Resume last download of %s' % dst
+        elif not args.force and os.path.exists(dst):
             ans = raw_input('Output file %s existed. Do you wish to ' \
                     'overwrite it? (y/n): ' % dst)
             if ans.strip().lower() != 'y':
                 print 'Answer is no. Quit now.'
                 sys.exit(0)
 
+        if parallel:
+            return self._fetch_parallel(vault_name, job_id, dst, args)
+
         res = self.api.get_job_output(vault_name, job_id, output_range)
         check_response(res)
 
@@ -536,6 +560,76 @@ class CASCMD(object):
         if jtype == 'inventory-retrieval' and job['InventoryRetrievalParameters']['Marker']:
             print 'NOTICE: Want more archive list? Create a new job with  --marker %s'%(job['InventoryRetrievalParameters']['Marker'])
 
+    def _fetch_parallel(self, vault_name, job_id, dst, args):
+        vault = Vault(CasAPI(self.api), {'VaultName': vault_name})
+        job = vault.get_job(job_id)
+        part_size = self._parse_size(getattr(args, 'part_size', None))
+        if part_size and part_size % (1024 * 1024) != 0:
+            sys.stderr.write('Error: partsize must be divided by 1MB!\n')
+            sys.exit(1)
+        tracer = self._create_tracer(args)
+        try:
+            job.download_to_file(dst, block=False, part_size=part_size,
+                                 threads=getattr(args, 'threads', None),
+                                 progress=self._print_progress, tracer=tracer)
+        except Exception, e:
+            sys.stderr.write('\n[Error]: %s\n' % e)
+            sys.stderr.write('Run the same command again to resume\n')
+            sys.exit(1)
+        finally:
+            self._save_trace(tracer, args)
+        print 'Download job output success'
+
+    def cmd_restore(self, args):
+        vault_name = parse_vault_name(args.vault)
+        archive_ids = list(args.archive_ids)
+        if args.archive_list:
+            with open(args.archive_list) as f:
+                archive_ids.extend(line.strip() for line in f if line.strip())
+        if not archive_ids:
+            sys.stderr.write('Error: no archive ID provided\n')
+            sys.exit(1)
+        part_size = self._parse_size(args.part_size)
+        if part_size and part_size % (1024 * 1024) != 0:
+            sys.stderr.write('Error: partsize must be divided by 1MB!\n')
+            sys.exit(1)
+        kwargs = {}
+        if args.max_bytes is not None:
+            kwargs['max_bytes'] = self._parse_size(args.max_bytes)
+
+        vault = Vault(CasAPI(self.api), {'VaultName': vault_name})
+        failed = []
+
+        def on_done(future):
+            job = future.job
+            exception = future.exception()
+            if exception is None:
+                print 'Archive %s restored to %s' % (job.archive_id, os.path.join(args.dir, job.archive_id))
+            else:
+                failed.append(job.archive_id)
+                sys.stderr.write('[Error]: restore archive %s by job %s failed: %s\n' %
+                                 (job.archive_id, job.id, exception))
+
+        with RestorePipeline(downloads=args.downloads, threads=args.threads,
+                             part_size=part_size, **kwargs) as pipeline:
+            futures = []
+            for archive_id in archive_ids:
+                try:
+                    future = pipeline.restore(vault, archive_id, os.path.join(args.dir, archive_id),
+                                              desc=args.desc, tier=args.tier)
+                except Exception, e:
+                    failed.append(archive_id)
+                    sys.stderr.write('[Error]: retrieve archive %s failed: %s\n' % (archive_id, e))
+                    continue
+                print 'Archive %s retrieval job: %s' % (archive_id, future.job.id)
+                future.add_done_callback(on_done)
+                futures.append(future)
+            for future in futures:
+                future.exception()
+        print 'Restored %d of %d archives' % (len(archive_ids) - len(failed), len(archive_ids))
+        if failed:
+            sys.exit(1)
+
     def cmd_list_job(self, args):
         vault_name = parse_vault_name(args.vault)
         marker = args.marker
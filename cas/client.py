@@ -2,6 +2,7 @@
 
 import httplib
 import json
+import mmap
 import socket
 import string
 import sys
@@ -10,7 +11,13 @@ import logging
 
 from cas.conf import client_conf
 from cas.utils import http_utils
+from cas.utils import metrics
 from cas.utils import file_utils
+from cas.utils import request_hooks
+from cas.utils import socket_utils
+from cas.utils import tracer
+from cas.utils.buffer_utils import buffer_slice
+from cas.utils.connection_pool import ConnectionPool
 
 log = logging.getLogger(__name__)
 
@@ -24,22 +31,61 @@ class CASClient(object):
     _DefaultSendBufferSize = client_conf.DefaultSendBufferSize
     _DefaultGetBufferSize = client_conf.DefaultGetBufferSize
     _DefaultAuthTimeout = client_conf.DefaultAuthTimeout
+    _DefaultConnectionTimeout = client_conf.DefaultConnectionTimeout
+    _DefaultConnectionPoolSize = client_conf.DefaultConnectionPoolSize
+    _DefaultConnectionIdleTimeout = client_conf.DefaultConnectionIdleTimeout
+    _DefaultMetrics = client_conf.DefaultMetrics
     _provider = client_conf.provider
+    _IdempotentMethods = ('GET', 'HEAD', 'PUT', 'DELETE')
 
-    def __init__(self, endpoint, appid, ak, sk, port=80, is_security=False):
+    def __init__(self, endpoint, appid, ak, sk, port=80, is_security=False,
+                 pool_size=_DefaultConnectionPoolSize, idle_timeout=_DefaultConnectionIdleTimeout,
+                 hooks=None):
+        """
+        :param hooks: 接收请求各阶段计时事件的RequestHooks，默认为进程共用的request_hooks.default_hooks
+        """
         self.host = endpoint
         self.appid = appid
         self.ak = ak
         self.sk = sk
         self.port = port
-        self.is_security = is_security
-
-    def __get_connection(self):
-        if self.is_security or self.port == 443:
-            self.is_security = True
-            return httplib.HTTPSConnection(self.host, self.port, timeout=100)
-        else:
-            return httplib.HTTPConnection(self.host, self.port, timeout=100)
+        self.is_security = is_security or port == 443
+        self.signer = http_utils.Signer(self.ak, self.sk, self._DefaultAuthTimeout)
+        self.pool = ConnectionPool(self.host, self.port, self.is_security,
+                                   timeout=self._DefaultConnectionTimeout,
+                                   max_size=pool_size, idle_timeout=idle_timeout)
+        self.hooks = hooks if hooks is not None else request_hooks.default_hooks
+        if self._DefaultMetrics:
+            metrics.watch_client(self)
+
+    def __get_connection(self, trace):
+        conn, reused = self.pool.get()
+        if conn.sock is None:
+            conn.connect()
+        trace.connected(reused)
+        return conn, reused
+
+    def __get_response(self, conn, trace):
+        response = conn.getresponse()
+        trace.first_byte(response)
+        self.pool.release_on_close(conn, response)
+        return response
+
+    @classmethod
+    def __send_request(cls, conn, method, url, body, headers, trace):
+        """
+        与HTTPConnection.request相同，较小的请求体与请求头一起发送，分别记录发送完成的时间
+        """
+        header_names = set(k.lower() for k in headers)
+        conn.putrequest(method, url, skip_host='host' in header_names,
+                        skip_accept_encoding='accept-encoding' in header_names)
+        if body is not None and 'content-length' not in header_names:
+            conn.putheader('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            conn.putheader(k, v)
+        conn.endheaders(body)
+        trace.headers_sent()
+        trace.body_sent(len(body or ''))
 
     def __http_request(self, method, url, headers=None, body='', params=None):
         headers = headers or dict()
@@ -50,16 +96,33 @@ class CASClient(object):
         headers['Date'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
         headers['User-Agent'] = 'CAS Python SDK'
 
+        trace = self.hooks.start(method, url)
         if params is not None:
             url = http_utils.append_param(url, params)
-        conn = self.__get_connection()
-        try:
-            conn.request(method, url, body, headers)
-            return conn.getresponse()
-        except socket.timeout, e:
-            raise Exception('Connect or send timeout! ' + e.message)
+        while True:
+            conn, reused = None, False
+            try:
+                conn, reused = self.__get_connection(trace)
+                self.__send_request(conn, method, url, body, headers, trace)
+                return self.__get_response(conn, trace)
+            except socket.timeout, e:
+                trace.error(e)
+                if conn is not None:
+                    conn.close()
+                raise Exception('Connect or send timeout! ' + e.message)
+            except (httplib.BadStatusLine, socket.error), e:
+                trace.error(e)
+                if conn is not None:
+                    conn.close()
+                # 服务端可能已关闭了复用的keep-alive连接，对幂等请求使用新连接重试一次
+                if not reused or method not in self._IdempotentMethods:
+                    raise
+                trace.retried()
+                log.debug('debug: reused connection failed, retry with a new one: %s\n' % e)
 
     def __http_reader_huge_cache_request(self, method, url, headers, content):
+        trace = self.hooks.start(method, url)
+        conn = None
         try:
             # only host need to sign !!!
             headers['Host'] = self.host
@@ -69,15 +132,16 @@ class CASClient(object):
             headers['Date'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
             headers['User-Agent'] = 'CAS Python SDK'
 
-            conn = self.__get_connection()
+            conn, _ = self.__get_connection(trace)
             conn.putrequest(method, url)
             for k in headers.keys():
                 conn.putheader(str(k), str(headers[k]))
             conn.endheaders()
+            trace.headers_sent()
 
             send_buffer_size = 1024 * 1024
             sended_size = 0
-            content_length = len(content)
+            content_length = file_utils.content_length(content)
             left_length = content_length
             while True:
                 if sended_size == content_length:
@@ -86,11 +150,9 @@ class CASClient(object):
                     raise Exception(
                         'Sended data more than content_length set.')
 
+                # 按视图切片发送，不复制content中的数据
                 left_length = content_length - sended_size
-                if left_length > send_buffer_size:
-                    buf = content[sended_size:(send_buffer_size+sended_size)]
-                else:
-                    buf = content[sended_size:content_length]
+                buf = buffer_slice(content, sended_size, min(left_length, send_buffer_size))
                 buf_len = len(buf)
                 if buf_len > 0:
                     conn.send(buf)
@@ -100,20 +162,32 @@ class CASClient(object):
 
             if sended_size < content_length:
                 raise Exception('Sended data less than content_length set.')
+            trace.body_sent(sended_size)
 
-            return conn.getresponse()
+            return self.__get_response(conn, trace)
 
         except socket.timeout, e:
+            trace.error(e)
+            if conn is not None:
+                conn.close()
             raise Exception('Connect or send timeout! ' + e.message)
         except socket.error, e:
+            trace.error(e)
             error_info = str(e)
             bpipe_error = '[Errno 32] Broken pipe'
-            if string.find(error_info, bpipe_error) >= 0:
-                return conn.getresponse()
+            if conn is not None and string.find(error_info, bpipe_error) >= 0:
+                return self.__get_response(conn, trace)
             else:
+                if conn is not None:
+                    conn.close()
                 raise Exception('Request error! ' + str(e))
+        except Exception, e:
+            trace.error(e)
+            raise
 
     def __http_reader_request(self, method, url, headers, reader, content_length):
+        trace = self.hooks.start(method, url)
+        conn = None
         try:
             # only host need to sign !
             headers['Host'] = self.host
@@ -122,15 +196,20 @@ class CASClient(object):
 
             headers['Date'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
             headers['User-Agent'] = 'CAS Python SDK'
-            conn = self.__get_connection()
+            conn, _ = self.__get_connection(trace)
             conn.putrequest(method, url)
             for k in headers.keys():
                 conn.putheader(str(k), str(headers[k]))
             conn.endheaders()
+            trace.headers_sent()
 
             send_buffer_size = 1024 * 1024
             sended_size = 0
-            left_length = content_length
+            if socket_utils.can_sendfile(conn.sock, reader):
+                sended_size = socket_utils.sendfile(conn.sock, reader, content_length)
+            elif isinstance(reader, mmap.mmap):
+                sended_size = socket_utils.send_mmap(conn, reader, content_length, send_buffer_size)
+            left_length = content_length - sended_size
             while True:
                 if sended_size == content_length:
                     break
@@ -152,22 +231,32 @@ class CASClient(object):
 
             if sended_size < content_length:
                 raise Exception('Sended data less than content_length set.')
+            trace.body_sent(sended_size)
 
-            return conn.getresponse()
+            return self.__get_response(conn, trace)
 
         except socket.timeout, e:
+            trace.error(e)
+            if conn is not None:
+                conn.close()
             raise Exception('Connect or send timeout! ' + e.message)
         except socket.error, e:
+            trace.error(e)
             error_info = str(e)
             bpipe_error = '[Errno 32] Broken pipe'
-            if string.find(error_info, bpipe_error) >= 0:
-                return conn.getresponse()
+            if conn is not None and string.find(error_info, bpipe_error) >= 0:
+                return self.__get_response(conn, trace)
             else:
+                if conn is not None:
+                    conn.close()
                 raise Exception('Request error! ' + str(e))
+        except Exception, e:
+            trace.error(e)
+            raise
 
-    def __create_auth(self, method, url, headers=None, params=None, expire=_DefaultAuthTimeout):
-        auth_value = http_utils.create_auth(self.ak, self.sk, self.host, method, url, headers, params, expire)
-        return auth_value
+    def __create_auth(self, method, url, headers=None, params=None):
+        with tracer.span('sign', 'request'):
+            return self.signer.sign(method, url, headers, params)
 
     def create_vault(self, vault_name):
         url = '/%s/vaults/%s' % (self.appid, vault_name)
@@ -218,12 +307,9 @@ class CASClient(object):
         headers['x-cas-sha256-tree-hash'] = tree_etag
         if desc is not None:
             headers['x-cas-archive-description'] = desc
-        headers['Content-Length'] = len(content)
+        headers['Content-Length'] = file_utils.content_length(content)
 
-        if len(content) < 512*1024*1024:
-            return self.__http_request(method, url, headers, content)
-        else:
-            return self.__http_reader_huge_cache_request(method, url, headers, content)
+        return self.__http_reader_huge_cache_request(method, url, headers, content)
 
     def post_archive_from_reader(self, vault_name, reader, content_length, etag, tree_etag, desc=None):
         """
@@ -310,7 +396,7 @@ class CASClient(object):
         method = 'PUT'
         headers = dict()
         headers['Host'] = self.host
-        headers['Content-Length'] = len(content)
+        headers['Content-Length'] = file_utils.content_length(content)
         headers['x-cas-content-sha256'] = etag
         headers['x-cas-sha256-tree-hash'] = tree_etag
 
@@ -321,10 +407,7 @@ class CASClient(object):
 
         log.debug('debug: post part from content, url: %s, range, %s\n' % (url, prange))
 
-        if len(content) < 512*1024*1024:
-            return self.__http_request(method, url, headers, content)
-        else:
-            return self.__http_reader_huge_cache_request(method, url, headers, content)
+        return self.__http_reader_huge_cache_request(method, url, headers, content)
 
     def post_multipart_from_reader(self, vault_name, upload_id, reader, content_length, prange, etag, tree_etag):
         """
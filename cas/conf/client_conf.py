@@ -3,4 +3,10 @@
 DefaultSendBufferSize = 8192
 DefaultGetBufferSize = 1024 * 1024 * 10
 DefaultAuthTimeout = 1200  # seconds
+DefaultConnectionTimeout = 100  # seconds
+DefaultConnectionPoolSize = 64  # 每个endpoint保持的最大空闲连接数，为0时不复用连接
+DefaultConnectionIdleTimeout = 60  # seconds, 空闲超过该时间的连接将被关闭
+DefaultMetadataCacheTTL = 10  # seconds, describe与list结果的缓存时间，为0时不缓存
+DefaultMetadataCacheSize = 1024  # 缓存的最大记录数
+DefaultMetrics = False  # 为True时CASClient将请求数、流量、耗时与连接数记录到metrics.default_registry
 provider = "CAS"
@@ -23,5 +23,9 @@ Multipart_Upload_MaximumNumberOfParts = 10000       # 分块上传的最大分
 
 Job_Default_Download_PartSize = 32 * MEGABYTE       # Archive取回时的默认分块大小
 
+DEFAULT_HASH_CACHE_FILE = os.path.expanduser('~') + '/.cas_hash_cache.db'   # 本地hash缓存文件
+DEFAULT_HASH_CACHE_MAX_ENTRIES = 1000000            # 本地hash缓存的最大记录数
 
 
+
+DEFAULT_UPLOAD_JOURNAL_DIR = os.path.expanduser('~') + '/.cas_upload_journal'    # 分块上传断点记录目录
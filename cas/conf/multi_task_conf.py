@@ -5,6 +5,26 @@ from multiprocessing import cpu_count
 Default_Thread_Num = None      # 该项为None，则默认使用CPU的核心数*4
 Job_NumberThread = Default_Thread_Num or (cpu_count() * 4)
 Job_NumRetry = 3
+Job_StartupDelay = (0.256, 4.096)     # 每个分片开始下载前随机等待的 (最小, 最大) 时间，单位秒，为None时不等待
 
 MultipartUpload_NumberThread = Default_Thread_Num or (cpu_count() * 8)
 MultipartUpload_NumberRetry = 3
+MultipartUpload_StartupDelay = (0.256, 4.096)     # 每个分片开始上传前随机等待的 (最小, 最大) 时间，单位秒，为None时不等待
+MultipartUpload_Pipeline = False       # 为True时每个分片只从磁盘读取一次，在内存中完成hash计算与发送
+MultipartUpload_NumberBuffer = cpu_count() * 2      # pipeline模式下分片缓冲区的数目，内存占用上限为该值*分片大小
+MultipartUpload_Journal = True         # 在本地记录已上传分片的hash，续传时不必重新读取这些分片
+MultipartUpload_VerifySample = 0.0     # 续传时从本地记录中随机抽取该比例的分片重新计算hash校验
+
+Adaptive_Concurrency = False    # 为True时MultipartUpload与Job在线程数上限内根据吞吐、延迟与错误率动态调整并发数
+
+JobWatcher_TierInterval = {'Expedited': (5, 60),       # JobWatcher对各检索类型任务的 (初始, 最大) 轮询间隔，单位秒
+                           'Standard': (60, 600),
+                           'Bulk': (300, 1800)}
+
+Restore_NumberDownload = 4      # 批量取回时同时下载的archive数目
+Restore_MaxBytes = 64 * 1024 * 1024 * 1024      # 批量取回时同时下载的archive总大小上限，为None时不限制
+
+ArchiveReader_BlockSize = 4 * 1024 * 1024      # ArchiveReader每次请求的块大小，必须为1MB的整数倍
+ArchiveReader_CacheBlocks = 32      # ArchiveReader缓存的最大块数
+ArchiveReader_Readahead = 4     # ArchiveReader顺序读取时预读的块数
+ArchiveReader_NumberThread = 4      # ArchiveReader预读线程数
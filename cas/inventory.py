@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import sqlite3
+import threading
+
+from cas.conf.common_conf import MEGABYTE
+
+log = logging.getLogger(__name__)
+
+_WHITESPACE = ' \t\n\r'
+
+
+class InventoryParser(object):
+    """
+    增量解析inventory-retrieval输出的JSON，逐条返回ArchiveList中的记录
+    每次只在内存中保留一个读取块与当前记录，不需要一次读入整个输出
+    """
+
+    _ListKey = '"ArchiveList"'
+
+    def __init__(self, stream, chunk_size=MEGABYTE):
+        """
+        :param stream: 带有read(size)方法的对象，如get_job_output(..., stream=True)返回的CASResponse
+        """
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def __iter__(self):
+        self._seek_list()
+        while True:
+            char = self._next_char(',')
+            if char == ']':
+                return
+            while True:
+                try:
+                    record, end = self.decoder.raw_decode(self.buf, self.pos)
+                    break
+                except ValueError:
+                    # 记录不完整时读取更多数据后重新解析
+                    if not self._fill():
+                        raise ValueError('Truncated inventory at record: %r' % self.buf[self.pos:self.pos + 64])
+            self.pos = end
+            yield record
+
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _next_char(self, skip=''):
+        """
+        跳过空白与skip中的字符，返回下一个字符但不前进
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE + skip:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of inventory')
+
+    def _seek_list(self):
+        while True:
+            index = self.buf.find(self._ListKey, self.pos)
+            if index >= 0:
+                self.pos = index + len(self._ListKey)
+                break
+            # 保留末尾可能被截断的部分key
+            self.pos = max(self.pos, len(self.buf) - len(self._ListKey))
+            if not self._fill():
+                raise ValueError('ArchiveList not found in inventory')
+        for expected in ':[':
+            if self._next_char() != expected:
+                raise ValueError('Malformed inventory near: %r' % self.buf[self.pos:self.pos + 64])
+            self.pos += 1
+
+
+def iter_inventory(stream, chunk_size=MEGABYTE):
+    """
+    逐条返回inventory中的archive记录(dict)
+    """
+    return iter(InventoryParser(stream, chunk_size))
+
+
+class InventoryCatalog(object):
+    """
+    保存在本地SQLite中的archive索引，支持按描述前缀、创建时间与大小查询
+    """
+
+    _Columns = ('vault', 'archive_id', 'description', 'creation_date', 'size', 'tree_hash')
+    _RecordFields = (('ArchiveId', 'archive_id'),
+                     ('ArchiveDescription', 'description'),
+                     ('CreationDate', 'creation_date'),
+                     ('Size', 'size'),
+                     ('SHA256TreeHash', 'tree_hash'))
+
+    def __init__(self, db_path=':memory:'):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS archives (
+                vault TEXT NOT NULL,
+                archive_id TEXT NOT NULL,
+                description TEXT,
+                creation_date TEXT,
+                size INTEGER,
+                tree_hash TEXT,
+                PRIMARY KEY (vault, archive_id));
+            CREATE INDEX IF NOT EXISTS archives_description ON archives (vault, description);
+            CREATE INDEX IF NOT EXISTS archives_creation_date ON archives (vault, creation_date);
+            CREATE INDEX IF NOT EXISTS archives_size ON archives (vault, size);
+        ''')
+
+    def __repr__(self):
+        return 'InventoryCatalog: %s' % self.db_path
+
+    def load(self, vault_name, records, replace=True, batch_size=10000):
+        """
+        写入archive记录，按batch_size分批提交
+        :param records: inventory记录的可迭代对象，如iter_inventory的返回值
+        :param replace: 为True时先清空该vault原有的记录
+        :return: 写入的记录数
+        """
+        sql = 'INSERT OR REPLACE INTO archives (%s) VALUES (%s)' % (
+            ', '.join(self._Columns), ', '.join('?' * len(self._Columns)))
+        count = 0
+        with self._lock:
+            if replace:
+                self._conn.execute('DELETE FROM archives WHERE vault = ?', (vault_name,))
+            batch = []
+            for record in records:
+                batch.append((vault_name,) + tuple(record.get(key) for key, _ in self._RecordFields))
+                if len(batch) >= batch_size:
+                    self._conn.executemany(sql, batch)
+                    self._conn.commit()
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._conn.executemany(sql, batch)
+                count += len(batch)
+            self._conn.commit()
+        log.info('Loaded %d archives of %s into %s' % (count, vault_name, self.db_path))
+        return count
+
+    def load_job(self, job, replace=True, batch_size=10000):
+        """
+        以流的方式读取inventory-retrieval任务的输出并写入索引
+        """
+        response = job.vault.api.get_job_output(job.vault.name, job.id, stream=True)
+        return self.load(job.vault.name, iter_inventory(response), replace, batch_size)
+
+    def get(self, vault_name, archive_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM archives WHERE vault = ? AND archive_id = ?',
+                                     (vault_name, archive_id)).fetchone()
+        return dict(row) if row is not None else None
+
+    def find(self, vault_name, prefix=None, start_date=None, end_date=None,
+             min_size=None, max_size=None, order_by='creation_date', limit=None):
+        """
+        :param prefix: 描述前缀
+        :param start_date, end_date: 创建时间范围 [start_date, end_date)，格式同inventory，如2017-01-01T00:00:00Z
+        :param min_size, max_size: 大小范围 [min_size, max_size]
+        :return: 符合条件的记录(dict)列表
+        """
+        if order_by not in self._Columns:
+            raise ValueError('invalid order_by: %s' % order_by)
+        where, params = ['vault = ?'], [vault_name]
+        if prefix:
+            # 以范围条件代替LIKE，可以使用description上的索引
+            prefix = prefix.decode('utf-8') if isinstance(prefix, str) else prefix
+            where.append('description >= ? AND description < ?')
+            params.extend([prefix, prefix[:-1] + unichr(ord(prefix[-1]) + 1)])
+        for column, op, value in (('creation_date', '>=', start_date), ('creation_date', '<', end_date),
+                                  ('size', '>=', min_size), ('size', '<=', max_size)):
+            if value is not None:
+                where.append('%s %s ?' % (column, op))
+                params.append(value)
+        sql = 'SELECT * FROM archives WHERE %s ORDER BY %s' % (' AND '.join(where), order_by)
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def count(self, vault_name=None):
+        with self._lock:
+            if vault_name is None:
+                return self._conn.execute('SELECT COUNT(*) FROM archives').fetchone()[0]
+            return self._conn.execute('SELECT COUNT(*) FROM archives WHERE vault = ?',
+                                      (vault_name,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -7,17 +7,21 @@ import random
 import threading
 import time
 
-import yaml
-
 try:
     from collections import OrderedDict
 except ImportError:
     from ordereddict import OrderedDict
 from multiprocessing.pool import ThreadPool
 
+from cas.archive_reader import ArchiveReader
 from cas.conf import multi_task_conf
 from cas.utils.file_utils import *
 from cas.utils.file_utils import calc_num_part
+from cas.utils.concurrency import AdaptiveConcurrency
+from cas.utils.journal import DownloadJournal
+from cas.utils.metrics import part_metrics
+from cas.utils.request_hooks import retry_context
+from cas.utils.tracer import NULL_TRACER
 from cas.conf.common_conf import MEGABYTE
 from cas.conf.common_conf import Job_Default_Download_PartSize
 from cas.conf.common_conf import MAX_PART_NUM
@@ -33,6 +37,8 @@ class Job(object):
 
     _NumberThread = multi_task_conf.Job_NumberThread
     _NumRetry = multi_task_conf.Job_NumRetry
+    _StartupDelay = multi_task_conf.Job_StartupDelay
+    _Adaptive = multi_task_conf.Adaptive_Concurrency
 
     ResponseDataParser = (('Action', 'action', None),
                           ('ArchiveSHA256TreeHash', 'archive_etag', None),
@@ -90,11 +96,25 @@ class Job(object):
             value = cas_response.get(response_name)
             setattr(self, attr_name, value or default)
 
+        self._layout_parts()
+
+    def _layout_parts(self, part_size=None):
+        """
+        按part_size划分下载分片，未指定时按calc_part_size计算
+        :param part_size: 必须为1MB的整数倍，以保证服务端返回的各分片tree hash可以校验
+        """
         self.parts = OrderedDict()
         if self.archive_size > 0 and self.action == "ArchiveRetrieval":
             tmp_byte_range = self._parse_job_range()
             size = range_size(tmp_byte_range)
-            if size > 32*1024*1024:
+            if part_size:
+                if part_size % MEGABYTE != 0:
+                    raise ValueError('part size must be a multiple of 1MB: %d' % part_size)
+                if calc_num_part(part_size, size) > MAX_PART_NUM:
+                    part_size = self.calc_part_size(size)
+                for byte_range in calc_ranges(part_size, size):
+                    self.parts[byte_range] = None
+            elif size > 32*1024*1024:
                 part_size = self.calc_part_size(size)
                 for byte_range in calc_ranges(part_size, size):
                     self.parts[byte_range] = None
@@ -102,7 +122,7 @@ class Job(object):
                 self.parts[(0, size - 1)] = None
 
     def update_status(self):
-        cas_response = self.vault.api.describe_job(self.vault.name, self.id)
+        cas_response = self.vault.api.describe_job(self.vault.name, self.id, refresh=True)
         self._update(cas_response)
 
     def _check_status(self, block=False):
@@ -134,9 +154,11 @@ class Job(object):
         try:
             for cnt in xrange(self._NumRetry):
                 pos = 0
+                response = None
                 try:
-                    response = self.vault.api.get_job_output(
-                        self.vault.name, self.id, byte_range=byte_range)
+                    with retry_context(cnt):
+                        response = self.vault.api.get_job_output(
+                            self.vault.name, self.id, byte_range=byte_range, stream=True)
                     while True:
                         data = response.read(chunk_size)
                         if not data:
@@ -164,6 +186,9 @@ class Job(object):
                               (byte_range[0], byte_range[1], e))
                     f.seek(offset)
                     continue
+                finally:
+                    if response is not None:
+                        response.close()
         finally:
             f.flush()
             if f is not file_obj:
@@ -172,7 +197,15 @@ class Job(object):
         raise DownloadArchiveError(
             'Incomplete download: %d / %d' % (pos, size))
 
-    def download_to_file(self, file_path, chunk_size=None, block=True):
+    def download_to_file(self, file_path, chunk_size=None, block=True, adaptive=None,
+                         part_size=None, threads=None, progress=None, tracer=None):
+        """
+        :param adaptive: 为True时由AIMD控制器根据吞吐、延迟与错误率动态调整同时下载的分片数，默认取multi_task_conf
+        :param part_size: 分片大小，必须为1MB的整数倍，默认按calc_part_size计算
+        :param threads: 下载线程数，默认取multi_task_conf
+        :param progress: 每个分片下载成功后以 (已完成字节数, 总字节数) 调用
+        :param tracer: 记录每个分片各阶段耗时的Tracer，见cas.utils.tracer
+        """
         if self.action == "PullFromCOS" or self.action == "PushToCOS":
             raise DownloadArchiveError('Job not ready')
 
@@ -183,77 +216,119 @@ class Job(object):
                 file_path=file_path,
                 byte_range=(0, self.inventory_size - 1))
 
+        if part_size:
+            self._layout_parts(part_size)
+        threads = threads or self._NumberThread
+        size_total = range_size(self._parse_job_range())
         file_dir, file_name = os.path.split(file_path)
         log_file = os.path.join(file_dir, file_name + '.cas')
-        try:
-            self._load(log_file)
-        except IOError:
-            pass
-        log_lock = threading.RLock()
-        file_lock = threading.RLock()
+        journal = DownloadJournal(log_file, self.parts.keys())
+        self.parts.update(journal.load())
+        if adaptive is None:
+            adaptive = self._Adaptive
+        controller = AdaptiveConcurrency(threads) if adaptive else None
+        tracer = tracer or NULL_TRACER
+        progress_lock = threading.Lock()
+        completed = [self.size_completed]
 
         def download_part(byte_range):
+            with tracer.activate(), tracer.span('part', range='%d-%d' % byte_range):
+                fetch_part(byte_range)
+
+        def fetch_part(byte_range):
             for cnt in xrange(self._NumRetry):
-                time.sleep(random.randint(256, 4096) / 1000)
+                if self._StartupDelay:
+                    with tracer.span('startup-sleep'):
+                        time.sleep(random.uniform(*self._StartupDelay))
+                started = None
+                if controller:
+                    with tracer.span('wait-slot'):
+                        started = controller.acquire()
+                part = part_metrics.start('download')
+                nbytes, congested = 0, False
+                response = None
                 try:
-                    response = self.vault.api.get_job_output(
-                        self.vault.name, self.id, byte_range=byte_range)
-
-                    generator = TreeHashGenerator()
-                    offset = byte_range[0]
-                    while True:
-                        data = response.read(chunk_size)
-                        if not data:
-                            break
-                        generator.update(data)
-
-                        with file_lock:
-                            f.seek(offset)
-                            f.write(data)
-                            f.flush()
+                    with retry_context(cnt), tracer.span('retry' if cnt else 'attempt', attempt=cnt):
+                        response = self.vault.api.get_job_output(
+                            self.vault.name, self.id, byte_range=byte_range)
+
+                        generator = TreeHashGenerator()
+                        offset = byte_range[0]
+                        while True:
+                            data = response.read(chunk_size)
+                            if not data:
+                                break
+                            with tracer.span('hash'):
+                                generator.update(data)
+                            with tracer.span('write'):
+                                writer.write(offset, data)
                             offset += len(data)
 
                     if offset != byte_range[1] + 1:
+                        congested = True
                         log.error('Range %d-%d(%d) incomplete download.' %
                                   (byte_range[0], byte_range[1], offset))
                         continue
                     tree_etag = generator.generate().digest()
                     if self._is_tree_hash_align() and \
                             tree_etag != response['x-cas-sha256-tree-hash']:
+                        congested = True
                         log.error('Range %d-%d invalid checksum %s, '
                                   'which %s expected.' %
                                   (byte_range[0], byte_range[1], tree_etag,
                                    response['x-cas-sha256-tree-hash']))
                         continue
                     else:
+                        writer.flush(byte_range[0], range_size(byte_range))
                         self.parts[byte_range] = tree_etag
-                        with log_lock:
-                            self._save(log_file)
+                        journal.append(byte_range, tree_etag)
+                        # 校验通过并落盘后才计为成功传输
+                        nbytes = range_size(byte_range)
+                        if progress is not None:
+                            with progress_lock:
+                                completed[0] += nbytes
+                                progress(completed[0], size_total)
                         log.info('Range %d-%d download success.' % byte_range)
                         return
-                except (CASServerError, IOError) as e:
+                except CASServerError as e:
+                    congested = e.status // 100 == 5
+                    log.error('Range %d-%d download failed. Reason: %s' %
+                              (byte_range[0], byte_range[1], e))
+                    continue
+                except IOError as e:
+                    congested = True
                     log.error('Range %d-%d download failed. Reason: %s' %
                               (byte_range[0], byte_range[1], e))
                     continue
                 except Exception as e:
+                    congested = True
                     log.error('Range %d-%d download failed. The reason: %s' %
                               (byte_range[0], byte_range[1], e))
                     continue
+                finally:
+                    if response is not None:
+                        response.close()
+                    part_metrics.finish(part, nbytes)
+                    if controller:
+                        controller.release(started, nbytes, congested)
 
             log.info('Range %d-%d download failed.' % byte_range)
 
-        f = open_file(file_path=file_path, mode='wb+')
-        with f:
+        # 续传时保留已下载的分片，不能以wb+打开清空文件
+        writer = PositionalWriter(file_path, size_total)
+        with writer, journal:
             log.info('Start download.')
-            pool = ThreadPool(
-                            processes=min(self._NumberThread, len(self.parts)))
-            pool.map(download_part,
-                     [byte_range for byte_range, tag in self.parts.items()
-                      if tag is None])
-            pool.close()
+            tracer.attach()
+            try:
+                pool = ThreadPool(processes=min(threads, len(self.parts)))
+                pool.map(download_part,
+                         [byte_range for byte_range, tag in self.parts.items()
+                          if tag is None])
+                pool.close()
+            finally:
+                tracer.detach()
 
             size = self.size_completed
-            size_total = range_size(self._parse_job_range())
             if size != size_total:
                 raise DownloadArchiveError(
                     'Incomplete download: %d / %d' %
@@ -266,20 +341,19 @@ class Job(object):
                             'tree-etag not match: %s / %s (actual)' %
                             (tree_etag_actual, self.retrieval_etag))
 
-            if os.path.exists(log_file):
-                os.remove(log_file)
+            journal.remove()
 
         log.info('Download finish.')
 
-    def _save(self, file_path):
-        f = open_file(file_path=file_path, mode='wb+')
-        with f:
-            f.write(yaml.dump(self.parts, default_flow_style=True))
-
-    def _load(self, file_path):
-        f = open_file(file_path=file_path)
-        with f:
-            self.parts = yaml.load(f)
+    def open(self, block_size=None, cache_blocks=None, readahead=None, threads=None):
+        """
+        以只读、可seek的文件对象读取任务输出，不必先下载整个文件，参数见ArchiveReader
+        """
+        if self.action == "PullFromCOS" or self.action == "PushToCOS":
+            raise DownloadArchiveError('Job not ready')
+        self._check_status(False)
+        return ArchiveReader(self, block_size=block_size, cache_blocks=cache_blocks,
+                             readahead=readahead, threads=threads)
 
     @property
     def size_completed(self):
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import sys
+import threading
+import time
+
+from cas.conf import multi_task_conf
+from cas.exceptions.cas_client_error import DownloadArchiveError
+
+log = logging.getLogger(__name__)
+
+
+class JobFuture(object):
+    """
+    等待中的任务，任务完成后result返回更新过状态的Job，任务失败时抛出DownloadArchiveError
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self._done = threading.Event()
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('Job %s not completed in %s seconds' % (self.job.id, timeout))
+        if self._exception is not None:
+            raise self._exception
+        return self.job
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('Job %s not completed in %s seconds' % (self.job.id, timeout))
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """
+        任务完成后以该future为参数调用fn，已完成时立即调用
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        self._call(fn)
+
+    def _set(self, exception=None):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self._exception = exception
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            self._call(fn)
+
+    def _call(self, fn):
+        try:
+            fn(self)
+        except Exception as e:
+            log.error('Callback of job %s failed: %s' % (self.job.id, e))
+
+
+class _WatchEntry(object):
+
+    def __init__(self, job, future, interval):
+        self.job = job
+        self.future = future
+        self.initial, self.max_interval = interval
+        self.interval = self.initial
+        self.next_poll = 0
+
+    def backoff(self, now):
+        self.next_poll = now + self.interval
+        self.interval = min(self.interval * 2, self.max_interval)
+
+
+class JobWatcher(object):
+    """
+    同时等待多个任务完成。同一vault中到期的任务通过一次分页list_jobs(completed='true')查询，
+    代替每个任务单独describe_job轮询；未完成的任务按检索类型(Expedited/Standard/Bulk)的间隔指数退避
+    """
+
+    _TierInterval = multi_task_conf.JobWatcher_TierInterval
+    _DefaultTier = 'Standard'
+
+    def __init__(self, page_limit=None):
+        """
+        :param page_limit: 每次list_jobs返回的最大任务数
+        """
+        self.page_limit = page_limit
+        self._entries = {}              # (vault_name, job_id) -> _WatchEntry
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def watch(self, job, callback=None):
+        """
+        :param callback: 任务完成或失败后以JobFuture为参数调用
+        :return: JobFuture
+        """
+        interval = self._TierInterval.get(job.tier or self._DefaultTier,
+                                          self._TierInterval[self._DefaultTier])
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('JobWatcher closed')
+            key = (job.vault.name, job.id)
+            entry = self._entries.get(key)
+            # 传入时已完成的任务不需要轮询
+            finished = entry is None and job.completed
+            if entry is None:
+                entry = _WatchEntry(job, JobFuture(job), interval)
+                if not finished:
+                    self._entries[key] = entry
+            if not finished:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run)
+                    self._thread.daemon = True
+                    self._thread.start()
+                self._cond.notify()
+        if finished:
+            self._finish(entry)
+        if callback is not None:
+            entry.future.add_done_callback(callback)
+        return entry.future
+
+    def wait(self, futures, timeout=None):
+        """
+        等待所有futures完成，返回对应的Job列表；任一任务失败时抛出其异常
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        return [future.result(None if deadline is None else max(deadline - time.time(), 0))
+                for future in futures]
+
+    def close(self):
+        """
+        停止轮询，仍在等待中的任务的future以RuntimeError结束，避免result()无限等待
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        with self._cond:
+            entries, self._entries = self._entries.values(), {}
+        for entry in entries:
+            entry.future._set(RuntimeError('JobWatcher closed before job %s completed' % entry.job.id))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = time.time()
+                    due = [entry for entry in self._entries.values() if entry.next_poll <= now]
+                    if due:
+                        break
+                    timeout = min(entry.next_poll for entry in self._entries.values()) - now \
+                        if self._entries else None
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+            vaults = {}
+            for entry in due:
+                vault = entry.job.vault
+                vaults.setdefault((vault.api, vault.name), []).append(entry)
+            for entries in vaults.values():
+                self._poll(entries[0].job.vault, entries)
+
+    def _poll(self, vault, entries):
+        """
+        分页列出vault中已完成的任务，所有到期的任务都找到后提前停止
+        """
+        waiting = dict((entry.job.id, entry) for entry in entries)
+        try:
+            for data in vault.api.iter_jobs(vault.name, completed='true', limit=self.page_limit,
+                                            refresh=True):
+                entry = waiting.pop(data.get('JobId'), None)
+                if entry is not None:
+                    self._complete(entry, data)
+                if not waiting:
+                    break
+        except Exception as e:
+            log.error('List jobs of %s failed: %s' % (vault.name, e))
+        now = time.time()
+        with self._cond:
+            for entry in waiting.values():
+                entry.backoff(now)
+
+    def _complete(self, entry, data):
+        job = entry.job
+        with self._cond:
+            self._entries.pop((job.vault.name, job.id), None)
+        try:
+            job._update(data)
+        except Exception:
+            entry.future._set(sys.exc_info()[1])
+            return
+        self._finish(entry)
+
+    @classmethod
+    def _finish(cls, entry):
+        job = entry.job
+        if (job.status_code or '').lower() == 'failed':
+            entry.future._set(DownloadArchiveError('Job process failed: %s' % job.status_message))
+        else:
+            log.info('Job %s completed: %s' % (job.id, job.status_code))
+            entry.future._set()
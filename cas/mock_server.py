@@ -0,0 +1,720 @@
+# -*- coding=UTF-8 -*-
+
+import binascii
+import BaseHTTPServer
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import socket
+import SocketServer
+import string
+import struct
+import threading
+import time
+import urllib
+import urlparse
+
+from cas.client import CASClient
+from cas.conf.common_conf import MEGABYTE
+from cas.utils.file_utils import compute_combine_tree_etag_from_list
+from cas.utils.file_utils import compute_hash_from_content
+
+log = logging.getLogger(__name__)
+
+_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+_CHUNK_SIZE = 64 * 1024
+_UNRESERVED = frozenset(string.ascii_letters + string.digits + '-_.~')
+
+
+def _rfc3986(value):
+    return ''.join(c if c in _UNRESERVED else '%%%02X' % ord(c) for c in value)
+
+
+def _canonical(pairs):
+    """
+    服务端按签名规则独立实现的规范化：key小写后排序，value按RFC 3986编码，拼接为 k1=v1&k2&k3=v3
+    不调用SDK的http_utils，客户端签名实现的回归不会在服务端被同样复现
+    """
+    return '&'.join('%s=%s' % (k, _rfc3986(v)) if v else k
+                    for k, v in sorted((_rfc3986(k.strip().lower()), v) for k, v in pairs))
+
+
+def _now():
+    return time.strftime(_DATE_FORMAT, time.gmtime())
+
+
+def _new_id(nbytes=32):
+    return binascii.hexlify(os.urandom(nbytes))
+
+
+class _ServiceError(Exception):
+
+    def __init__(self, status, code, message, error_type='client'):
+        super(_ServiceError, self).__init__(message)
+        self.status = status
+        self.code = code
+        self.type = error_type
+        self.message = message
+
+
+class _Throttle(object):
+    """
+    所有连接共享的带宽限制，按请求顺序排队
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.time()
+            start = max(self._next, now)
+            self._next = start + float(nbytes) / self.rate
+            delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _Fault(object):
+
+    def __init__(self, fault, times, method, path, probability):
+        self.fault = str(fault)
+        self.times = times
+        self.method = method
+        self.path = re.compile(path) if path else None
+        self.probability = probability
+
+    def match(self, method, path):
+        if self.times is not None and self.times <= 0:
+            return False
+        if self.method is not None and self.method != method:
+            return False
+        if self.path is not None and not self.path.search(path):
+            return False
+        if random.random() >= self.probability:
+            return False
+        if self.times is not None:
+            self.times -= 1
+        return True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockCAS/1.0'
+
+    def log_message(self, fmt, *args):
+        log.debug(fmt % args)
+
+    def do_GET(self):
+        self.server.mock._dispatch(self)
+
+    do_PUT = do_POST = do_DELETE = do_HEAD = do_GET
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        BaseHTTPServer.HTTPServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+        self.connections_cond = threading.Condition()
+
+    def process_request(self, request, client_address):
+        with self.connections_cond:
+            self.connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+        with self.connections_cond:
+            self.connections.discard(request)
+            self.connections_cond.notify_all()
+
+    def close_connections(self, timeout=5):
+        """
+        关闭客户端连接池中保持的长连接，并等待对应的处理线程退出
+        """
+        with self.connections_cond:
+            connections = list(self.connections)
+        for request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        deadline = time.time() + timeout
+        with self.connections_cond:
+            while self.connections and time.time() < deadline:
+                self.connections_cond.wait(deadline - time.time())
+
+    def handle_error(self, request, client_address):
+        # 客户端断开连接属于正常情况，不打印异常
+        log.debug('connection from %s:%d closed' % client_address)
+
+
+class MockCASServer(object):
+    """
+    进程内的模拟CAS服务，实现客户端使用的REST接口：vault、archive、multipart-upload、job及其输出(支持Range)、access-policy
+    校验请求签名与tree hash，数据保存在内存中；可设置延迟、带宽上限，并注入5xx、超时、连接重置与InvalidDigest错误
+    用于在没有网络的环境中测试SDK、稳定地对比吞吐
+    """
+
+    def __init__(self, appid='1250000000', ak='AKIDmockcas', sk='mockcassecretkey', host='127.0.0.1',
+                 port=0, verify_signature=True, latency=0, bandwidth=None, job_delay=0,
+                 timeout_seconds=30):
+        """
+        :param latency: 每个请求处理前的延迟，单位秒
+        :param bandwidth: 上传与下载方向各自的带宽上限，单位字节/秒，为None时不限制
+        :param job_delay: 任务从创建到完成的时间，单位秒；可以为 {tier: 秒数} 的dict
+        :param timeout_seconds: 注入timeout错误时挂起请求的时间
+        """
+        self.appid = str(appid)
+        self.ak = ak
+        self.sk = sk
+        self.verify_signature = verify_signature
+        self.latency = latency
+        self.job_delay = job_delay
+        self.timeout_seconds = timeout_seconds
+        self._upstream = _Throttle(bandwidth)
+        self._downstream = _Throttle(bandwidth)
+        self._faults = []
+        self._lock = threading.RLock()
+        self.vaults = {}        # name -> vault dict，包括archives、uploads、jobs与policy
+        self.stats = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0, 'faults': 0, 'errors': 0}
+        self._httpd = _HTTPServer((host, port), _Handler)
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._httpd.server_address[0]
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    @property
+    def bandwidth(self):
+        return self._upstream.rate
+
+    @bandwidth.setter
+    def bandwidth(self, rate):
+        self._upstream.rate = self._downstream.rate = rate
+
+    def client(self, **kwargs):
+        """
+        返回访问该服务的CASClient
+        """
+        return CASClient(self.host, self.appid, self.ak, self.sk, port=self.port, **kwargs)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.close_connections()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def inject(self, fault, times=1, method=None, path=None, probability=1.0):
+        """
+        注入错误，按注入顺序匹配
+        :param fault: 5xx状态码(如500, 503)、'timeout'(挂起timeout_seconds后断开)、'reset'(读取请求体前以RST断开)
+                      或'InvalidDigest'
+        :param times: 生效次数，为None时一直生效
+        :param method: 只对该HTTP方法生效
+        :param path: 只对路径匹配该正则的请求生效
+        :param probability: 匹配的请求按该概率出错
+        """
+        fault = str(fault)
+        if fault not in ('timeout', 'reset', 'InvalidDigest') and not re.match(r'^5\d\d$', fault):
+            raise ValueError('unsupported fault: %s' % fault)
+        with self._lock:
+            self._faults.append(_Fault(fault, times, method, path, probability))
+
+    def clear_faults(self):
+        with self._lock:
+            self._faults = []
+
+    # 请求处理
+
+    _Routes = (
+        (r'^/vaults$', {'GET': '_list_vaults'}),
+        (r'^/vaults/([^/]+)$', {'PUT': '_create_vault', 'GET': '_describe_vault', 'DELETE': '_delete_vault'}),
+        (r'^/vaults/([^/]+)/archives$', {'POST': '_post_archive'}),
+        (r'^/vaults/([^/]+)/archives/([^/]+)$', {'DELETE': '_delete_archive'}),
+        (r'^/vaults/([^/]+)/multipart-uploads$', {'POST': '_initiate_multipart', 'GET': '_list_multipart'}),
+        (r'^/vaults/([^/]+)/multipart-uploads/([^/]+)$', {'PUT': '_upload_part', 'GET': '_list_parts',
+                                                          'POST': '_complete_multipart',
+                                                          'DELETE': '_abort_multipart'}),
+        (r'^/vaults/([^/]+)/jobs$', {'POST': '_initiate_job', 'GET': '_list_jobs'}),
+        (r'^/vaults/([^/]+)/jobs/([^/]+)$', {'GET': '_describe_job'}),
+        (r'^/vaults/([^/]+)/jobs/([^/]+)/output$', {'GET': '_get_job_output'}),
+        (r'^/vaults/([^/]+)/access-policy$', {'GET': '_get_policy', 'PUT': '_set_policy',
+                                              'DELETE': '_delete_policy'}),
+    )
+
+    def _dispatch(self, handler):
+        method = handler.command
+        path, _, query = handler.path.partition('?')
+        params = dict((k, v[0]) for k, v in urlparse.parse_qs(query, keep_blank_values=True).items())
+        with self._lock:
+            self.stats['requests'] += 1
+            fault = None
+            for rule in self._faults:
+                if rule.match(method, path):
+                    fault = rule.fault
+                    self.stats['faults'] += 1
+                    break
+        if self.latency:
+            time.sleep(self.latency)
+        if fault == 'reset':
+            handler.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            handler.close_connection = 1
+            return
+        body = self._read_body(handler)
+        if fault == 'timeout':
+            time.sleep(self.timeout_seconds)
+            handler.close_connection = 1
+            return
+        try:
+            if fault == 'InvalidDigest':
+                raise _ServiceError(400, 'InvalidDigest', 'injected digest error')
+            if fault is not None:
+                raise _ServiceError(int(fault), 'InternalError', 'injected server error', 'server')
+            if self.verify_signature:
+                self._check_signature(handler, method, path, params)
+            prefix = '/%s/' % self.appid
+            if not path.startswith(prefix):
+                raise _ServiceError(404, 'InvalidAppId', 'appid not found')
+            sub_path = path[len(prefix) - 1:]
+            for pattern, methods in self._Routes:
+                m = re.match(pattern, sub_path)
+                if m is None:
+                    continue
+                if method not in methods:
+                    raise _ServiceError(405, 'MethodNotAllowed', '%s not allowed' % method)
+                args = [urllib.unquote(arg) for arg in m.groups()]
+                result = getattr(self, methods[method])(handler, params, body, *args)
+                break
+            else:
+                raise _ServiceError(404, 'ResourceNotFound', 'unknown resource %s' % path)
+        except Exception as e:
+            if not isinstance(e, _ServiceError):
+                log.exception('%s %s failed' % (method, path))
+                e = _ServiceError(500, 'InternalError', str(e), 'server')
+            with self._lock:
+                self.stats['errors'] += 1
+            result = (e.status, {}, json.dumps({'code': e.code, 'type': e.type, 'message': e.message}),
+                      'application/json')
+        self._send(handler, *result)
+
+    def _read_body(self, handler):
+        length = int(handler.headers.getheader('content-length') or 0)
+        chunks = []
+        while length > 0:
+            data = handler.rfile.read(min(length, _CHUNK_SIZE))
+            if not data:
+                break
+            self._upstream.consume(len(data))
+            chunks.append(data)
+            length -= len(data)
+        body = ''.join(chunks)
+        with self._lock:
+            self.stats['bytes_in'] += len(body)
+        return body
+
+    def _send(self, handler, status, headers=None, body='', content_type=None):
+        handler.send_response(status)
+        handler.send_header('x-cas-requestid', _new_id(16))
+        for k, v in (headers or {}).items():
+            handler.send_header(k, v)
+        if body and content_type:
+            handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if handler.command == 'HEAD':
+            return
+        for pos in xrange(0, len(body), _CHUNK_SIZE):
+            chunk = buffer(body, pos, _CHUNK_SIZE)
+            self._downstream.consume(len(chunk))
+            handler.wfile.write(chunk)
+        with self._lock:
+            self.stats['bytes_out'] += len(body)
+
+    def _check_signature(self, handler, method, path, params):
+        auth = dict(item.partition('=')[::2] for item in
+                    (handler.headers.getheader('authorization') or '').split('&'))
+        if auth.get('q-ak') != self.ak:
+            raise _ServiceError(403, 'InvalidAccessKeyId', 'unknown access key')
+        try:
+            start, end = [int(t) for t in auth['q-sign-time'].split(';')]
+        except (KeyError, ValueError):
+            raise _ServiceError(403, 'AuthFailure', 'invalid q-sign-time')
+        if not start <= time.time() <= end:
+            raise _ServiceError(403, 'RequestTimeTooSkewed', 'signature expired')
+        headers = dict((k, handler.headers.getheader(k) or '')
+                       for k in auth.get('q-header-list', '').split(';') if k)
+        signed_params = dict((k, params.get(k, '').lower()) for k in auth.get('q-url-param-list', '').split(';') if k)
+        format_string = '%s\n%s\n%s\n%s\n' % (method.lower(), path, _canonical(signed_params.items()),
+                                                 _canonical(headers.items()))
+        string_to_sign = 'sha1\n%s\n%s\n' % (auth['q-sign-time'], hashlib.sha1(format_string).hexdigest())
+        sign_key = hmac.new(self.sk, auth.get('q-key-time', ''), hashlib.sha1).hexdigest()
+        expected = hmac.new(sign_key, string_to_sign, hashlib.sha1).hexdigest()
+        if expected != auth.get('q-signature'):
+            raise _ServiceError(403, 'SignatureDoesNotMatch', 'signature does not match')
+
+    @classmethod
+    def _json(cls, status, data, headers=None):
+        return status, headers or {}, json.dumps(data), 'application/json'
+
+    @classmethod
+    def _page(cls, items, key, params, limit=1000):
+        """
+        按key排序后从marker开始取limit个，返回 (本页, 下一页marker)
+        """
+        items = sorted(items, key=key)
+        marker = params.get('marker')
+        if marker:
+            items = [item for item in items if key(item) >= marker]
+        limit = int(params.get('limit') or limit)
+        if len(items) > limit:
+            return items[:limit], key(items[limit])
+        return items, None
+
+    def _vault(self, name):
+        vault = self.vaults.get(name)
+        if vault is None:
+            raise _ServiceError(404, 'VaultNotExist', 'vault %s not exists' % name)
+        return vault
+
+    def _vault_qcs(self, name):
+        return 'qcs::cas:mock:uid/%s:vault/%s' % (self.appid, name)
+
+    def _vault_info(self, vault):
+        return {'VaultName': vault['name'],
+                'VaultQCS': self._vault_qcs(vault['name']),
+                'CreationDate': vault['created'],
+                'LastInventoryDate': vault['inventory_date'],
+                'NumberOfArchives': len(vault['archives']),
+                'SizeInBytes': sum(len(a['data']) for a in vault['archives'].values())}
+
+    # vault
+
+    def _list_vaults(self, handler, params, body):
+        with self._lock:
+            vaults, marker = self._page(self.vaults.values(), lambda v: v['name'], params)
+            return self._json(200, {'Marker': marker, 'VaultList': [self._vault_info(v) for v in vaults]})
+
+    def _create_vault(self, handler, params, body, name):
+        with self._lock:
+            if name not in self.vaults:
+                self.vaults[name] = {'name': name, 'created': _now(), 'inventory_date': None, 'archives': {},
+                                     'uploads': {}, 'jobs': {}, 'policy': None}
+        return 201, {'Location': '/%s/vaults/%s' % (self.appid, name)}, ''
+
+    def _describe_vault(self, handler, params, body, name):
+        with self._lock:
+            return self._json(200, self._vault_info(self._vault(name)))
+
+    def _delete_vault(self, handler, params, body, name):
+        with self._lock:
+            if self._vault(name)['archives']:
+                raise _ServiceError(409, 'VaultNotEmpty', 'vault %s is not empty' % name)
+            del self.vaults[name]
+        return 204, {}, ''
+
+    # archive
+
+    def _check_digest(self, handler, data):
+        etag, tree_etag = compute_hash_from_content(data)
+        if handler.headers.getheader('x-cas-content-sha256') != etag or \
+                handler.headers.getheader('x-cas-sha256-tree-hash') != tree_etag:
+            raise _ServiceError(400, 'InvalidDigest', 'content sha256 or tree hash does not match')
+        return tree_etag
+
+    def _add_archive(self, vault, data, tree_etag, desc):
+        archive_id = _new_id()
+        vault['archives'][archive_id] = {'id': archive_id, 'data': data, 'tree_etag': tree_etag,
+                                         'desc': desc, 'created': _now()}
+        return 201, {'x-cas-archive-id': archive_id,
+                     'Location': '/%s/vaults/%s/archives/%s' % (self.appid, vault['name'], archive_id)}, ''
+
+    def _post_archive(self, handler, params, body, name):
+        if not body:
+            raise _ServiceError(400, 'InvalidParameter', 'empty archive')
+        tree_etag = self._check_digest(handler, body)
+        with self._lock:
+            return self._add_archive(self._vault(name), body, tree_etag,
+                                     handler.headers.getheader('x-cas-archive-description'))
+
+    def _delete_archive(self, handler, params, body, name, archive_id):
+        with self._lock:
+            if self._vault(name)['archives'].pop(archive_id, None) is None:
+                raise _ServiceError(404, 'ArchiveNotExist', 'archive %s not exists' % archive_id)
+        return 204, {}, ''
+
+    # multipart upload
+
+    def _upload(self, name, upload_id):
+        upload = self._vault(name)['uploads'].get(upload_id)
+        if upload is None:
+            raise _ServiceError(404, 'UploadIdNotFound', 'upload %s not exists' % upload_id)
+        return upload
+
+    def _upload_info(self, name, upload):
+        return {'ArchiveDescription': upload['desc'],
+                'CreationDate': upload['created'],
+                'MultipartUploadId': upload['id'],
+                'PartSizeInBytes': upload['part_size'],
+                'VaultQCS': self._vault_qcs(name)}
+
+    def _initiate_multipart(self, handler, params, body, name):
+        try:
+            part_size = int(handler.headers.getheader('x-cas-part-size'))
+        except (TypeError, ValueError):
+            raise _ServiceError(400, 'InvalidParameter', 'invalid x-cas-part-size')
+        if part_size <= 0 or part_size % MEGABYTE != 0:
+            raise _ServiceError(400, 'InvalidParameter', 'part size must be a multiple of 1MB')
+        with self._lock:
+            vault = self._vault(name)
+            upload_id = _new_id()
+            vault['uploads'][upload_id] = {'id': upload_id, 'part_size': part_size, 'parts': {},
+                                           'desc': handler.headers.getheader('x-cas-archive-description'),
+                                           'created': _now()}
+        return 201, {'x-cas-multipart-upload-id': upload_id,
+                     'Location': '/%s/vaults/%s/multipart-uploads/%s' % (self.appid, name, upload_id)}, ''
+
+    def _list_multipart(self, handler, params, body, name):
+        with self._lock:
+            uploads, marker = self._page(self._vault(name)['uploads'].values(), lambda u: u['id'], params)
+            return self._json(200, {'Marker': marker,
+                                    'UploadsList': [self._upload_info(name, u) for u in uploads]})
+
+    def _upload_part(self, handler, params, body, name, upload_id):
+        m = re.match(r'^bytes (\d+)-(\d+)/', handler.headers.getheader('content-range') or '')
+        if m is None:
+            raise _ServiceError(400, 'InvalidParameter', 'invalid Content-Range')
+        start, end = int(m.group(1)), int(m.group(2))
+        with self._lock:
+            part_size = self._upload(name, upload_id)['part_size']
+        if start % part_size != 0 or end - start + 1 > part_size or end - start + 1 != len(body):
+            raise _ServiceError(400, 'InvalidParameter', 'range %d-%d does not match part size' % (start, end))
+        tree_etag = self._check_digest(handler, body)
+        with self._lock:
+            self._upload(name, upload_id)['parts'][(start, end)] = (body, tree_etag)
+        return 204, {'x-cas-sha256-tree-hash': tree_etag}, ''
+
+    def _list_parts(self, handler, params, body, name, upload_id):
+        with self._lock:
+            upload = self._upload(name, upload_id)
+            ranges, marker = self._page(upload['parts'].keys(), lambda r: '%020d' % r[0], params)
+            data = self._upload_info(name, upload)
+            data['Marker'] = marker
+            data['Parts'] = [{'RangeInBytes': '%d-%d' % r, 'SHA256TreeHash': upload['parts'][r][1]}
+                             for r in ranges]
+            return self._json(200, data)
+
+    def _complete_multipart(self, handler, params, body, name, upload_id):
+        with self._lock:
+            upload = self._upload(name, upload_id)
+            ranges = sorted(upload['parts'])
+        pos = 0
+        for start, end in ranges:
+            if start != pos:
+                raise _ServiceError(400, 'InvalidParameter', 'missing part at %d' % pos)
+            pos = end + 1
+        size = handler.headers.getheader('x-cas-archive-size')
+        if size is None or int(size) != pos:
+            raise _ServiceError(400, 'InvalidParameter', 'archive size %s does not match %d' % (size, pos))
+        tree_etag = compute_combine_tree_etag_from_list(
+            [binascii.unhexlify(upload['parts'][r][1]) for r in ranges])
+        if handler.headers.getheader('x-cas-sha256-tree-hash') != tree_etag:
+            raise _ServiceError(400, 'InvalidDigest', 'tree hash does not match')
+        data = ''.join(upload['parts'][r][0] for r in ranges)
+        with self._lock:
+            vault = self._vault(name)
+            vault['uploads'].pop(upload_id, None)
+            return self._add_archive(vault, data, tree_etag, upload['desc'])
+
+    def _abort_multipart(self, handler, params, body, name, upload_id):
+        with self._lock:
+            self._upload(name, upload_id)
+            del self._vault(name)['uploads'][upload_id]
+        return 204, {}, ''
+
+    # job
+
+    def _job_delay(self, tier):
+        if isinstance(self.job_delay, dict):
+            return self.job_delay.get(tier or 'Standard', 0)
+        return self.job_delay
+
+    def _job(self, name, job_id):
+        job = self._vault(name)['jobs'].get(job_id)
+        if job is None:
+            raise _ServiceError(404, 'JobNotExist', 'job %s not exists' % job_id)
+        if not job['info']['Completed'] and time.time() >= job['ready_at']:
+            job['info'].update({'Completed': True, 'StatusCode': 'Succeeded',
+                                'StatusMessage': 'Succeeded', 'CompletionDate': _now()})
+        return job
+
+    def _initiate_job(self, handler, params, body, name):
+        try:
+            request = json.loads(body)
+        except ValueError:
+            raise _ServiceError(400, 'InvalidParameter', 'invalid job request body')
+        job_type = request.get('Type')
+        tier = request.get('Tier') or 'Standard'
+        info = {'JobId': _new_id(), 'JobDescription': request.get('Description'), 'CreationDate': _now(),
+                'Completed': False, 'CompletionDate': None, 'StatusCode': 'InProgress',
+                'StatusMessage': None, 'Tier': tier, 'VaultQCS': self._vault_qcs(name),
+                'ArchiveSizeInBytes': 0, 'InventorySizeInBytes': 0}
+        with self._lock:
+            vault = self._vault(name)
+            if job_type == 'archive-retrieval':
+                archive = vault['archives'].get(request.get('ArchiveId'))
+                if archive is None:
+                    raise _ServiceError(404, 'ArchiveNotExist', 'archive %s not exists' % request.get('ArchiveId'))
+                size = len(archive['data'])
+                try:
+                    start, end = [int(v) for v in (request.get('RetrievalByteRange') or '0-%d' % (size - 1)).split('-')]
+                except ValueError:
+                    raise _ServiceError(400, 'InvalidParameter', 'invalid RetrievalByteRange')
+                if not 0 <= start <= end < size or start % MEGABYTE != 0 or \
+                        (end + 1 != size and (end + 1) % MEGABYTE != 0):
+                    raise _ServiceError(400, 'InvalidParameter', 'RetrievalByteRange must be aligned to 1MB')
+                output = archive['data'][start:end + 1]
+                info.update({'Action': 'ArchiveRetrieval', 'ArchiveId': archive['id'],
+                             'ArchiveSizeInBytes': size,
+                             'ArchiveSHA256TreeHash': archive['tree_etag'],
+                             'RetrievalByteRange': '%d-%d' % (start, end),
+                             'SHA256TreeHash': archive['tree_etag'] if (start, end) == (0, size - 1)
+                             else compute_hash_from_content(output)[1]})
+            elif job_type == 'inventory-retrieval':
+                vault['inventory_date'] = _now()
+                output = json.dumps({'VaultQCS': self._vault_qcs(name), 'InventoryDate': vault['inventory_date'],
+                                     'ArchiveList': [{'ArchiveId': a['id'], 'ArchiveDescription': a['desc'],
+                                                      'CreationDate': a['created'], 'Size': len(a['data']),
+                                                      'SHA256TreeHash': a['tree_etag']}
+                                                     for a in sorted(vault['archives'].values(),
+                                                                     key=lambda a: a['created'])]})
+                info.update({'Action': 'InventoryRetrieval', 'InventorySizeInBytes': len(output),
+                             'InventoryRetrievalParameters': dict(
+                                 {'Format': 'JSON', 'Limit': None, 'Marker': None},
+                                 **(request.get('InventoryRetrievalParameters') or {}))})
+            else:
+                raise _ServiceError(400, 'InvalidParameter', 'unsupported job type %s' % job_type)
+            vault['jobs'][info['JobId']] = {'info': info, 'output': output,
+                                            'ready_at': time.time() + self._job_delay(tier)}
+        return 202, {'x-cas-job-id': info['JobId'],
+                     'Location': '/%s/vaults/%s/jobs/%s' % (self.appid, name, info['JobId'])}, ''
+
+    def _list_jobs(self, handler, params, body, name):
+        with self._lock:
+            jobs = [self._job(name, job_id)['info'] for job_id in self._vault(name)['jobs']]
+            completed = params.get('completed')
+            if completed:
+                jobs = [job for job in jobs if job['Completed'] == (completed.lower() == 'true')]
+            if params.get('statuscode'):
+                jobs = [job for job in jobs if job['StatusCode'].lower() == params['statuscode'].lower()]
+            jobs, marker = self._page(jobs, lambda job: job['JobId'], params)
+            return self._json(200, {'Marker': marker, 'JobList': jobs})
+
+    def _describe_job(self, handler, params, body, name, job_id):
+        with self._lock:
+            return self._json(200, self._job(name, job_id)['info'])
+
+    def _get_job_output(self, handler, params, body, name, job_id):
+        with self._lock:
+            job = self._job(name, job_id)
+        if not job['info']['Completed']:
+            raise _ServiceError(400, 'JobNotReady', 'job %s in progress' % job_id)
+        output = job['output']
+        headers = {}
+        status = 200
+        m = re.match(r'^bytes=(\d+)-(\d+)$', handler.headers.getheader('range') or '')
+        start, end = 0, len(output) - 1
+        if m is not None:
+            start, end = int(m.group(1)), min(int(m.group(2)), len(output) - 1)
+            if start > end:
+                raise _ServiceError(416, 'InvalidRange', 'invalid range')
+            status = 206
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, len(output))
+        data = output[start:end + 1]
+        if job['info']['Action'] == 'ArchiveRetrieval':
+            content_type = 'application/octet-stream'
+            # 按1MB对齐的范围可以校验tree hash
+            if start % MEGABYTE == 0 and ((end + 1) % MEGABYTE == 0 or end == len(output) - 1):
+                headers['x-cas-sha256-tree-hash'] = compute_hash_from_content(data)[1]
+        else:
+            content_type = 'application/json'
+        return status, headers, data, content_type
+
+    # access policy
+
+    def _get_policy(self, handler, params, body, name):
+        with self._lock:
+            policy = self._vault(name)['policy']
+        if policy is None:
+            raise _ServiceError(404, 'PolicyNotExist', 'vault %s has no access policy' % name)
+        return self._json(200, {'Policy': policy})
+
+    def _set_policy(self, handler, params, body, name):
+        try:
+            policy = json.loads(body)['policy']
+        except (ValueError, KeyError):
+            raise _ServiceError(400, 'InvalidParameter', 'invalid access policy')
+        with self._lock:
+            self._vault(name)['policy'] = policy
+        return 204, {}, ''
+
+    def _delete_policy(self, handler, params, body, name):
+        with self._lock:
+            self._vault(name)['policy'] = None
+        return 204, {}, ''
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='local mock CAS server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--appid', default='1250000000')
+    parser.add_argument('--secretid', default='AKIDmockcas')
+    parser.add_argument('--secretkey', default='mockcassecretkey')
+    parser.add_argument('--latency', type=float, default=0, help='delay of each request in seconds')
+    parser.add_argument('--bandwidth', type=int, help='bytes per second of each direction')
+    parser.add_argument('--job-delay', type=float, default=0, help='seconds before a job completes')
+    args = parser.parse_args()
+
+    server = MockCASServer(args.appid, args.secretid, args.secretkey, host=args.host, port=args.port,
+                           latency=args.latency, bandwidth=args.bandwidth, job_delay=args.job_delay)
+    print 'Mock CAS server on %s:%d, appid %s, secretid %s, secretkey %s' % (
+        server.host, server.port, args.appid, args.secretid, args.secretkey)
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -5,6 +5,7 @@ from __future__ import division
 import sys
 import logging
 import random
+import threading
 import time
 import cas.conf.common_conf
 
@@ -16,6 +17,14 @@ from multiprocessing.pool import ThreadPool
 
 from cas.utils.merkle import *
 from cas.utils.file_utils import *
+from cas.utils.buffer_utils import BufferPool
+from cas.utils import hash_cache
+from cas.utils.hash_cache import file_identity
+from cas.utils.journal import UploadJournal
+from cas.utils.concurrency import AdaptiveConcurrency
+from cas.utils.metrics import part_metrics
+from cas.utils.request_hooks import retry_context
+from cas.utils.tracer import NULL_TRACER
 from cas.conf.common_conf import MEGABYTE
 from cas.conf.common_conf import GIGABYTE
 from cas.conf import multi_task_conf
@@ -32,6 +41,12 @@ class MultipartUpload(object):
     _MaximumNumberOfParts = cas.conf.common_conf.Multipart_Upload_MaximumNumberOfParts
     _NumberThread = multi_task_conf.MultipartUpload_NumberThread
     _NumberRetry = multi_task_conf.MultipartUpload_NumberRetry
+    _StartupDelay = multi_task_conf.MultipartUpload_StartupDelay
+    _Pipeline = multi_task_conf.MultipartUpload_Pipeline
+    _NumberBuffer = multi_task_conf.MultipartUpload_NumberBuffer
+    _Adaptive = multi_task_conf.Adaptive_Concurrency
+    _Journal = multi_task_conf.MultipartUpload_Journal
+    _VerifySample = multi_task_conf.MultipartUpload_VerifySample
 
     ResponseDataParser = (('ArchiveDescription', 'description', None),
                           ('CreationDate', 'creation_date', None),
@@ -46,6 +61,7 @@ class MultipartUpload(object):
         self.parts = OrderedDict()
         self.file_path = file_path
         self.size_total = 0
+        self._journal = None
         if self.file_path is not None:
             self._prepare(self.file_path)
 
@@ -92,77 +108,195 @@ class MultipartUpload(object):
         for byte_range in calc_ranges(self.part_size, self.size_total):
             self.parts[byte_range] = None
 
-    def resume(self, file_path):
+    def _open_journal(self):
+        """
+        打开本地的分片记录，返回其中已完成的分片 {byte_range: (etag, tree_etag)}
+        记录不可用时只打印警告，上传照常进行
+        """
+        if not self._Journal or self._journal is not None:
+            return {}
+        try:
+            f = open_file(self.file_path)
+            with f:
+                identity = file_identity(f)
+            journal = UploadJournal(self.id, identity, self.parts.keys())
+            entries = journal.load()
+        except (IOError, OSError) as e:
+            log.warning('Upload journal of %s unavailable: %s' % (self.id, e))
+            return {}
+        self._journal = journal
+        return entries
+
+    def resume(self, file_path, verify_sample=None, threads=None, **kwargs):
+        """
+        与服务端的分片列表对比续传。本地记录中tree etag与服务端一致的分片不再读取文件，其余分片并行重新计算hash校验
+        :param verify_sample: 从本地记录可信的分片中随机抽取该比例重新计算hash校验，默认取multi_task_conf
+        其余参数与start相同
+        """
+        if verify_sample is None:
+            verify_sample = self._VerifySample
+        threads = threads or self._NumberThread
         self._prepare(file_path)
-        result = self.vault.api.list_all_parts(self.vault.name, self.id)
-
-        for part in result['Parts']:
-            byte_range = self.parse_range_from_str(part['RangeInBytes'])
-            self.parts[byte_range] = part['SHA256TreeHash']
-            tree_etag = compute_tree_etag_from_file(
-                self.file_path, offset=byte_range[0],
-                size=range_size(byte_range))
-            if tree_etag != self.parts[byte_range]:
-                raise HashDoesNotMatchError(
-                    'Hash does not match for %d-%d: %s, which %s excepted' %
-                    (byte_range[0], byte_range[1], tree_etag,
-                     self.parts[byte_range]))
-
-        return self.start()
-
-    def start(self):
+        local = self._open_journal()
+        # 校验通过后由start重新打开记录；校验失败抛出异常时记录文件也要关闭
+        try:
+            result = self.vault.api.list_all_parts(self.vault.name, self.id, refresh=True)
+
+            uploaded = OrderedDict()
+            for part in result['Parts']:
+                uploaded[self.parse_range_from_str(part['RangeInBytes'])] = part['SHA256TreeHash']
+            trusted = [byte_range for byte_range, tree_etag in uploaded.items()
+                       if byte_range in local and local[byte_range][1] == tree_etag]
+            verify = set(random.sample(trusted, int(math.ceil(len(trusted) * verify_sample))))
+            trusted = set(trusted) - verify
+            log.info('Resume %s: %d parts uploaded, %d trusted from journal.' %
+                     (self.id, len(uploaded), len(trusted)))
+
+            for byte_range, expected in uploaded.items():
+                self.parts[byte_range] = expected
+
+            def hash_part(byte_range):
+                return compute_hash_from_file(self.file_path, offset=byte_range[0],
+                                              size=range_size(byte_range))
+
+            to_verify = [byte_range for byte_range in uploaded if byte_range not in trusted]
+            if to_verify:
+                pool = ThreadPool(processes=min(threads, len(to_verify)))
+                hashes = pool.map(hash_part, to_verify)
+                pool.close()
+            else:
+                hashes = []
+            for byte_range, (etag, tree_etag) in zip(to_verify, hashes):
+                expected = uploaded[byte_range]
+                if tree_etag != expected:
+                    raise HashDoesNotMatchError(
+                        'Hash does not match for %d-%d: %s, which %s excepted' %
+                        (byte_range[0], byte_range[1], tree_etag, expected))
+                if self._journal is not None and local.get(byte_range) != (etag, tree_etag):
+                    self._journal.append(byte_range, (etag, tree_etag))
+        finally:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+        return self.start(threads=threads, **kwargs)
+
+    def start(self, pipeline=None, adaptive=None, threads=None, progress=None, tracer=None):
+        """
+        :param pipeline: 为True时每个分片只读取一次到复用的缓冲区中，在内存中计算hash并发送，默认取multi_task_conf
+        :param adaptive: 为True时由AIMD控制器根据吞吐、延迟与错误率动态调整同时上传的分片数，默认取multi_task_conf
+        :param threads: 上传线程数，默认取multi_task_conf
+        :param progress: 每个分片上传成功后以 (已完成字节数, 总字节数) 调用
+        :param tracer: 记录每个分片各阶段耗时的Tracer，见cas.utils.tracer
+        """
+        if pipeline is None:
+            pipeline = self._Pipeline
+        if adaptive is None:
+            adaptive = self._Adaptive
+        threads = threads or self._NumberThread
+        buffer_pool = BufferPool(self.part_size, self._NumberBuffer) if pipeline else None
+        controller = AdaptiveConcurrency(threads) if adaptive else None
+        tracer = tracer or NULL_TRACER
+        progress_lock = threading.Lock()
+        completed = [self.size_completed]
+
+        def send_part(byte_range, etag, tree_etag, send):
+            for cnt in xrange(self._NumberRetry):
+                started = None
+                if controller:
+                    with tracer.span('wait-slot'):
+                        started = controller.acquire()
+                part = part_metrics.start('upload')
+                nbytes, congested = 0, False
+                try:
+                    with retry_context(cnt), tracer.span('retry' if cnt else 'attempt', attempt=cnt):
+                        send()
+                    nbytes = range_size(byte_range)
+                    self.parts[byte_range] = tree_etag
+                    if self._journal is not None:
+                        self._journal.append(byte_range, (etag, tree_etag))
+                    if progress is not None:
+                        with progress_lock:
+                            completed[0] += nbytes
+                            progress(completed[0], self.size_total)
+                    log.info('Range %d-%d upload success.' % byte_range)
+                    return
+                except CASServerError as e:
+                    congested = e.status // 100 == 5
+                    log.error('upload %s range %d-%d upload failed. etag: %s. Reason: %s' %
+                              (self.id, byte_range[0], byte_range[1], etag, e))
+                    if e.code != 'InvalidDigest' or e.type != 'client':
+                        return
+                except IOError as e:
+                    congested = True
+                    log.error('uploadid %s range %d-%d upload failed. Reason: %s' %
+                              (self.id, byte_range[0], byte_range[1], e))
+                    continue
+                except Exception as e:
+                    congested = True
+                    log.error('upload %s range %d-%d upload failed. etag: %s. Error: %s' %
+                              (self.id, byte_range[0], byte_range[1], etag, e))
+                    continue
+                finally:
+                    part_metrics.finish(part, nbytes)
+                    if controller:
+                        controller.release(started, nbytes, congested)
+
+        def upload_part_from_file(f, byte_range):
+            offset = byte_range[0]
+            size = range_size(byte_range)
+            # 非pipeline模式下读取与hash在同一遍完成
+            with tracer.span('read+hash'):
+                etag, tree_etag = compute_hash_from_file_obj(f, offset=offset, size=size)
+
+            def send():
+                # 直接传入文件对象，明文连接时由sendfile在内核中完成发送
+                f.seek(offset)
+                if size > content_length(f):
+                    raise ValueError('Byte range exceeded : %d-%d', byte_range)
+                self.vault.api.post_multipart_from_reader(self.vault.name, self.id, f, size,
+                                                          '%d-%d' % byte_range, etag, tree_etag)
+            send_part(byte_range, etag, tree_etag, send)
+
+        def upload_part_from_buffer(f, byte_range):
+            with tracer.span('wait-buffer'):
+                buf = buffer_pool.acquire()
+            try:
+                with tracer.span('read'):
+                    content = read_file_into(f, buf, byte_range[0], range_size(byte_range))
+                with tracer.span('hash'):
+                    etag, tree_etag = hash_cache.lookup(f, byte_range[0], range_size(byte_range))
+                    if etag is None or tree_etag is None:
+                        etag, tree_etag = compute_hash_from_content(content)
+                        hash_cache.store(f, byte_range[0], range_size(byte_range), etag, tree_etag)
+                send_part(byte_range, etag, tree_etag,
+                          lambda: self.vault.api.post_multipart(self.vault.name, self.id, content,
+                                                                '%d-%d' % byte_range, etag, tree_etag))
+            finally:
+                buffer_pool.release(buf)
+
         def upload_part(byte_range):
             try:
-                time.sleep(random.randint(256, 4096) / 1000)
-                offset = byte_range[0]
-                size = range_size(byte_range)
-                etag = compute_etag_from_file(self.file_path, offset=offset, size=size)
-                tree_etag = compute_tree_etag_from_file(self.file_path, offset=offset, size=size)
-
-                f = open_file(self.file_path)
-                with f:
-                    for cnt in xrange(self._NumberRetry):
-                        try:
-                            if self.part_size % mmap.ALLOCATIONGRANULARITY == 0:
-                                target = mmap.mmap(f.fileno(), length=size,
-                                                   offset=offset,
-                                                   access=mmap.ACCESS_READ)
-                            else:
-                                f.seek(offset)
-                                target = f
-
-                            if range_size(byte_range) > content_length(target):
-                                raise ValueError('Byte range exceeded : %d-%d', byte_range)
-                            self.vault.api.post_multipart_from_reader(self.vault.name, self.id, target,
-                                                                      range_size(byte_range), '%d-%d' % byte_range,
-                                                                      etag, tree_etag)
-                            self.parts[byte_range] = tree_etag
-                            log.info('Range %d-%d upload success.' % byte_range)
-                            return
-                        except CASServerError as e:
-                            log.error('upload %s range %d-%d upload failed. etag: %s. Reason: %s' %
-                                      (self.id, byte_range[0], byte_range[1], etag, e))
-                            if e.code != 'InvalidDigest' or e.type != 'client':
-                                return
-                        except IOError as e:
-                            log.error('uploadid %s range %d-%d upload failed. Reason: %s' %
-                                      (self.id, byte_range[0], byte_range[1], e))
-                            continue
-                        except Exception as e:
-                            log.error('upload %s range %d-%d upload failed. etag: %s. Error: %s' %
-                                      (self.id, byte_range[0], byte_range[1], etag, e))
-                            continue
-                        finally:
-                            if 'target' in locals() and target is not f:
-                                target.close()
+                with tracer.activate(), tracer.span('part', range='%d-%d' % byte_range):
+                    if self._StartupDelay:
+                        with tracer.span('startup-sleep'):
+                            time.sleep(random.uniform(*self._StartupDelay))
+                    f = open_file(self.file_path)
+                    with f:
+                        if pipeline:
+                            upload_part_from_buffer(f, byte_range)
+                        else:
+                            upload_part_from_file(f, byte_range)
             except Exception as e:
                 log.error('Upload %s range %d-%d upload finally failed. Reason: %s' %
                                (self.id, byte_range[0], byte_range[1], e))
                 raise
 
         log.info('Start upload %s from %s.' % (self.id, self.file_path))
+        self._open_journal()
+        tracer.attach()
         try:
-            pool = ThreadPool(processes=min(self._NumberThread, len(self.parts)))
+            pool = ThreadPool(processes=min(threads, len(self.parts)))
             pool.map(upload_part, [byte_range
                                    for byte_range, tag in self.parts.items()
                                    if tag is None])
@@ -176,6 +310,8 @@ class MultipartUpload(object):
                 self.tree_hash)
             log.debug('debug: send complete part res: %s\n' % response)
             log.info('Upload %s finish.' % (self.id))
+            if self._journal is not None:
+                self._journal.remove()
             return response.get('x-cas-archive-id')
         except UploadArchiveError as e:
             error_info = 'upload %s failed, cause:%s' % (self.id, e)
@@ -185,6 +321,11 @@ class MultipartUpload(object):
             error_info = 'upload %s failed, cause:%s' % (self.id, e)
             log.error(error_info)
             raise ValueError(error_info)
+        finally:
+            tracer.detach()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
 
     def cancel(self):
         return self.vault.api.abort_multipart_upload(self.vault.name, self.id)
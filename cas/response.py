@@ -6,7 +6,10 @@ import yaml
 
 
 class CASResponse(dict):
-    def __init__(self, http_response):
+    def __init__(self, http_response, stream=False):
+        """
+        :param stream: 为True时不读取响应体，由调用方通过read逐段读取
+        """
         super(dict, self).__init__()
         raw_headers = http_response.getheaders()
         headers = dict()
@@ -21,7 +24,7 @@ class CASResponse(dict):
             self[k] = v
 
         content_type = headers.get('content-type')
-        if content_type == 'application/octet-stream':
+        if stream or content_type == 'application/octet-stream':
             self.reader = http_response
             return
 
@@ -41,3 +44,9 @@ class CASResponse(dict):
 
     def read(self, size):
         return self.reader.read(size)
+
+    def close(self):
+        """
+        关闭响应；未读完的连接不能复用，由连接池关闭
+        """
+        self.response.close()
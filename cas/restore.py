@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sys
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from cas.conf import multi_task_conf
+from cas.job_watcher import JobFuture
+from cas.job_watcher import JobWatcher
+from cas.utils.concurrency import ByteSemaphore
+from cas.utils.file_utils import range_size
+
+log = logging.getLogger(__name__)
+
+
+class RestorePipeline(object):
+    """
+    批量取回archive：提交archive-retrieval任务后交给JobWatcher等待，任务完成即在共享的下载线程池中
+    调用download_to_file写入本地文件，等待中的任务与已完成任务的下载同时进行
+    同时下载的archive总大小不超过max_bytes
+    """
+
+    _NumberDownload = multi_task_conf.Restore_NumberDownload
+    _MaxBytes = multi_task_conf.Restore_MaxBytes
+
+    def __init__(self, watcher=None, downloads=None, max_bytes=-1, threads=None,
+                 part_size=None, progress=None):
+        """
+        :param watcher: 共享的JobWatcher，为None时新建并在close时关闭
+        :param downloads: 同时下载的archive数目，默认取multi_task_conf
+        :param max_bytes: 同时下载的archive总大小上限，为None时不限制，默认取multi_task_conf
+        :param threads, part_size: 传给每个Job.download_to_file
+        :param progress: 以(job, completed, total)为参数调用的下载进度回调
+        """
+        self._own_watcher = watcher is None
+        self.watcher = watcher or JobWatcher()
+        self.threads = threads
+        self.part_size = part_size
+        self.progress = progress
+        self._budget = ByteSemaphore(self._MaxBytes if max_bytes == -1 else max_bytes)
+        self._pool = ThreadPool(processes=downloads or self._NumberDownload)
+        self._futures = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def restore(self, vault, archive_id, file_path, desc=None, byte_range=None, tier=None):
+        """
+        提交archive-retrieval任务，任务完成后下载到file_path
+        :return: JobFuture，下载完成后result返回Job
+        """
+        job = vault.retrieve_archive(archive_id, desc=desc, byte_range=byte_range, tier=tier)
+        log.info('Restore archive %s by job %s' % (archive_id, job.id))
+        return self.add_job(job, file_path)
+
+    def add_job(self, job, file_path):
+        """
+        等待已提交的任务完成后下载到file_path
+        :return: JobFuture，下载完成后result返回Job
+        """
+        future = JobFuture(job)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('RestorePipeline closed')
+            self._futures.append(future)
+        self.watcher.watch(job, lambda f: self._on_job_done(f, future, file_path))
+        return future
+
+    def wait(self, futures=None, timeout=None):
+        """
+        等待futures(默认为所有已提交的任务)下载完成，返回对应的Job列表；任一任务失败时抛出其异常
+        """
+        if futures is None:
+            with self._lock:
+                futures = list(self._futures)
+        return self.watcher.wait(futures, timeout)
+
+    def close(self):
+        """
+        等待已开始的下载结束后释放线程池，尚未开始下载的任务的future以RuntimeError结束
+        """
+        with self._lock:
+            self._closed = True
+        if self._own_watcher:
+            self.watcher.close()
+        self._pool.close()
+        self._pool.join()
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future._set(RuntimeError('RestorePipeline closed before job %s was downloaded' % future.job.id))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _on_job_done(self, job_future, future, file_path):
+        exception = job_future.exception()
+        if exception is not None:
+            future._set(exception)
+            return
+        # 与close互斥，关闭后不再向线程池提交下载
+        with self._lock:
+            if not self._closed:
+                self._pool.apply_async(self._download, (future, file_path))
+                return
+        future._set(RuntimeError('RestorePipeline closed before job %s was downloaded' % future.job.id))
+
+    def _download(self, future, file_path):
+        job = future.job
+        nbytes = range_size(job._parse_job_range())
+        progress = None
+        if self.progress is not None:
+            progress = lambda completed, total: self.progress(job, completed, total)
+        self._budget.acquire(nbytes)
+        try:
+            directory = os.path.dirname(file_path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            job.download_to_file(file_path, block=False, part_size=self.part_size,
+                                 threads=self.threads, progress=progress)
+        except Exception:
+            log.error('Download job %s to %s failed: %s' % (job.id, file_path, sys.exc_info()[1]))
+            future._set(sys.exc_info()[1])
+            return
+        finally:
+            self._budget.release(nbytes)
+        log.info('Archive %s restored to %s' % (job.archive_id, file_path))
+        future._set()
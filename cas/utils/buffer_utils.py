@@ -0,0 +1,72 @@
+# -*- coding=UTF-8 -*-
+
+import Queue
+import threading
+
+def is_buffer(obj):
+    """
+    是否支持buffer协议 (str, bytearray, memoryview, mmap, array等)
+    """
+    if isinstance(obj, memoryview):
+        return True
+    if isinstance(obj, unicode):
+        return False
+    try:
+        buffer(obj)
+    except TypeError:
+        return False
+    return True
+
+
+def buffer_length(content):
+    """
+    content的字节数，对array这类元素大于1字节的对象按字节计算
+    """
+    itemsize = getattr(content, 'itemsize', 1)
+    return len(content) * itemsize
+
+
+def buffer_slice(content, offset=0, size=None):
+    """
+    返回content[offset:offset + size]的只读视图，不复制数据
+    """
+    total = buffer_length(content)
+    if size is None or offset + size > total:
+        size = max(total - offset, 0)
+    if isinstance(content, memoryview) and content.itemsize == 1:
+        return content[offset:offset + size]
+    try:
+        view = memoryview(content)
+    except TypeError:
+        # mmap、array等只支持旧式buffer协议的对象
+        return buffer(content, offset, size)
+    if view.itemsize != 1:
+        return buffer(content, offset, size)
+    return view[offset:offset + size]
+
+
+class BufferPool(object):
+    """
+    固定大小缓冲区的有界池，最多分配max_buffers个缓冲区，全部借出时acquire阻塞等待归还
+    """
+
+    def __init__(self, buffer_size, max_buffers):
+        self.buffer_size = buffer_size
+        self.max_buffers = max(max_buffers, 1)
+        self._free = Queue.Queue()
+        self._allocated = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self._free.get_nowait()
+        except Queue.Empty:
+            pass
+        with self._lock:
+            if self._allocated < self.max_buffers:
+                self._allocated += 1
+                return bytearray(self.buffer_size)
+        return self._free.get()
+
+    def release(self, buf):
+        self._free.put(buf)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+
+class TTLCache(object):
+    """
+    线程安全的LRU缓存，记录超过ttl秒后失效，记录数超过max_entries时淘汰最久未访问的记录
+    ttl或max_entries为0时不缓存任何内容
+    """
+
+    def __init__(self, max_entries=1024, ttl=10):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[0] <= now:
+                self.misses += 1
+                return default
+            self._data[key] = item
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self.ttl, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, match):
+        """
+        :param match: 以key为参数，返回True的记录被删除
+        """
+        with self._lock:
+            for key in [key for key in self._data if match(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrency(object):
+    """
+    AIMD并发控制器：请求成功时缓慢增加允许的并发数，出现5xx、超时或者延迟明显升高时按比例减少
+    工作线程在发起请求前acquire，结束后release并报告本次请求的字节数与是否出现拥塞
+    """
+
+    def __init__(self, max_limit, min_limit=1, initial=None, increase=1.0, decrease=0.5,
+                 latency_factor=3.0, cooldown=1.0):
+        """
+        :param max_limit: 并发数上限，通常为线程池大小
+        :param initial: 初始并发数，默认为max_limit的四分之一
+        :param increase: 每经过约一个并发窗口的成功请求，并发数增加的值
+        :param decrease: 拥塞时并发数乘以的系数
+        :param latency_factor: 单位数据的耗时超过基准的该倍数时视为拥塞
+        :param cooldown: 两次减少之间的最小间隔(秒)，避免同一批失败导致并发数连续减半
+        """
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = max(min(min_limit, self.max_limit), 1)
+        self.limit = float(initial or max(self.max_limit // 4, self.min_limit))
+        self.limit = min(max(self.limit, self.min_limit), self.max_limit)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._base_latency = None           # 每MB耗时的基准值
+        self._last_decrease = 0
+        self._bytes = 0
+        self._started = time.time()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        return time.time()
+
+    def release(self, started, nbytes=0, congested=False):
+        """
+        :param started: acquire的返回值
+        :param nbytes: 本次请求成功传输的字节数
+        :param congested: 本次请求是否遇到5xx、超时、连接中断等拥塞信号
+        """
+        now = time.time()
+        with self._cond:
+            self.in_flight -= 1
+            if not congested and nbytes > 0:
+                self._bytes += nbytes
+                congested = self._is_latency_congested((now - started) * 1024 * 1024 / nbytes)
+            if congested:
+                self._on_congestion(now)
+            elif nbytes > 0:
+                self.limit = min(self.limit + self.increase / self.limit, self.max_limit)
+            self._cond.notify_all()
+
+    def _is_latency_congested(self, latency):
+        if self._base_latency is None or latency < self._base_latency:
+            self._base_latency = latency
+            return False
+        # 基准缓慢上浮，适应链路本身的变化
+        self._base_latency += (latency - self._base_latency) * 0.01
+        return latency > self._base_latency * self.latency_factor
+
+    def _on_congestion(self, now):
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        limit = max(self.limit * self.decrease, self.min_limit)
+        if int(limit) != int(self.limit):
+            log.info('Congestion detected, concurrency %d -> %d' % (self.limit, limit))
+        self.limit = limit
+
+    @property
+    def throughput(self):
+        """
+        启动以来成功传输的平均速率，字节/秒
+        """
+        elapsed = time.time() - self._started
+        return self._bytes / elapsed if elapsed > 0 else 0
+
+
+class ByteSemaphore(object):
+    """
+    按字节数计量的信号量，限制同时处理的数据总量；单个请求超过上限时，等其它请求全部释放后单独执行
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: 同时处理的字节数上限，为None时不限制
+        """
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self._cond:
+            while self.max_bytes is not None and self.in_use > 0 and \
+                    self.in_use + nbytes > self.max_bytes:
+                self._cond.wait()
+            self.in_use += nbytes
+
+    def release(self, nbytes):
+        with self._cond:
+            self.in_use -= nbytes
+            self._cond.notify_all()
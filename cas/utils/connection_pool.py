@@ -0,0 +1,194 @@
+# -*- coding=UTF-8 -*-
+
+import httplib
+import logging
+import select
+import threading
+import time
+import weakref
+
+log = logging.getLogger(__name__)
+
+_collect_refs = set()       # 等待response被回收的weakref
+
+
+class _DoneState(object):
+    """
+    与response分开保存done回调，response未关闭就被回收时仍能调用
+    """
+
+    def __init__(self):
+        self.callback = None
+        self.bytes_read = 0
+
+    def notify(self):
+        done, self.callback = self.callback, None
+        if done is not None:
+            done(self.bytes_read)
+
+
+def _notify_on_collect(response, state):
+    def collected(ref):
+        _collect_refs.discard(ref)
+        state.notify()
+    _collect_refs.add(weakref.ref(response, collected))
+
+
+class PooledHTTPResponse(httplib.HTTPResponse):
+    """
+    HTTPResponse that hands its connection back to the pool once the body
+    has been completely read
+    """
+
+    def __init__(self, *args, **kwargs):
+        httplib.HTTPResponse.__init__(self, *args, **kwargs)
+        self.release_callback = None
+        self.bytes_read = 0
+        self._done = _DoneState()
+        self._reading = False
+
+    def read(self, amt=None):
+        self._reading = True
+        try:
+            data = httplib.HTTPResponse.read(self, amt)
+            self.bytes_read += len(data)
+            self._done.bytes_read = self.bytes_read
+            return data
+        finally:
+            self._reading = False
+            # 读取到末尾时close在read内部被调用，计入最后一块数据后再通知
+            if self.fp is None:
+                self._notify_done()
+
+    def close(self):
+        # only a close triggered by reading to the end of the body leaves
+        # the socket in a state where it can carry another request
+        reusable = self._reading or self.length == 0
+        httplib.HTTPResponse.close(self)
+        callback, self.release_callback = self.release_callback, None
+        if callback is not None:
+            callback(reusable)
+        if not self._reading:
+            self._notify_done()
+
+    def on_done(self, callback):
+        """
+        响应关闭时以已读取的字节数调用callback一次，用于请求计时；
+        未读完也未关闭的响应被回收时同样调用，避免该请求一直被视为占用连接
+        """
+        self._done.callback = callback
+        _notify_on_collect(self, self._done)
+
+    def _notify_done(self):
+        self._done.notify()
+
+
+class PooledHTTPConnection(httplib.HTTPConnection):
+    response_class = PooledHTTPResponse
+
+
+class PooledHTTPSConnection(httplib.HTTPSConnection):
+    response_class = PooledHTTPResponse
+
+
+class ConnectionPool(object):
+    """
+    单个endpoint的keep-alive连接池，线程安全
+    max_size限制的是空闲连接的数目，取出的连接数目不受限制，超出部分在归还时直接关闭
+    """
+
+    def __init__(self, host, port, is_security=False, timeout=100,
+                 max_size=10, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.is_security = is_security
+        self.timeout = timeout
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = []                 # [(connection, last_used)], 最近归还的在末尾
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        if self.is_security:
+            return PooledHTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return PooledHTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    @classmethod
+    def _is_dropped(cls, conn):
+        """
+        空闲连接上不应有可读数据，可读意味着对端已关闭或者连接状态异常
+        """
+        sock = conn.sock
+        if sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (select.error, ValueError, TypeError):
+            return True
+        return bool(readable)
+
+    def _evict_idle(self, now):
+        expired = [item for item in self._idle if now - item[1] > self.idle_timeout]
+        if expired:
+            self._idle = [item for item in self._idle if now - item[1] <= self.idle_timeout]
+        return expired
+
+    def get(self):
+        """
+        取出一个连接，返回 (connection, reused)
+        """
+        while True:
+            with self._lock:
+                expired = self._evict_idle(time.time())
+                item = self._idle.pop() if self._idle else None
+            for conn, _ in expired:
+                conn.close()
+            if item is None:
+                return self._new_connection(), False
+            conn = item[0]
+            if self._is_dropped(conn):
+                log.debug('debug: drop stale connection to %s:%s\n' % (self.host, self.port))
+                conn.close()
+                continue
+            return conn, True
+
+    def put(self, conn):
+        if conn.sock is None:
+            return
+        with self._lock:
+            expired = self._evict_idle(time.time())
+            if len(self._idle) < self.max_size:
+                self._idle.append((conn, time.time()))
+                conn = None
+        for stale, _ in expired:
+            stale.close()
+        if conn is not None:
+            conn.close()
+
+    def release_on_close(self, conn, response):
+        """
+        在response读取完毕后将连接归还连接池
+        """
+        # 回调中不引用response，response未关闭时也可以被回收
+        def release(reusable):
+            if reusable:
+                self.put(conn)
+            else:
+                conn.close()
+
+        if response.will_close:
+            return
+        response.release_callback = release
+        if response.length == 0:
+            response.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    @property
+    def idle_count(self):
+        with self._lock:
+            return len(self._idle)
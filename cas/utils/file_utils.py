@@ -1,20 +1,45 @@
 # -*- coding: utf-8 -*-
 
+import errno
 import hashlib
 import io
 import math
 import mmap
 import os
+import sys
+import threading
 
+from cas.utils.buffer_utils import buffer_length
+from cas.utils.buffer_utils import buffer_slice
+from cas.utils.buffer_utils import is_buffer
+from cas.utils import hash_cache
 from cas.utils.merkle import MerkleTree
 from cas.utils.merkle import TreeHashGenerator
 
+_os_fallocate = getattr(os, 'posix_fallocate', None)
+_libc_fallocate = None
+
+if _os_fallocate is None and sys.platform.startswith('linux'):
+    try:
+        import ctypes
+        import ctypes.util
+
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc_fallocate = getattr(_libc, 'posix_fallocate64', None) or _libc.posix_fallocate
+        _libc_fallocate.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        _libc_fallocate.restype = ctypes.c_int
+    except (ImportError, OSError, AttributeError):
+        _libc_fallocate = None
+
 
 def is_file_like(obj):
     return callable(getattr(obj, 'read', None))
 
 
 def content_length(content):
+    if is_buffer(content):
+        return buffer_length(content)
+
     if hasattr(content, '__len__'):
         return len(content)
 
@@ -35,6 +60,31 @@ def content_length(content):
     raise ValueError('Unsupported content type')
 
 
+def reserve_space(fd, size):
+    """
+    为文件[0, size)分配磁盘块，返回是否成功；磁盘空间不足时抛出IOError
+    文件系统不支持或平台没有posix_fallocate时返回False
+    """
+    if size <= 0:
+        return True
+    if _os_fallocate is not None:
+        try:
+            _os_fallocate(fd, 0, size)
+            return True
+        except OSError as e:
+            err = e.errno
+    elif _libc_fallocate is not None:
+        # posix_fallocate直接返回错误码，不设置errno
+        err = _libc_fallocate(fd, 0, size)
+        if err == 0:
+            return True
+    else:
+        return False
+    if err in (errno.ENOSPC, errno.EFBIG, errno.EDQUOT):
+        raise IOError(err, os.strerror(err))
+    return False
+
+
 def open_file(file_path=None, file_obj=None, mode='rb'):
     if file_path is None and file_obj is None:
         raise ValueError(
@@ -48,6 +98,118 @@ def open_file(file_path=None, file_obj=None, mode='rb'):
             raise IOError('Failed to open file: %s' % file_path)
 
 
+def read_file_into(file_obj, buf, offset, size):
+    """
+    将文件[offset, offset + size)读入预先分配的buf中，返回这部分数据的视图
+    """
+    view = memoryview(buf)[:size]
+    file_obj.seek(offset)
+    pos = 0
+    while pos < size:
+        n = file_obj.readinto(view[pos:])
+        if not n:
+            raise IOError('Unexpected end of file at %d' % (offset + pos))
+        pos += n
+    return view
+
+
+class PositionalWriter(object):
+    """
+    多个线程按偏移并发写同一个文件，写入之间不需要加锁
+    优先使用os.pwrite；没有pwrite时(python2)先预留磁盘空间再使用共享的可写mmap，
+    无法预留或映射失败(如32位系统上的大文件)时每个线程各自打开文件，以lseek+write写入
+    打开时将文件扩展为size大小，已存在的文件不会被清空，以便断点续传
+    """
+
+    def __init__(self, file_path, size):
+        self.size = size
+        self.file_path = file_path
+        mode = 'r+b' if os.path.exists(file_path) else 'w+b'
+        self._file = open_file(file_path=file_path, mode=mode)
+        self._fd = self._file.fileno()
+        self._map = None
+        self._local = None
+        try:
+            self._file.truncate(size)
+            if not hasattr(os, 'pwrite') and size > 0:
+                # truncate得到的是稀疏文件，磁盘写满时通过mmap写入会触发SIGBUS而不是IOError
+                if reserve_space(self._fd, size):
+                    try:
+                        self._map = mmap.mmap(self._fd, size, access=mmap.ACCESS_WRITE)
+                    except (mmap.error, OverflowError, ValueError):
+                        pass
+                if self._map is None:
+                    self._local = threading.local()
+                    self._fds = []
+                    self._lock = threading.Lock()
+        except Exception:
+            self._file.close()
+            raise
+
+    def _thread_fd(self):
+        """
+        每个线程单独open的描述符有各自的文件偏移，lseek+write之间不需要加锁；dup得到的描述符共享偏移，不能使用
+        """
+        fd = getattr(self._local, 'fd', None)
+        if fd is None:
+            fd = self._local.fd = os.open(self.file_path, os.O_WRONLY)
+            with self._lock:
+                self._fds.append(fd)
+        return fd
+
+    def write(self, offset, data):
+        if offset + len(data) > self.size:
+            raise IOError('Write beyond end of file: %d + %d > %d' %
+                          (offset, len(data), self.size))
+        if self._map is not None:
+            self._map[offset:offset + len(data)] = data
+        elif self._local is not None:
+            fd = self._thread_fd()
+            view = memoryview(data)
+            try:
+                os.lseek(fd, offset, os.SEEK_SET)
+                while view:
+                    view = view[os.write(fd, view):]
+            except OSError as e:
+                raise IOError(e.errno, e.strerror)
+        else:
+            view = memoryview(data)
+            while view:
+                n = os.pwrite(self._fd, view, offset)
+                view, offset = view[n:], offset + n
+
+    def flush(self, offset=0, size=None):
+        """
+        将[offset, offset + size)已写入的数据落盘，每个分片完成时调用一次
+        """
+        if self._map is not None:
+            size = self.size - offset if size is None else size
+            aligned = offset - offset % mmap.PAGESIZE
+            if size > 0:
+                self._map.flush(aligned, offset + size - aligned)
+            return
+        # fsync作用于文件本身，各线程描述符写入的数据一并落盘
+        getattr(os, 'fdatasync', os.fsync)(self._fd)
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        if self._local is not None:
+            with self._lock:
+                fds, self._fds = self._fds, []
+            for fd in fds:
+                os.close(fd)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def range_size(byte_range):
     return byte_range[1] - byte_range[0] + 1
 
@@ -73,9 +235,28 @@ def compute_etag_from_file(file_path, offset=0, size=None, chunk_size=1024 * 102
             f, offset=offset, size=size, chunk_size=chunk_size)
 
 
+def _range_length(file_obj, offset, size):
+    return size or os.fstat(file_obj.fileno()).st_size - offset
+
+
 def compute_etag_from_file_obj(file_obj, offset=0, size=None, chunk_size=1024 * 1024):
+    size = _range_length(file_obj, offset, size)
+    cached, _ = hash_cache.lookup(file_obj, offset, size)
+    if cached is not None:
+        return cached
+
     etag = hashlib.sha256()
-     
+    for data in iter_file_chunks(file_obj, offset, size, chunk_size):
+        etag.update(data)
+    hash_cache.store(file_obj, offset, size, etag=etag.hexdigest())
+    return etag.hexdigest()
+
+
+def iter_file_chunks(file_obj, offset=0, size=None, chunk_size=1024 * 1024):
+    """
+    按chunk_size依次返回文件[offset, offset + size)中的数据
+    可以mmap时返回的是映射内存的只读视图，不会复制数据
+    """
     size = size or os.fstat(file_obj.fileno()).st_size - offset
 
     if size != 0 and offset % mmap.ALLOCATIONGRANULARITY == 0:
@@ -86,17 +267,23 @@ def compute_etag_from_file_obj(file_obj, offset=0, size=None, chunk_size=1024 *
         target = file_obj
         target.seek(offset)
 
-    while size > 0:
-        data = target.read(chunk_size)
-        etag.update(data[:min(len(data), size)])
-        size -= len(data)
-
-    if target is file_obj:
-        file_obj.seek(offset)
-    else:
-        target.close()
-    s = etag.hexdigest()
-    return s
+    try:
+        if target is not file_obj:
+            for pos in xrange(0, size, chunk_size):
+                yield buffer_slice(target, pos, min(chunk_size, size - pos))
+            return
+
+        while size > 0:
+            data = target.read(min(chunk_size, size))
+            if not data:
+                break
+            yield data
+            size -= len(data)
+    finally:
+        if target is file_obj:
+            file_obj.seek(offset)
+        else:
+            target.close()
 
 
 def compute_combine_etag(etag_list):
@@ -119,27 +306,17 @@ def compute_tree_etag_from_file(file_path, offset=0, size=None,
 
 def compute_tree_etag_from_file_obj(file_obj, offset=0, size=None,
                                     chunk_size=1024 * 1024):
-    generator = TreeHashGenerator()
-
-    size = size or os.fstat(file_obj.fileno()).st_size - offset
-    if size != 0 and offset % mmap.ALLOCATIONGRANULARITY == 0:
-        target = mmap.mmap(file_obj.fileno(), length=size,
-                           offset=offset,
-                           access=mmap.ACCESS_READ)
-    else:
-        target = file_obj
-        target.seek(offset)
+    size = _range_length(file_obj, offset, size)
+    _, cached = hash_cache.lookup(file_obj, offset, size)
+    if cached is not None:
+        return cached
 
-    while size > 0:
-        data = target.read(chunk_size)
-        generator.update(data[:min(len(data), size)])
-        size -= len(data)
-
-    if target is file_obj:
-        file_obj.seek(offset)
-    else:
-        target.close()
-    return generator.generate().digest()
+    generator = TreeHashGenerator()
+    for data in iter_file_chunks(file_obj, offset, size, chunk_size):
+        generator.update(data)
+    tree_etag = generator.generate().digest()
+    hash_cache.store(file_obj, offset, size, tree_etag=tree_etag)
+    return tree_etag
 
 
 def compute_hash_from_file(file_path, offset=0, size=None, chunk_size=1024*1024):
@@ -149,27 +326,31 @@ def compute_hash_from_file(file_path, offset=0, size=None, chunk_size=1024*1024)
         
 
 def compute_hash_from_file_obj(file_obj, offset=0, size=None, chunk_size=1024 * 1024):
+    size = _range_length(file_obj, offset, size)
+    cached = hash_cache.lookup(file_obj, offset, size)
+    if None not in cached:
+        return cached
+
     etag = hashlib.sha256()
     generator = TreeHashGenerator()
+    for data in iter_file_chunks(file_obj, offset, size, chunk_size):
+        generator.update(data)
+        etag.update(data)
+    result = etag.hexdigest(), generator.generate().digest()
+    hash_cache.store(file_obj, offset, size, *result)
+    return result
 
-    size = size or os.fstat(file_obj.fileno()).st_size - offset
-
-    if size != 0 and offset % mmap.ALLOCATIONGRANULARITY == 0:
-        target = mmap.mmap(file_obj.fileno(), length=size,
-                           offset=offset,
-                           access=mmap.ACCESS_READ)
-    else:
-        target = file_obj
-        target.seek(offset)
-
-    while size > 0:
-        data = target.read(chunk_size)
-        generator.update(data[:min(len(data), size)])
-        etag.update(data[:min(len(data), size)])
-        size -= len(data)
 
-    if target is file_obj:
-        file_obj.seek(offset)
-    else:
-        target.close()
+def compute_hash_from_content(content, offset=0, size=None, chunk_size=1024 * 1024):
+    """
+    计算内存中数据(str, bytearray, memoryview, mmap, array等)的etag与tree etag，按视图切片不复制数据
+    """
+    if size is None:
+        size = buffer_length(content) - offset
+    etag = hashlib.sha256()
+    generator = TreeHashGenerator()
+    for pos in xrange(offset, offset + size, chunk_size):
+        data = buffer_slice(content, pos, min(chunk_size, offset + size - pos))
+        generator.update(data)
+        etag.update(data)
     return etag.hexdigest(), generator.generate().digest()
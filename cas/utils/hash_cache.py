@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from cas.conf.common_conf import DEFAULT_HASH_CACHE_FILE
+from cas.conf.common_conf import DEFAULT_HASH_CACHE_MAX_ENTRIES
+
+log = logging.getLogger(__name__)
+
+
+def file_identity(file_obj):
+    """
+    文件标识 (device, inode, size, mtime_ns)，文件被修改后标识随之变化
+    """
+    st = os.fstat(file_obj.fileno())
+    mtime_ns = getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1000000000)
+    return st.st_dev, st.st_ino, st.st_size, mtime_ns
+
+
+class HashCache(object):
+    """
+    本地持久化的etag/tree etag缓存，以 (device, inode, size, mtime_ns, offset, length) 为键存储在SQLite中
+    文件大小或修改时间变化后，该文件的旧记录在下次访问时被清除；记录数超过max_entries时按最近访问时间淘汰
+    """
+
+    _EvictInterval = 1000           # 每写入多少次检查一次记录数
+
+    def __init__(self, path=DEFAULT_HASH_CACHE_FILE, max_entries=DEFAULT_HASH_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._puts = 0
+
+    def _connection(self):
+        # sqlite连接不能跨进程使用，fork之后重新建立
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('CREATE TABLE IF NOT EXISTS hashes ('
+                         'dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, '
+                         'offset INTEGER, length INTEGER, etag TEXT, tree_etag TEXT, '
+                         'last_used REAL, '
+                         'PRIMARY KEY (dev, ino, size, mtime_ns, offset, length))')
+            conn.execute('CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)')
+            conn.commit()
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, identity, offset, length):
+        """
+        :return: (etag, tree_etag)，未缓存的项为None；没有记录时返回None
+        """
+        key = tuple(identity) + (offset, length)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute('SELECT etag, tree_etag FROM hashes WHERE dev=? AND ino=? AND size=? '
+                               'AND mtime_ns=? AND offset=? AND length=?', key).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE hashes SET last_used=? WHERE dev=? AND ino=? AND size=? '
+                         'AND mtime_ns=? AND offset=? AND length=?', (time.time(),) + key)
+            conn.commit()
+        return tuple(str(v) if v is not None else None for v in row)
+
+    def put(self, identity, offset, length, etag=None, tree_etag=None):
+        dev, ino, size, mtime_ns = identity
+        key = tuple(identity) + (offset, length)
+        with self._lock:
+            conn = self._connection()
+            # 同一文件的大小或修改时间发生变化，之前的记录全部失效
+            conn.execute('DELETE FROM hashes WHERE dev=? AND ino=? AND (size!=? OR mtime_ns!=?)',
+                         (dev, ino, size, mtime_ns))
+            row = conn.execute('SELECT etag, tree_etag FROM hashes WHERE dev=? AND ino=? AND size=? '
+                               'AND mtime_ns=? AND offset=? AND length=?', key).fetchone()
+            if row is not None:
+                etag = etag or row[0]
+                tree_etag = tree_etag or row[1]
+            conn.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         key + (etag, tree_etag, time.time()))
+            self._puts += 1
+            if self._puts % self._EvictInterval == 0:
+                self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        count = conn.execute('SELECT COUNT(*) FROM hashes').fetchone()[0]
+        if count > self.max_entries:
+            conn.execute('DELETE FROM hashes WHERE rowid IN '
+                         '(SELECT rowid FROM hashes ORDER BY last_used LIMIT ?)',
+                         (count - self.max_entries,))
+
+    def invalidate(self, identity):
+        dev, ino = identity[0], identity[1]
+        with self._lock:
+            conn = self._connection()
+            conn.execute('DELETE FROM hashes WHERE dev=? AND ino=?', (dev, ino))
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute('DELETE FROM hashes')
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+_default_cache = None
+
+
+def enable_hash_cache(path=None, max_entries=None):
+    """
+    启用全局hash缓存，file_utils.compute_*以及MultipartUpload将优先使用缓存结果
+    """
+    global _default_cache
+    disable_hash_cache()
+    _default_cache = HashCache(path or DEFAULT_HASH_CACHE_FILE,
+                               max_entries or DEFAULT_HASH_CACHE_MAX_ENTRIES)
+    return _default_cache
+
+
+def disable_hash_cache():
+    global _default_cache
+    cache, _default_cache = _default_cache, None
+    if cache is not None:
+        cache.close()
+
+
+def get_hash_cache():
+    return _default_cache
+
+
+def lookup(file_obj, offset, length):
+    """
+    :return: 全局缓存中file_obj[offset, offset + length)的 (etag, tree_etag)，未启用缓存或无记录时返回 (None, None)
+    """
+    cache = _default_cache
+    if cache is None:
+        return None, None
+    try:
+        return cache.get(file_identity(file_obj), offset, length) or (None, None)
+    except (sqlite3.Error, OSError, IOError, AttributeError, ValueError) as e:
+        log.warning('hash cache lookup failed: %s' % e)
+        return None, None
+
+
+def store(file_obj, offset, length, etag=None, tree_etag=None):
+    cache = _default_cache
+    if cache is None:
+        return
+    try:
+        cache.put(file_identity(file_obj), offset, length, etag, tree_etag)
+    except (sqlite3.Error, OSError, IOError, AttributeError, ValueError) as e:
+        log.warning('hash cache store failed: %s' % e)
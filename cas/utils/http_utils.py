@@ -4,6 +4,7 @@ import hashlib
 import sys
 import time
 import hmac
+import threading
 import urllib
 from datetime import tzinfo, timedelta
 
@@ -32,52 +33,55 @@ def safe_get_element(name, container):
     return ""
 
 
+def _canonical_pairs(items, quote_key):
+    """
+    key小写去空格后排序，value按RFC 3986编码，拼接为 k1=v1&k2&k3=v3
+    """
+    pairs = []
+    for k, v in sorted(items):
+        if quote_key:
+            k = urllib.quote(k)
+        if v:
+            pairs.append(k + '=' + urllib.quote(v, '~'))
+        else:
+            pairs.append(k)
+    return '&'.join(pairs)
+
+
 def format_params(params=None):
     if not params:
         return ''
-    tmp_params = dict()
-    for k, v in params.items():
-        tmp_k = k.lower().strip()
-        tmp_params[tmp_k] = str(v).lower()
-    res = ''
-    separator = '&'
-    check_params = tmp_params.keys()
-    check_params.sort()
-
-    if check_params is not None:
-        for p in check_params:
-            res += urllib.quote(p)
-            # print p, tmp_params[p]
-            v = tmp_params[p]
-            if len(v) != 0:
-                res += '='
-                res += urllib.quote_plus(v, '~').replace('+', '%20')
-            res += separator
-        res = res.rstrip(separator)
-    return res
+    tmp_params = dict((k.lower().strip(), str(v).lower()) for k, v in params.items())
+    return _canonical_pairs(tmp_params.items(), True)
 
 
 def format_headers(headers=None):
     if not headers:
         return ''
-    tmp_headers = {}
-    for k, v in headers.items():
-        tmp_k = k.lower().strip()
-        tmp_headers[tmp_k] = str(v)
-    res = ''
-    separator = '&'
-    check_headers = tmp_headers.keys()
-    check_headers.sort()
-    if check_headers is not None:
-        for p in check_headers:
-            res += p
-            v = tmp_headers[p]
-            if len(v) != 0:
-                res += '='
-                res += urllib.quote_plus(v, '~').replace('+', '%20')
-            res += separator
-        res = res.rstrip(separator)
-    return res
+    tmp_headers = dict((k.lower().strip(), str(v)) for k, v in headers.items())
+    return _canonical_pairs(tmp_headers.items(), False)
+
+
+def _key_list(container):
+    if not container:
+        return ''
+    return ';'.join(sorted(k.lower() for k in container.keys()))
+
+
+def _sign(ak, sign_key, time_range, method, url, headers, params):
+    format_string = '\n'.join((method.lower(), url, format_params(params),
+                               format_headers(headers), ''))
+    string_to_sign = '\n'.join(('sha1', time_range,
+                                hashlib.sha1(format_string).hexdigest(), ''))
+    sign = hmac.new(sign_key, string_to_sign, hashlib.sha1).hexdigest()
+
+    return ''.join(('q-sign-algorithm=sha1&',
+                    'q-ak=%s&' % ak.encode('utf8'),
+                    'q-sign-time=%s&' % time_range,
+                    'q-key-time=%s&' % time_range,
+                    'q-header-list=%s&' % _key_list(headers),
+                    'q-url-param-list=%s&' % _key_list(params),
+                    'q-signature=%s' % sign))
 
 
 def create_auth(ak, sk, host, method, url, headers, params, expire):
@@ -98,44 +102,41 @@ def create_auth(ak, sk, host, method, url, headers, params, expire):
     now = int(time.time())
     time_range = '%d;%d' % (now, now + expire)
     sign_key = hmac.new(sk, time_range, hashlib.sha1).hexdigest()
+    return _sign(ak, sign_key, time_range, method, url, headers, params)
 
-    format_string = method.lower() + '\n'
-    format_string += url + '\n'
-    format_string += format_params(params) + '\n'
-    format_string += format_headers(headers) + '\n'
-
-    # print '=== debug: headers: ', headers
-    # print '=== debug: format headers: ', format_headers(headers)
-    # print '=== debug: format string:\n', format_string
-
-    string_to_sign = 'sha1\n'
-    string_to_sign += time_range + '\n'
-    string_to_sign += hashlib.sha1(format_string).hexdigest() + '\n'
 
-    # print '=== debug: string to sign: ', string_to_sign
-
-    sign = hmac.new(sign_key, string_to_sign, hashlib.sha1).hexdigest()
+class Signer(object):
+    """
+    请求签名器，缓存由sk派生的sign_key
+    签名时间段按expire/2对齐，同一时间段内的请求复用同一个sign_key，签名剩余有效期始终不少于expire/2
+    """
 
-    auth_content = 'q-sign-algorithm=sha1&'
-    auth_content += 'q-ak=%s&' % ak.encode('utf8')
-    auth_content += 'q-sign-time=%s&' % time_range
-    auth_content += 'q-key-time=%s&' % time_range
-
-    h_list = []
-    if headers:
-        h_list = [k.lower() for k in headers.keys()]
-        h_list.sort()
-    s_header = ';'.join(h_list)
-    auth_content += 'q-header-list=%s&' % s_header
-
-    p_list = []
-    if params:
-        p_list = [k.lower() for k in params.keys()]
-        p_list.sort()
-    s_param = ';'.join(p_list)
-    auth_content += 'q-url-param-list=%s&' % s_param
-    auth_content += 'q-signature=%s' % sign
-    return auth_content
+    def __init__(self, ak, sk, expire):
+        if isinstance(sk, unicode):
+            sk = sk.encode('utf8')
+        self.ak = ak
+        self.sk = sk
+        self.expire = expire
+        self._window = max(expire // 2, 1)
+        self._key = (None, None, None)        # (window_start, time_range, sign_key)
+        self._lock = threading.Lock()
+
+    def _signing_key(self):
+        now = int(time.time())
+        window_start = now - now % self._window
+        key = self._key
+        if key[0] != window_start:
+            with self._lock:
+                key = self._key
+                if key[0] != window_start:
+                    time_range = '%d;%d' % (window_start, window_start + self.expire)
+                    sign_key = hmac.new(self.sk, time_range, hashlib.sha1).hexdigest()
+                    key = self._key = (window_start, time_range, sign_key)
+        return key[1], key[2]
+
+    def sign(self, method, url, headers=None, params=None):
+        time_range, sign_key = self._signing_key()
+        return _sign(self.ak, sign_key, time_range, method, url, headers, params)
 
 
 def append_param(url, params):
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+import binascii
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+
+import yaml
+
+from cas.conf.common_conf import DEFAULT_UPLOAD_JOURNAL_DIR
+from cas.utils.file_utils import range_size
+
+log = logging.getLogger(__name__)
+
+
+class _LegacyLoader(yaml.SafeLoader):
+    """
+    只用于读取旧版本以yaml.dump(OrderedDict)保存的.cas文件，不构造其它python对象
+    """
+
+
+def _construct_tuple(loader, node):
+    return tuple(loader.construct_sequence(node))
+
+
+def _construct_ordered_dict(loader, node):
+    args = loader.construct_sequence(node, deep=True)
+    return dict((tuple(k), v) for k, v in (args[0] if args else []))
+
+
+_LegacyLoader.add_constructor(u'tag:yaml.org,2002:python/tuple', _construct_tuple)
+_LegacyLoader.add_constructor(
+    u'tag:yaml.org,2002:python/object/apply:collections.OrderedDict', _construct_ordered_dict)
+
+
+class _Journal(object):
+    """
+    只追加写入的断点记录文件：固定的header之后是若干定长记录
+    每条记录写入内核缓冲区后立即可见，每sync_interval条或sync_seconds秒fsync一次。
+    进程异常退出时，末尾不完整的记录在重放时被丢弃；fsync之前掉电丢失的记录只会导致对应分片重新传输
+    每条记录为分片下标(4)与digests个32字节的hash，子类提供header
+    """
+
+    def __init__(self, file_path, header, digests=1, sync_interval=64, sync_seconds=5.0):
+        """
+        :param digests: 每条记录中hash的个数，为1时记录的值为hex字符串，否则为hex字符串的tuple
+        """
+        self.file_path = file_path
+        self.header = header
+        self._digests = digests
+        self._Record = struct.Struct('<I' + '32s' * digests)
+        self.sync_interval = sync_interval
+        self.sync_seconds = sync_seconds
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pending = 0
+        self._last_sync = time.time()
+
+    def _set_ranges(self, byte_ranges):
+        """
+        记录中以分片在byte_ranges中的下标代替分片范围
+        :return: (part_size, size_total)，写入header用于判断记录是否对应当前的分片方式
+        """
+        self.byte_ranges = list(byte_ranges)
+        self._index = dict((byte_range, i) for i, byte_range in enumerate(self.byte_ranges))
+        if not self.byte_ranges:
+            return 0, 0
+        return range_size(self.byte_ranges[0]), self.byte_ranges[-1][1] + 1
+
+    def _encode(self, byte_range, value):
+        digests = (value,) if self._digests == 1 else value
+        return self._Record.pack(self._index[byte_range], *[binascii.unhexlify(d) for d in digests])
+
+    def _decode(self, record):
+        """
+        :return: (byte_range, value)，无效记录返回None
+        """
+        index, digests = record[0], tuple(binascii.hexlify(d) for d in record[1:])
+        if index < len(self.byte_ranges):
+            return self.byte_ranges[index], digests[0] if self._digests == 1 else digests
+
+    def _migrate(self, data):
+        return {}
+
+    def load(self):
+        """
+        重放已有的记录并打开文件用于追加
+        :return: {key: value}，同一key以最后一条记录为准
+        """
+        try:
+            with open(self.file_path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            data = None
+
+        entries = {}
+        if data and data.startswith(self.header[:4]):
+            if data.startswith(self.header):
+                entries, valid = self._replay(data)
+                self._open(truncate_at=valid)
+                return entries
+            log.warning('Journal %s does not match current transfer, ignored.' % self.file_path)
+        elif data:
+            entries = self._migrate(data)
+        self._rewrite(entries)
+        return entries
+
+    def _replay(self, data):
+        size, record_size = len(self.header), self._Record.size
+        end = size + (len(data) - size) // record_size * record_size
+        entries = {}
+        for offset in xrange(size, end, record_size):
+            entry = self._decode(self._Record.unpack_from(data, offset))
+            if entry is not None:
+                entries[entry[0]] = entry[1]
+        return entries, end
+
+    def _rewrite(self, entries):
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.header)
+            for key, value in entries.items():
+                f.write(self._encode(key, value))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.file_path)
+        self._open()
+
+    def _open(self, truncate_at=None):
+        self._fd = os.open(self.file_path, os.O_WRONLY | os.O_APPEND)
+        if truncate_at is not None:
+            os.ftruncate(self._fd, truncate_at)
+
+    def append(self, key, value):
+        record = self._encode(key, value)
+        with self._lock:
+            os.write(self._fd, record)
+            self._pending += 1
+            if self._pending >= self.sync_interval or \
+                    time.time() - self._last_sync >= self.sync_seconds:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._fd)
+        self._pending = 0
+        self._last_sync = time.time()
+
+    def sync(self):
+        with self._lock:
+            if self._fd is not None and self._pending:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                if self._pending:
+                    self._sync()
+                os.close(self._fd)
+                self._fd = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DownloadJournal(_Journal):
+    """
+    分片下载的断点记录
+        header: magic(4) version(2) reserved(2) part_size(8) size_total(8)
+        record: part index(4) tree hash(32)
+    兼容读取旧版本的yaml格式.cas文件，读取后改写为二进制格式
+    """
+
+    Magic = 'CASJ'
+    Version = 1
+    _Header = struct.Struct('<4sHHQQ')
+
+    def __init__(self, file_path, byte_ranges, sync_interval=64, sync_seconds=5.0):
+        """
+        :param byte_ranges: 按顺序排列的全部分片范围，记录中的part index即为其下标
+        """
+        part_size, size_total = self._set_ranges(byte_ranges)
+        header = self._Header.pack(self.Magic, self.Version, 0, part_size, size_total)
+        super(DownloadJournal, self).__init__(file_path, header, 1, sync_interval, sync_seconds)
+
+    def _migrate(self, data):
+        try:
+            legacy = yaml.load(data, Loader=_LegacyLoader)
+        except yaml.YAMLError as e:
+            log.warning('Unrecognized journal %s ignored: %s' % (self.file_path, e))
+            return {}
+        if not isinstance(legacy, dict):
+            return {}
+        log.info('Migrate YAML journal %s.' % self.file_path)
+        return dict((byte_range, tree_etag) for byte_range, tree_etag in legacy.items()
+                    if byte_range in self._index and tree_etag)
+
+
+class UploadJournal(_Journal):
+    """
+    分块上传的断点记录，文件名由upload id决定，header中记录本地文件的标识，文件被修改后记录失效
+        header: magic(4) version(2) id length(2) part_size(8) size_total(8)
+                device(8) inode(8) size(8) mtime_ns(8) upload id
+        record: part index(4) etag(32) tree etag(32)
+    """
+
+    Magic = 'CASU'
+    Version = 1
+    _Header = struct.Struct('<4sHHQQQQQQ')
+
+    def __init__(self, upload_id, identity, byte_ranges, journal_dir=DEFAULT_UPLOAD_JOURNAL_DIR,
+                 sync_interval=64, sync_seconds=5.0):
+        """
+        :param identity: hash_cache.file_identity返回的 (device, inode, size, mtime_ns)
+        load的结果为 {byte_range: (etag, tree_etag)}
+        """
+        self.upload_id = upload_id = str(upload_id)
+        part_size, size_total = self._set_ranges(byte_ranges)
+        header = self._Header.pack(self.Magic, self.Version, len(upload_id), part_size, size_total,
+                                   *identity) + upload_id
+        file_path = os.path.join(journal_dir, hashlib.sha1(upload_id).hexdigest())
+        super(UploadJournal, self).__init__(file_path, header, 2, sync_interval, sync_seconds)
+
+    def load(self):
+        journal_dir = os.path.dirname(self.file_path)
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir)
+        return super(UploadJournal, self).load()
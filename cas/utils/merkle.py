@@ -1,7 +1,11 @@
+# -*- coding: utf-8 -*-
+
 import binascii
 import hashlib
 
 from cas.conf.common_conf import MEGABYTE
+from cas.utils.buffer_utils import buffer_length
+from cas.utils.buffer_utils import buffer_slice
 
 
 class MerkleTree(object):
@@ -22,49 +26,79 @@ class MerkleTree(object):
         return delimiter.join(self.hash_list)
 
     def digest(self):
-        if len(self.hash_list) < 1:
-            return ''
+        accumulator = MerkleAccumulator(hash_func=self.hash_func)
+        for block_hash in self.hash_list:
+            accumulator.append(block_hash)
+        return accumulator.digest()
+
+
+class MerkleAccumulator(object):
+    """
+    增量计算的Merkle树，叶子逐个折叠进至多log2(n)个待合并节点的栈中，结果与MerkleTree.digest一致
+    keep_leaves为True时同时保留叶子列表，用于导出
+    """
+
+    def __init__(self, hash_func=hashlib.sha256, keep_leaves=False):
+        self.hash_func = hash_func
+        self.count = 0
+        self.hash_list = [] if keep_leaves else None
+        self._pending = []              # [(level, node)], 第level层的节点覆盖2^level个叶子
+
+    def _combine(self, left, right):
+        md = self.hash_func()
+        md.update(left)
+        md.update(right)
+        return md.digest()
 
-        hashes = list(self.hash_list)
-        while len(hashes) > 1:
-            new_hashes = list()
+    def append(self, block_hash):
+        node, level = block_hash, 0
+        while self._pending and self._pending[-1][0] == level:
+            node = self._combine(self._pending.pop()[1], node)
+            level += 1
+        self._pending.append((level, node))
+        self.count += 1
+        if self.hash_list is not None:
+            self.hash_list.append(block_hash)
+        return self
 
-            while True:
-                if len(hashes) > 1:
-                    md = self.hash_func()
-                    md.update(hashes.pop(0))
-                    md.update(hashes.pop(0))
-                    new_hashes.append(md.digest())
-                elif len(hashes) > 0:
-                    new_hashes.append(hashes.pop(0))
-                else:
-                    break
+    def dump(self, delimiter=' '):
+        if self.hash_list is None:
+            raise ValueError('leaves are not kept, create with keep_leaves=True')
+        return delimiter.join(self.hash_list)
+
+    def digest(self):
+        if not self._pending:
+            return ''
 
-            hashes = new_hashes
-        return binascii.hexlify(hashes[0])
+        # 未配对的节点直接提升到上层，等价于自右向左依次合并
+        node = self._pending[-1][1]
+        for _, left in reversed(self._pending[:-1]):
+            node = self._combine(left, node)
+        return binascii.hexlify(node)
 
 
 class TreeHashGenerator(object):
 
-    def __init__(self, block_size=MEGABYTE, hash_func=hashlib.sha256):
+    def __init__(self, block_size=MEGABYTE, hash_func=hashlib.sha256, keep_leaves=False):
         self.block_size = block_size
         self.hash_func = hash_func
+        self.keep_leaves = keep_leaves
         self.stream = hash_func()
         self.remain = block_size
-        self.tree = MerkleTree(hash_func=hash_func)
+        self.tree = MerkleAccumulator(hash_func=hash_func, keep_leaves=keep_leaves)
 
     def update(self, data, offset=0, length=None):
-        length = length or len(data)
+        length = length or buffer_length(data) - offset
         while length > 0:
             if length >= self.remain:
-                self.stream.update(data[offset:offset + self.remain])
+                self.stream.update(buffer_slice(data, offset, self.remain))
                 self.tree.append(self.stream.digest())
                 self.stream = self.hash_func()
                 offset += self.remain
                 length -= self.remain
                 self.remain = self.block_size
             else:
-                self.stream.update(data[offset:offset + length])
+                self.stream.update(buffer_slice(data, offset, length))
                 self.remain -= length
                 length = 0
 
@@ -76,6 +110,6 @@ class TreeHashGenerator(object):
         result = self.tree
 
         self.remain = self.block_size
-        self.tree = MerkleTree(hash_func=self.hash_func)
+        self.tree = MerkleAccumulator(hash_func=self.hash_func, keep_leaves=self.keep_leaves)
 
         return result
@@ -0,0 +1,432 @@
+# -*- coding=UTF-8 -*-
+
+import BaseHTTPServer
+import bisect
+import json
+import logging
+import os
+import SocketServer
+import threading
+import weakref
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from cas.utils.request_hooks import monotonic
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DEFAULT_THROUGHPUT_BUCKETS = tuple(2 ** i * 1024 * 1024 for i in xrange(-4, 11))  # 64KB/s ~ 1GB/s
+
+
+def _format_value(value):
+    if isinstance(value, (int, long)):
+        return '%d' % value
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return '%d' % value
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}           # 标签值的tuple -> 值
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s: %s' % (self.__class__.__name__, self.name)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError('%s expects labels %s, got %s' % (self.name, self.labelnames, sorted(labels)))
+        try:
+            return tuple(str(labels[name]) for name in self.labelnames)
+        except KeyError:
+            raise ValueError('%s expects labels %s, got %s' % (self.name, self.labelnames, sorted(labels)))
+
+    def samples(self):
+        """
+        :return: [(样本名, 标签dict, 值)]
+        """
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('counter %s can only increase' % self.name)
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super(Gauge, self).__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """
+        导出时调用function取值，只用于没有标签的gauge
+        """
+        if self.labelnames:
+            raise ValueError('gauge %s with labels can not use a function' % self.name)
+        self._function = function
+
+    def value(self, **labels):
+        if self._function is not None:
+            return self._function()
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self._function is not None:
+            return [(self.name, {}, self._function())]
+        return super(Gauge, self).samples()
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        if 'le' in labelnames:
+            raise ValueError('histogram %s can not use label le' % name)
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # 各桶的计数(不累加)，最后一个为+Inf，另记sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def value(self, **labels):
+        """
+        :return: (count, sum)
+        """
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            if counts is None:
+                return 0, 0.0
+            return sum(counts[:-1]), counts[-1]
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        samples = []
+        for key, counts in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                cumulative += count
+                samples.append((self.name + '_bucket', dict(labels, le=_format_value(float(bound))), cumulative))
+            samples.append((self.name + '_sum', labels, counts[-1]))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry(object):
+    """
+    进程内的指标表，可导出为Prometheus文本格式或JSON，写入文件或通过本地HTTP端口提供
+    同名指标重复注册时返回已有的实例
+    """
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError('metric %s already registered as %s%s' %
+                                 (name, metric.type, metric.labelnames))
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        with self._lock:
+            return self._metrics.get(name)
+
+    def collect(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def to_prometheus(self):
+        lines = []
+        for metric in self.collect():
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                if labels:
+                    # le放在最后，与常见exporter的输出一致
+                    names = sorted(labels, key=lambda k: (k == 'le', k))
+                    name += '{%s}' % ','.join('%s="%s"' % (k, _escape(labels[k])) for k in names)
+                lines.append('%s %s' % (name, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        result = OrderedDict()
+        for metric in self.collect():
+            result[metric.name] = {
+                'type': metric.type,
+                'help': metric.documentation,
+                'samples': [{'name': name, 'labels': labels, 'value': value}
+                            for name, labels, value in metric.samples()]}
+        return result
+
+    def to_json(self, indent=None):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def dump(self, file_path, fmt='prometheus'):
+        """
+        先写临时文件再改名，node_exporter的textfile collector等读取方不会读到写了一半的文件
+        :param fmt: prometheus 或 json
+        """
+        content = self._render(fmt)
+        tmp_path = '%s.%d.tmp' % (file_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.rename(tmp_path, file_path)
+
+    def serve(self, port=0, host='127.0.0.1'):
+        """
+        在后台线程中提供 /metrics (Prometheus文本格式) 与 /metrics.json
+        :return: 已启动的MetricsServer
+        """
+        return MetricsServer(self, host, port).start()
+
+    def _render(self, fmt):
+        if fmt == 'prometheus':
+            return self.to_prometheus()
+        if fmt == 'json':
+            return self.to_json()
+        raise ValueError('unknown metrics format: %s' % fmt)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    _Formats = {'/metrics': ('prometheus', 'text/plain; version=0.0.4; charset=utf-8'),
+                '/metrics.json': ('json', 'application/json')}
+
+    def log_message(self, fmt, *args):
+        log.debug(fmt % args)
+
+    def do_GET(self):
+        fmt = self._Formats.get(self.path.split('?', 1)[0])
+        if fmt is None:
+            self.send_error(404)
+            return
+        body = self.server.registry._render(fmt[0])
+        self.send_response(200)
+        self.send_header('Content-Type', fmt[1])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MetricsServer(object):
+
+    def __init__(self, registry, host='127.0.0.1', port=0):
+        self._httpd = _HTTPServer((host, port), _Handler)
+        self._httpd.registry = registry
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._httpd.server_address[0]
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class RequestMetrics(object):
+    """
+    订阅RequestHooks，记录请求数、流量、耗时与占用中的连接数
+    """
+
+    def __init__(self, registry):
+        self.requests = registry.counter(
+            'cas_requests_total', 'Completed CAS API requests.', ('method', 'operation', 'status'))
+        self.errors = registry.counter(
+            'cas_request_errors_total', 'CAS API requests failed before a response was received.',
+            ('method', 'operation'))
+        self.bytes_sent = registry.counter('cas_bytes_sent_total', 'Request body bytes sent.')
+        self.bytes_received = registry.counter('cas_bytes_received_total', 'Response body bytes received.')
+        self.duration = registry.histogram(
+            'cas_request_duration_seconds', 'Time from request start until the response body was read.',
+            ('method', 'operation'))
+        self.in_use = registry.gauge('cas_connections_in_use', 'Connections carrying a request.')
+        self._holding = set()       # 占用连接中的请求ID
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        name = event.name
+        if name == 'connected':
+            self._hold(event.request_id, True)
+        elif name == 'response_done':
+            self._hold(event.request_id, False)
+            self.requests.inc(method=event.method, operation=event.url_template, status=event.status)
+            self.bytes_sent.inc(event.bytes_sent)
+            self.bytes_received.inc(event.bytes_received)
+            self.duration.observe(event.elapsed, method=event.method, operation=event.url_template)
+        elif name == 'error':
+            self._hold(event.request_id, False)
+            self.errors.inc(method=event.method, operation=event.url_template)
+
+    def _hold(self, request_id, holding):
+        with self._lock:
+            if holding and request_id not in self._holding:
+                self._holding.add(request_id)
+                self.in_use.inc()
+            elif not holding and request_id in self._holding:
+                self._holding.discard(request_id)
+                self.in_use.dec()
+
+
+class PartMetrics(object):
+    """
+    MultipartUpload与Job按分片记录每次尝试的耗时、吞吐与进行中的分片数
+    用法与AdaptiveConcurrency相同：start返回的值在尝试结束时传给finish
+    """
+
+    def __init__(self, registry):
+        self.duration = registry.histogram(
+            'cas_part_duration_seconds', 'Time to transfer one part, per attempt.', ('direction',))
+        self.throughput = registry.histogram(
+            'cas_part_throughput_bytes_per_second', 'Throughput of successfully transferred parts.',
+            ('direction',), buckets=DEFAULT_THROUGHPUT_BUCKETS)
+        self.parts = registry.counter(
+            'cas_parts_total', 'Part transfer attempts.', ('direction', 'result'))
+        self.bytes = registry.counter(
+            'cas_part_bytes_total', 'Bytes of successfully transferred parts.', ('direction',))
+        self.in_flight = registry.gauge(
+            'cas_parts_in_flight', 'Parts being transferred.', ('direction',))
+
+    def start(self, direction):
+        self.in_flight.inc(direction=direction)
+        return direction, monotonic()
+
+    def finish(self, started, nbytes):
+        """
+        :param nbytes: 成功传输的字节数，为0表示该次尝试失败
+        """
+        direction, start = started
+        elapsed = monotonic() - start
+        self.in_flight.dec(direction=direction)
+        self.duration.observe(elapsed, direction=direction)
+        if nbytes > 0:
+            self.parts.inc(direction=direction, result='success')
+            self.bytes.inc(nbytes, direction=direction)
+            if elapsed > 0:
+                self.throughput.observe(nbytes / elapsed, direction=direction)
+        else:
+            self.parts.inc(direction=direction, result='failure')
+
+
+default_registry = MetricsRegistry()
+part_metrics = PartMetrics(default_registry)
+
+_watched_pools = weakref.WeakSet()
+_subscribed = weakref.WeakKeyDictionary()      # hooks -> RequestMetrics
+_watch_lock = threading.Lock()
+
+
+def _register_pool_gauges(registry):
+    registry.gauge('cas_connections_idle', 'Idle keep-alive connections in the pools.').set_function(
+        lambda: sum(pool.idle_count for pool in list(_watched_pools)))
+    registry.gauge('cas_connections_max_idle', 'Idle connections the pools may keep.').set_function(
+        lambda: sum(pool.max_size for pool in list(_watched_pools)))
+
+
+_register_pool_gauges(default_registry)
+
+
+def watch_client(client):
+    """
+    订阅client的hooks记录请求指标，并将其连接池计入连接数指标，均记录到default_registry
+    client_conf.DefaultMetrics为True时由CASClient自动调用，否则需要时对client调用一次
+    """
+    with _watch_lock:
+        _watched_pools.add(client.pool)
+        if client.hooks not in _subscribed:
+            collector = RequestMetrics(default_registry)
+            client.hooks.subscribe(collector)
+            _subscribed[client.hooks] = collector
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+
+
+class _PageFetcher(threading.Thread):
+    """
+    在后台线程中请求一页数据，get时等待结果，请求中的异常在get时重新抛出
+    """
+
+    def __init__(self, fetch_page, marker):
+        super(_PageFetcher, self).__init__()
+        self.daemon = True
+        self.fetch_page = fetch_page
+        self.marker = marker
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        try:
+            self.result = self.fetch_page(self.marker)
+        except Exception:
+            self.exc_info = sys.exc_info()
+
+    def get(self):
+        self.join()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+class _LazyPage(object):
+
+    def __init__(self, fetch_page, marker):
+        self.fetch_page = fetch_page
+        self.marker = marker
+
+    def get(self):
+        return self.fetch_page(self.marker)
+
+
+def iter_pages(fetch_page, prefetch=True):
+    """
+    按Marker逐页返回列表接口的结果，调用方处理当前页时，下一页已在后台请求
+    调用方提前停止迭代时，已发出的请求在后台完成后被丢弃
+    :param fetch_page: 以marker(第一页为None)为参数，返回包含'Marker'的CASResponse
+    :param prefetch: 为False时在迭代到下一页时才发出请求
+    """
+    fetcher = _PageFetcher if prefetch else _LazyPage
+    pending = fetcher(fetch_page, None)
+    if prefetch:
+        pending.start()
+    while pending is not None:
+        response = pending.get()
+        marker = response['Marker']
+        pending = None
+        if marker:
+            pending = fetcher(fetch_page, marker)
+            if prefetch:
+                pending.start()
+        yield response
+
+
+def iter_items(fetch_page, key, prefetch=True):
+    """
+    逐条返回每一页中key对应列表的元素
+    """
+    for response in iter_pages(fetch_page, prefetch):
+        for item in response[key]:
+            yield item
+
+
+def list_all(fetch_page, key):
+    """
+    读取全部分页，返回第一页的CASResponse，key对应的列表替换为所有页的元素，Marker置为None表示已完整列出
+    """
+    pages = iter_pages(fetch_page)
+    response = next(pages)
+    items = list(response[key])
+    for page in pages:
+        items.extend(page[key])
+    response[key] = items
+    response['Marker'] = None
+    return response
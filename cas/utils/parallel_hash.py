@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import mmap
+import os
+import threading
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from cas.conf.common_conf import MEGABYTE
+from cas.utils import hash_cache
+from cas.utils.file_utils import calc_ranges
+from cas.utils.file_utils import compute_etag_from_file
+from cas.utils.file_utils import compute_hash_from_file
+from cas.utils.merkle import MerkleAccumulator
+
+
+def _hash_leaves(args):
+    """
+    计算文件[offset, offset + size)中每个block的sha256，供线程池和进程池调用，因此定义在模块顶层
+    hashlib在处理大块数据时会释放GIL，多线程即可并行
+    """
+    file_path, offset, size, block_size = args
+    aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+    start = offset - aligned
+    leaves = []
+    with open(file_path, 'rb') as f:
+        target = mmap.mmap(f.fileno(), length=start + size, offset=aligned,
+                           access=mmap.ACCESS_READ)
+        try:
+            for pos in xrange(start, start + size, block_size):
+                leaves.append(hashlib.sha256(
+                    buffer(target, pos, min(block_size, start + size - pos))).digest())
+        finally:
+            target.close()
+    return leaves
+
+
+def _hash_part(args):
+    file_path, offset, size = args
+    return compute_hash_from_file(file_path, offset=offset, size=size)
+
+
+class ParallelTreeHasher(object):
+    """
+    多核并行计算tree etag：文件按segment_size切分为若干段，各段内1MB叶子的hash由线程池(或进程池)并行计算，
+    再按顺序合并为Merkle树
+    """
+
+    def __init__(self, workers=None, use_process=False, segment_size=64 * MEGABYTE,
+                 block_size=MEGABYTE):
+        if segment_size % block_size != 0:
+            raise ValueError('segment_size must be a multiple of block_size')
+        self.workers = workers or cpu_count()
+        self.use_process = use_process
+        self.segment_size = segment_size
+        self.block_size = block_size
+
+    def _map(self, func, tasks):
+        if self.workers <= 1 or len(tasks) <= 1:
+            return map(func, tasks)
+        if self.use_process:
+            pool = Pool(processes=min(self.workers, len(tasks)))
+        else:
+            pool = ThreadPool(processes=min(self.workers, len(tasks)))
+        try:
+            return pool.map(func, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _imap(self, func, tasks):
+        """
+        与_map相同，但按tasks顺序逐个返回结果，不必等全部完成后再一起保存在内存中
+        """
+        if self.workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield func(task)
+            return
+        if self.use_process:
+            pool = Pool(processes=min(self.workers, len(tasks)))
+        else:
+            pool = ThreadPool(processes=min(self.workers, len(tasks)))
+        try:
+            for result in pool.imap(func, tasks):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @classmethod
+    def _file_size(cls, file_path, offset, size):
+        return size or os.path.getsize(file_path) - offset
+
+    def tree_etag(self, file_path, offset=0, size=None):
+        size = self._file_size(file_path, offset, size)
+        if size <= 0:
+            return ''
+        with open(file_path, 'rb') as f:
+            _, cached = hash_cache.lookup(f, offset, size)
+            if cached is not None:
+                return cached
+            tree_etag = self._compute_tree_etag(file_path, offset, size)
+            hash_cache.store(f, offset, size, tree_etag=tree_etag)
+        return tree_etag
+
+    def _compute_tree_etag(self, file_path, offset, size):
+        tasks = [(file_path, offset + start, end - start + 1, self.block_size)
+                 for start, end in calc_ranges(self.segment_size, size)]
+        accumulator = MerkleAccumulator()
+        # 每段的叶子到达后立即折叠，内存中只保留少数几段的叶子与O(log n)个待合并节点
+        for leaves in self._imap(_hash_leaves, tasks):
+            for leaf in leaves:
+                accumulator.append(leaf)
+        return accumulator.digest()
+
+    def hash(self, file_path, offset=0, size=None):
+        """
+        同时返回etag与tree etag。整个文件的sha256只能顺序计算，放在单独的线程中与叶子hash并行执行，
+        因此总耗时不低于单核顺序计算sha256的时间，多核只加速了tree etag部分；只需要tree etag时使用tree_etag
+        """
+        size = self._file_size(file_path, offset, size)
+        result = {}
+
+        def compute_etag():
+            try:
+                result['etag'] = compute_etag_from_file(file_path, offset=offset, size=size)
+            except Exception as e:
+                result['error'] = e
+
+        etag_thread = threading.Thread(target=compute_etag)
+        etag_thread.daemon = True
+        etag_thread.start()
+        tree_etag = self.tree_etag(file_path, offset, size)
+        etag_thread.join()
+        if 'error' in result:
+            raise result['error']
+        return result['etag'], tree_etag
+
+    def hash_parts(self, file_path, byte_ranges):
+        """
+        并行计算多个分片各自的 (etag, tree etag)，返回结果与byte_ranges顺序一致
+        """
+        tasks = [(file_path, start, end - start + 1) for start, end in byte_ranges]
+        return self._map(_hash_part, tasks)
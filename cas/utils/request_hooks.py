@@ -0,0 +1,242 @@
+# -*- coding=UTF-8 -*-
+
+import ctypes
+import ctypes.util
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+EVENTS = ('request_start', 'connected', 'headers_sent', 'body_sent', 'first_byte', 'response_done', 'error')
+
+
+def _load_monotonic():
+    """
+    Python 2没有time.monotonic，Linux与macOS下通过clock_gettime(CLOCK_MONOTONIC)读取，不可用时退回time.time
+    """
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    clock_monotonic = 6 if os.uname()[0] == 'Darwin' else 1
+    def monotonic():
+        t = timespec()
+        if clock_gettime(clock_monotonic, ctypes.byref(t)) != 0:
+            return time.time()
+        return t.tv_sec + t.tv_nsec * 1e-9
+
+    if clock_gettime(clock_monotonic, ctypes.byref(timespec())) != 0:
+        return time.time
+    return monotonic
+
+
+monotonic = _load_monotonic()
+
+_IdTemplates = {'archives': '{archive_id}', 'multipart-uploads': '{upload_id}', 'jobs': '{job_id}'}
+
+
+def url_template(url):
+    """
+    将请求路径中的appid、vault名与各类ID替换为占位符，如 /{appid}/vaults/{vault}/jobs/{job_id}/output，便于按接口聚合
+    """
+    fields = url.split('?', 1)[0].split('/')
+    if len(fields) > 1:
+        fields[1] = '{appid}'
+    if len(fields) > 3 and fields[2] == 'vaults':
+        fields[3] = '{vault}'
+    if len(fields) > 5:
+        fields[5] = _IdTemplates.get(fields[4], '{id}')
+    return '/'.join(fields)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def retry_context(retry):
+    """
+    标记当前线程发出的请求为第retry次重试，MultipartUpload与Job的重试循环在其中发送请求
+    """
+    previous = getattr(_local, 'retry', 0)
+    _local.retry = retry
+    try:
+        yield
+    finally:
+        _local.retry = previous
+
+
+def current_retry():
+    return getattr(_local, 'retry', 0)
+
+
+class RequestEvent(object):
+    """
+    :ivar name: 事件名，见EVENTS
+    :ivar timestamp: 事件发生时的单调时钟读数，单位秒
+    :ivar elapsed: 距request_start的秒数
+    :ivar retry: 上层重试次数与连接失效后重发次数之和
+    """
+
+    __slots__ = ('name', 'request_id', 'method', 'url', 'url_template', 'timestamp', 'elapsed',
+                 'bytes_sent', 'bytes_received', 'status', 'retry', 'reused', 'error')
+
+    def __init__(self, name, trace, timestamp, error=None):
+        self.name = name
+        self.request_id = trace.id
+        self.method = trace.method
+        self.url = trace.url
+        self.url_template = trace.url_template
+        self.timestamp = timestamp
+        self.elapsed = timestamp - trace.start
+        self.bytes_sent = trace.bytes_sent
+        self.bytes_received = trace.bytes_received
+        self.status = trace.status
+        self.retry = trace.retry
+        self.reused = trace.reused
+        self.error = error
+
+    def __repr__(self):
+        return 'RequestEvent: %s %s %s +%.6f' % (self.name, self.method, self.url_template, self.elapsed)
+
+
+class RequestTrace(object):
+    """
+    单个请求的计时上下文，由CASClient在发送请求的各阶段调用
+    """
+
+    def __init__(self, hooks, request_id, method, url):
+        self.hooks = hooks
+        self.id = request_id
+        self.method = method
+        self.url = url
+        self.url_template = url_template(url)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.status = None
+        self.retry = current_retry()
+        self.reused = None
+        self.start = monotonic()
+        self.emit('request_start', self.start)
+
+    def emit(self, name, timestamp=None, error=None):
+        self.hooks._emit(RequestEvent(name, self, timestamp or monotonic(), error))
+
+    def connected(self, reused):
+        self.reused = reused
+        self.emit('connected')
+
+    def headers_sent(self):
+        self.emit('headers_sent')
+
+    def body_sent(self, nbytes):
+        self.bytes_sent = nbytes
+        self.emit('body_sent')
+
+    def first_byte(self, response):
+        """
+        收到响应头时发出first_byte，响应体读取完毕(或连接关闭)时发出response_done
+        """
+        self.status = response.status
+        self.emit('first_byte')
+
+        def done(bytes_read):
+            self.bytes_received = bytes_read
+            self.emit('response_done')
+
+        response.on_done(done)
+
+    def error(self, error):
+        self.emit('error', error=error)
+
+    def retried(self):
+        """
+        复用的连接失效后在新连接上重发
+        """
+        self.retry += 1
+
+
+class _NullTrace(object):
+    """
+    没有订阅者时使用，各阶段的调用不产生任何开销
+    """
+
+    def connected(self, reused):
+        pass
+
+    def headers_sent(self):
+        pass
+
+    def body_sent(self, nbytes):
+        pass
+
+    def first_byte(self, response):
+        pass
+
+    def error(self, error):
+        pass
+
+    def retried(self):
+        pass
+
+
+_NULL_TRACE = _NullTrace()
+
+
+class RequestHooks(object):
+    """
+    请求计时事件的订阅表，可以同时有多个订阅者；订阅者在发送请求的线程中同步调用，其异常只记录日志
+    """
+
+    def __init__(self):
+        self._subscribers = ()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, callback, events=None):
+        """
+        :param callback: 以RequestEvent为参数调用
+        :param events: 只接收这些事件，为None时接收全部
+        """
+        if events is not None:
+            unknown = set(events) - set(EVENTS)
+            if unknown:
+                raise ValueError('unknown events: %s' % ', '.join(sorted(unknown)))
+            events = frozenset(events)
+        with self._lock:
+            self._subscribers += ((callback, events),)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s[0] != callback)
+
+    @property
+    def active(self):
+        return bool(self._subscribers)
+
+    def start(self, method, url):
+        if not self._subscribers:
+            return _NULL_TRACE
+        return RequestTrace(self, next(self._ids), method, url)
+
+    def _emit(self, event):
+        for callback, events in self._subscribers:
+            if events is not None and event.name not in events:
+                continue
+            try:
+                callback(event)
+            except Exception as e:
+                log.error('Request hook %r failed on %s: %s' % (callback, event.name, e))
+
+
+# 未指定hooks的CASClient共用该实例，订阅一次即可覆盖进程中的所有请求
+default_hooks = RequestHooks()
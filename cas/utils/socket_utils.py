@@ -0,0 +1,105 @@
+# -*- coding=UTF-8 -*-
+
+import errno
+import mmap
+import os
+import select
+import socket
+import stat
+import sys
+
+_os_sendfile = getattr(os, 'sendfile', None)
+_libc_sendfile = None
+
+if _os_sendfile is None and sys.platform.startswith('linux'):
+    try:
+        import ctypes
+        import ctypes.util
+
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc_sendfile = getattr(_libc, 'sendfile64', None) or _libc.sendfile
+        _libc_sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+                                   ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+        _libc_sendfile.restype = ctypes.c_ssize_t
+    except (ImportError, OSError, AttributeError):
+        _libc_sendfile = None
+
+
+def _sendfile_once(out_fd, in_fd, offset, count):
+    if _os_sendfile is not None:
+        return _os_sendfile(out_fd, in_fd, offset, count)
+    c_offset = ctypes.c_int64(offset)
+    sent = _libc_sendfile(out_fd, in_fd, ctypes.byref(c_offset), count)
+    if sent < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return sent
+
+
+def is_sendfile_supported():
+    return _os_sendfile is not None or _libc_sendfile is not None
+
+
+def can_sendfile(sock, reader):
+    """
+    只有明文socket + 普通文件才能交给内核直接发送，TLS连接需要在用户态加密
+    """
+    if not is_sendfile_supported() or type(sock) is not socket.socket:
+        return False
+    try:
+        file_no = reader.fileno()
+        return stat.S_ISREG(os.fstat(file_no).st_mode)
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
+
+
+def sendfile(sock, reader, count):
+    """
+    将reader从当前位置开始的count字节通过sendfile发送到sock，发送完成后reader的位置后移
+    :return: 实际发送的字节数，可能小于count
+    """
+    offset = reader.tell()
+    out_fd = sock.fileno()
+    in_fd = reader.fileno()
+    timeout = sock.gettimeout()
+    sent = 0
+    try:
+        while sent < count:
+            try:
+                n = _sendfile_once(out_fd, in_fd, offset + sent, count - sent)
+            except OSError as e:
+                if e.errno in (errno.EINVAL, errno.ENOSYS):
+                    # 文件系统不支持sendfile，剩余数据由调用方按普通方式发送
+                    break
+                if e.errno != errno.EAGAIN:
+                    raise socket.error(e.errno, e.strerror)
+                # 设置了超时的socket工作在非阻塞模式下，等待其可写
+                _, writable, _ = select.select([], [sock], [], timeout)
+                if not writable:
+                    raise socket.timeout('timed out')
+                continue
+            if n == 0:
+                break
+            sent += n
+    finally:
+        reader.seek(offset + sent)
+    return sent
+
+
+def send_mmap(conn, reader, count, chunk_size):
+    """
+    直接发送mmap的内存切片，避免read()在用户态复制数据
+    """
+    if not isinstance(reader, mmap.mmap):
+        raise TypeError('mmap expected')
+    offset = reader.tell()
+    count = min(count, len(reader) - offset)
+    sent = 0
+    try:
+        while sent < count:
+            size = min(chunk_size, count - sent)
+            conn.send(buffer(reader, offset + sent, size))
+            sent += size
+    finally:
+        reader.seek(offset + sent)
+    return sent
@@ -0,0 +1,220 @@
+# -*- coding=UTF-8 -*-
+
+import json
+import os
+import threading
+
+from cas.utils.request_hooks import default_hooks
+from cas.utils.request_hooks import monotonic
+
+_local = threading.local()
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.args = dict(self.args or {}, error='%s: %s' % (exc_type.__name__, exc_val))
+        self.tracer.add_span(self.name, self.start, monotonic(), self.cat, self.args)
+        return False
+
+
+class Tracer(object):
+    """
+    记录MultipartUpload.start与Job.download_to_file中每个分片的各阶段耗时，保存为Chrome/Perfetto可以打开的trace JSON
+    每个工作线程一行，分片内依次为startup-sleep、read、hash、attempt/retry，attempt中包括CASClient请求的sign、
+    connect、send、server-wait与receive，下载时receive中包括每块数据的hash与write
+    """
+
+    def __init__(self, hooks=None):
+        """
+        :param hooks: 请求所用CASClient的RequestHooks，默认为request_hooks.default_hooks
+        """
+        self.hooks = hooks if hooks is not None else default_hooks
+        self._events = []
+        self._threads = {}          # tid -> 线程名
+        self._requests = {}         # request_id -> 上一阶段结束的时间
+        self._lock = threading.Lock()
+        self._origin = monotonic()
+        self._pid = os.getpid()
+        self._attached = 0
+
+    def span(self, name, cat='part', **args):
+        """
+        以with语句记录一段耗时
+        """
+        return _Span(self, name, cat, args)
+
+    def add_span(self, name, start, end, cat='part', args=None):
+        """
+        :param start, end: monotonic时钟读数，单位秒
+        """
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': self._pid, 'tid': self._tid(),
+                 'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+
+    def instant(self, name, cat='part', **args):
+        event = {'name': name, 'cat': cat, 'ph': 'i', 's': 't', 'pid': self._pid, 'tid': self._tid(),
+                 'ts': (monotonic() - self._origin) * 1e6}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+
+    def activate(self):
+        """
+        在当前线程中记录CASClient请求的各阶段，用法：with tracer.activate(): ...
+        """
+        return _Activation(self)
+
+    def attach(self):
+        """
+        订阅hooks，可以嵌套调用，与detach成对使用
+        """
+        with self._lock:
+            self._attached += 1
+            subscribe = self._attached == 1
+        if subscribe:
+            self.hooks.subscribe(self._on_request)
+
+    def detach(self):
+        with self._lock:
+            self._attached -= 1
+            unsubscribe = self._attached == 0
+        if unsubscribe:
+            self.hooks.unsubscribe(self._on_request)
+
+    def to_dict(self):
+        with self._lock:
+            events = list(self._events)
+            threads = self._threads.items()
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self._pid, 'args': {'name': 'cas'}}]
+        metadata.extend({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': name}}
+                        for tid, name in sorted(threads))
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def save(self, file_path):
+        with open(file_path, 'wb') as f:
+            json.dump(self.to_dict(), f)
+
+    def _tid(self):
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self._threads:
+            with self._lock:
+                self._threads[tid] = thread.name
+        return tid
+
+    def _on_request(self, event):
+        if current() is not self:
+            return
+        name = event.name
+        with self._lock:
+            if name == 'request_start':
+                self._requests[event.request_id] = event.timestamp
+                return
+            previous = self._requests.get(event.request_id)
+            if name in ('response_done', 'error'):
+                self._requests.pop(event.request_id, None)
+            elif name != 'headers_sent':
+                self._requests[event.request_id] = event.timestamp
+        if previous is None:
+            return
+        # 各阶段从上一个事件开始，headers_sent与body_sent合并为send
+        stage = {'connected': 'connect', 'body_sent': 'send', 'first_byte': 'server-wait',
+                 'response_done': 'receive', 'error': 'error'}.get(name)
+        if stage is None:
+            return
+        args = {'method': event.method, 'url': event.url_template}
+        if name == 'connected':
+            args['reused'] = event.reused
+        elif name == 'body_sent':
+            args['bytes'] = event.bytes_sent
+        elif name == 'first_byte':
+            args['status'] = event.status
+        elif name == 'response_done':
+            args['bytes'] = event.bytes_received
+        else:
+            args['error'] = str(event.error)
+        self.add_span(stage, previous, event.timestamp, 'request', args)
+
+
+class _Activation(object):
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'tracer', None)
+        _local.tracer = self.tracer
+        return self.tracer
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _local.tracer = self.previous
+        return False
+
+
+class _NullTracer(object):
+    """
+    未指定tracer时使用，各调用不产生记录
+    """
+
+    def span(self, name, cat='part', **args):
+        return _NULL_SPAN
+
+    def instant(self, name, cat='part', **args):
+        pass
+
+    def activate(self):
+        return _NULL_SPAN
+
+    def attach(self):
+        pass
+
+    def detach(self):
+        pass
+
+
+NULL_TRACER = _NullTracer()
+
+
+def current():
+    """
+    当前线程中生效的Tracer，没有时为None
+    """
+    return getattr(_local, 'tracer', None)
+
+
+def span(name, cat='part', **args):
+    """
+    在当前线程生效的Tracer中记录一段耗时，没有生效的Tracer时不记录，供CASClient等底层代码使用
+    """
+    tracer = getattr(_local, 'tracer', None)
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, cat, **args)
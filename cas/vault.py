@@ -4,6 +4,8 @@ import sys
 from cas.utils.file_utils import *
 from cas.archive import Archive
 from cas.conf.common_conf import DEFAULT_NORMAL_UPLOAD_THRESHOLD, CAS_PREFIX
+from cas.conf.multi_task_conf import MultipartUpload_Pipeline
+from cas.exceptions.cas_server_error import CASServerError
 from job import Job
 from multipart_upload import MultipartUpload
 
@@ -41,29 +43,41 @@ class Vault(object):
 
     @classmethod
     def get_vault_by_name(cls, cas_api, vault_name):
-        vaults = cls.list_all_vaults(cas_api)
-        for vault in vaults:
-            if vault_name == vault.name:
-                return vault
-        raise ValueError('Vault not exists: %s' % vault_name)
+        try:
+            response = cas_api.describe_vault(vault_name)
+        except CASServerError as e:
+            if e.status == 404:
+                raise ValueError('Vault not exists: %s' % vault_name)
+            raise
+        return Vault(cas_api, response)
 
     @classmethod
     def delete_vault_by_name(cls, cas_api, vault_name):
-        vaults = cls.list_all_vaults(cas_api)
-        for vault in vaults:
-            if vault_name == vault.name:
-                return vault.delete()
-        raise ValueError('Vault not exists: %s' % vault_name)
+        try:
+            return cas_api.delete_vault(vault_name)
+        except CASServerError as e:
+            if e.status == 404:
+                raise ValueError('Vault not exists: %s' % vault_name)
+            raise
+
+    @classmethod
+    def iter_vaults(cls, cas_api):
+        """
+        逐个返回Vault对象，下一页在后台预取
+        """
+        for data in cas_api.iter_vaults():
+            yield Vault(cas_api, data)
 
     @classmethod
     def list_all_vaults(cls, cas_api):
-        api = cas_api
-        result = api.list_all_vaults()
-        return [Vault(api, data) for data in result['VaultList']]
+        return list(cls.iter_vaults(cas_api))
+
+    def iter_multipart_uploads(self):
+        for data in self.api.iter_multipart_uploads(self.name):
+            yield MultipartUpload(self, data)
 
     def list_all_multipart_uploads(self):
-        result = self.api.list_all_multipart_uploads(self.name)
-        return [MultipartUpload(self, data) for data in result['UploadsList']]
+        return list(self.iter_multipart_uploads())
 
     def get_archive(self, archive_id):
         return Archive(self, archive_id)
@@ -83,23 +97,29 @@ class Vault(object):
         response = self.api.initiate_job(self.name, 'inventory-retrieval', desc=desc)
         return self.get_job(response['x-cas-job-id'])
 
-    def upload_archive(self, file_path, desc=None):
+    def upload_archive(self, file_path, desc=None, pipeline=None):
+        """
+        :param pipeline: 为True时文件只读取一次到内存中，完成hash计算后直接发送，默认取multi_task_conf
+        """
+        if pipeline is None:
+            pipeline = MultipartUpload_Pipeline
         length = os.path.getsize(file_path)
         if length > self.NormalUploadThreshold:
             uploader = self.initiate_multipart_upload(file_path, desc=desc)
             print "====== start the multipart upload: ", uploader
-            archive_id = uploader.start()
+            archive_id = uploader.start(pipeline=pipeline)
             return archive_id
         elif length > 0:
             with open_file(file_path=file_path) as content:
-                mmaped_file = mmap.mmap(content.fileno(),length=length, offset=0, access=mmap.ACCESS_READ)
-                try:
-                    cas_response = self.api.upload_archive(self.name, mmaped_file,
-                                                           etag=compute_etag_from_file(file_path),
-                                                           tree_tag=compute_tree_etag_from_file(file_path),
-                                                           size=content_length(content), desc=desc)
-                finally:
-                    mmaped_file.close()
+                if pipeline:
+                    content = read_file_into(content, bytearray(length), 0, length)
+                    etag, tree_etag = compute_hash_from_content(content)
+                else:
+                    # 传入文件对象而非mmap，明文连接时可由sendfile直接发送
+                    etag, tree_etag = compute_hash_from_file_obj(content)
+                cas_response = self.api.upload_archive(self.name, content,
+                                                       etag=etag, tree_tag=tree_etag,
+                                                       size=content_length(content), desc=desc)
                 return cas_response['x-cas-archive-id']
         else:
             raise ValueError('CAS does not support zero byte archive.')
@@ -126,7 +146,7 @@ class Vault(object):
         return self.api.delete_vault(self.name)
 
     def get_job(self, job_id):
-        cas_response = self.api.describe_job(self.name, job_id)
+        cas_response = self.api.describe_job(self.name, job_id, refresh=True)
         return Job(self, cas_response)
 
     def push_archive_to_cos(self, archive_id, bucket_endpoint, object_name, desc=None, byte_range=None, tier=None):
@@ -8,9 +8,11 @@ import time
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from collections import namedtuple
 
+from cas import benchmark
 from cas.cas_cmd.cas_ops import CASCMD
 from cas.conf.common_conf import CONFIG_SECTION
 from cas.conf.common_conf import DEFAULT_CONFIG_FILE
+from cas.conf.common_conf import DEFAULT_HASH_CACHE_FILE
 
 HELP_INFO = \
     '''Usage: cascmd <action> [<args>]:
@@ -19,9 +21,10 @@ General Use:
     ls
     cv                     cas://vault
     rm                     cas://vault [archive_id]
-    upload                 cas://vault local_file [-p PART_SIZE] [--upload_id upload_id] [--desc desc]
+    upload                 cas://vault local_file [-p PART_SIZE] [--upload_id upload_id] [--desc desc] [--threads threads] [--hash-cache [file]]
     create_job             cas://vault [archive_id] [--start start] [--size size] [--desc desc]
-    fetch                  cas://vault jobid local_file [--start start] [--size size] [-f]
+    fetch                  cas://vault jobid local_file [--start start] [--size size] [-f] [--threads threads] [-p PART_SIZE]
+    restore                cas://vault [archive_id ...] [--archive-list file] [-d dir] [--tier tier] [--downloads n] [--max-bytes size] [--threads threads] [-p PART_SIZE]
 
 Vault Operations:
     create_vault           cas://vault
@@ -30,12 +33,12 @@ Vault Operations:
     desc_vault             cas://vault
 
 Archive Operations:
-    upload                 cas://vault local_file [-p PART_SIZE] [--upload_id upload_id] [--desc desc]
+    upload                 cas://vault local_file [-p PART_SIZE] [--upload_id upload_id] [--desc desc] [--threads threads] [--hash-cache [file]]
     delete_archive         cas://vault archive_id
 
 Etag Operations:
-    file_tree_etag   local_file
-    part_tree_etag   local_file start end
+    file_tree_etag   local_file [--threads threads] [--hash-cache [file]]
+    part_tree_etag   local_file start end [--threads threads] [--hash-cache [file]]
 
 Multipart Archive Operations:
     init_multipart_upload       cas://vault part_size [--desc desc]
@@ -48,11 +51,12 @@ Multipart Archive Operations:
 Job Operations:
     create_job             cas://vault [archive_id] [--desc desc] [--start start] [--size size] [--limit limit] [--marker marker] [--start_date start_date] [--end_date end_date]
     desc_job               cas://vault jobid
-    fetch_job_output       cas://vault jobid local_file [--start start] [--size size] [-f]
+    fetch_job_output       cas://vault jobid local_file [--start start] [--size size] [-f] [--threads threads] [-p PART_SIZE]
     list_job               cas://vault [--marker marker] [--limit limit]
 
 Other Operations:
     config                 --endpoint endpoint --appid appid --secretid secretid --secretkey secretkey
+    bench                  [-n number] [--size MB] [--threads n ...] [--part-sizes MB ...] [--latency seconds] [--bandwidth MB/s] [--no-transfer] [-o file]
     help
 
 '''
@@ -156,6 +160,10 @@ if __name__ == '__main__':
     cmd = 'help'
     phelp = subcmd.add_parser(cmd, help='show a detailed help message and exit')
 
+    cmd = 'bench'
+    pbench = subcmd.add_parser(cmd, help='run SDK benchmarks against a local mock server and print JSON results')
+    benchmark.add_arguments(pbench)
+
     cmd = 'ls'
     pls = subcmd.add_parser(cmd, help='list all vaults')
     pls.add_argument('--marker', type=str, help='list start position marker')
@@ -181,8 +189,11 @@ if __name__ == '__main__':
     pupload.add_argument('--upload_id', type=str, help=\
             'MultiPartUpload ID upload returned to resume last upload')
     pupload.add_argument('--desc', type=str, help='description of the file')
+    pupload.add_argument('--threads', type=int, help='number of parts hashed and uploaded concurrently, default to be 8 times the cpu count')
+    pupload.add_argument('--hash-cache', nargs='?', const=DEFAULT_HASH_CACHE_FILE, help='reuse hashes of unchanged files from the local cache file')
     pupload.add_argument('-p', '--part-size', type=str, help=
             'multipart upload part size')
+    pupload.add_argument('--trace', type=str, help='write a Chrome/Perfetto trace of each part of a multipart upload to this file')
     add_userinfo_config(pupload)
 
     cmd = 'create_job'
@@ -213,8 +224,25 @@ if __name__ == '__main__':
     pfj.add_argument('-f', '--force', action='store_true', help='force overwrite if file exists')
     pfj.add_argument('--start', type=str, help='start position to download output retrieved, default to be 0')
     pfj.add_argument('--size', type=str, help='size to download, default to be (totalsize - start)')
+    pfj.add_argument('--threads', type=int, help='number of ranges downloaded concurrently when fetching a whole archive, default to be 4 times the cpu count')
+    pfj.add_argument('-p', '--part-size', type=str, help='size of each range, must be divided by 1MB')
+    pfj.add_argument('--trace', type=str, help='write a Chrome/Perfetto trace of each range of a parallel fetch to this file')
     add_userinfo_config(pfj)
 
+    cmd = 'restore'
+    prs = subcmd.add_parser(cmd, help='retrieve archives and download each one as soon as its job completes')
+    prs.add_argument('vault', type=str, help='format cas://vault-name')
+    prs.add_argument('archive_ids', nargs='*', help='IDs of archives to be restored')
+    prs.add_argument('--archive-list', type=str, help='file containing archive IDs, one per line')
+    prs.add_argument('-d', '--dir', type=str, default='.', help='directory archives written to, each named by its archive ID')
+    prs.add_argument('--tier', type=str, help='The retrieval option to use for the archive retrieval. Standard is the default value used.')
+    prs.add_argument('--desc', type=str, help='description of the jobs')
+    prs.add_argument('--downloads', type=int, help='number of archives downloaded concurrently, default to be 4')
+    prs.add_argument('--max-bytes', type=str, help='limit of total size of archives downloaded concurrently, default to be 64G')
+    prs.add_argument('--threads', type=int, help='number of ranges downloaded concurrently for each archive, default to be 4 times the cpu count')
+    prs.add_argument('-p', '--part-size', type=str, help='size of each range, must be divided by 1MB')
+    add_userinfo_config(prs)
+
     cmd = 'create_vault'
     pcvault = subcmd.add_parser(cmd, help='create a vault')
     pcvault.add_argument('vault', type=str, help='format cas://vault-name')
@@ -242,6 +270,8 @@ if __name__ == '__main__':
     pua.add_argument('local_file', type=str, help='file to be uploaded')
     pua.add_argument('--upload_id', type=str, help='MultiPartUpload ID upload returned to resume last upload')
     pua.add_argument('--desc', type=str, help='description of the file')
+    pua.add_argument('--threads', type=int, help='number of parts hashed and uploaded concurrently, default to be 8 times the cpu count')
+    pua.add_argument('--hash-cache', nargs='?', const=DEFAULT_HASH_CACHE_FILE, help='reuse hashes of unchanged files from the local cache file')
     pua.add_argument('-p', '--part-size', type=str, help='multipart upload part size')
     add_userinfo_config(pua)
 
@@ -254,6 +284,8 @@ if __name__ == '__main__':
     cmd = 'file_tree_etag'
     pfth = subcmd.add_parser(cmd, help='calculate tree sha256 hash of a file')
     pfth.add_argument('local_file', type=str, help='file to be calculated')
+    pfth.add_argument('--threads', type=int, help='number of threads used to hash the file, default to be the cpu count')
+    pfth.add_argument('--hash-cache', nargs='?', const=DEFAULT_HASH_CACHE_FILE, help='reuse hashes of unchanged files from the local cache file')
     add_userinfo_config(pfth)
 
     cmd = 'part_tree_etag'
@@ -261,6 +293,8 @@ if __name__ == '__main__':
     ppth.add_argument('local_file', type=str, help='file to be read from')
     ppth.add_argument('start', type=str, help='start position to read')
     ppth.add_argument('end', type=str, help='end position to read')
+    ppth.add_argument('--threads', type=int, help='number of threads used to hash the file, default to be the cpu count')
+    ppth.add_argument('--hash-cache', nargs='?', const=DEFAULT_HASH_CACHE_FILE, help='reuse hashes of unchanged files from the local cache file')
     add_userinfo_config(ppth)
 
     cmd = 'init_multipart_upload'
@@ -331,6 +365,10 @@ if __name__ == '__main__':
             'start position to download output retrieved, default to be 0')
     pfjob.add_argument('--size', type=str, help=\
             'size to download, default to be (totalsize - start)')
+    pfjob.add_argument('--threads', type=int, help=\
+            'number of ranges downloaded concurrently when fetching a whole archive, default to be 4 times the cpu count')
+    pfjob.add_argument('-p', '--part-size', type=str, help=\
+            'size of each range, must be divided by 1MB')
     add_userinfo_config(pfjob)
 
     cmd = 'list_job'
@@ -356,6 +394,9 @@ if __name__ == '__main__':
     elif args.cmd == 'config':
         save_config(args)
         sys.exit(0)
+    elif args.cmd == 'bench':
+        benchmark.main(args)
+        sys.exit(0)
 
     # build auth_info
     auth_info = build_auth_info(args)
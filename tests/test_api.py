@@ -0,0 +1,50 @@
+# -*- coding=UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cas.api import CasAPI
+from cas.mock_server import MockCASServer
+from cas.vault import Vault
+
+
+class JobCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockCASServer(job_delay=0.2).start()
+        self.api = CasAPI(self.server.client())
+        self.vault = Vault.create(self.api, 'test')
+        self.tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(self.tmp_dir, 'src.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(1000))
+        self.job = self.vault.retrieve_archive(self.vault.upload_archive(path))
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_job_status_not_stale(self):
+        self.assertFalse(self.api.describe_job(self.vault.name, self.job.id)['Completed'])
+        self.assertFalse(self.vault.get_job(self.job.id).completed)
+        threading.Event().wait(0.3)
+        self.assertTrue(self.api.describe_job(self.vault.name, self.job.id)['Completed'])
+        self.assertTrue(self.vault.get_job(self.job.id).completed)
+        self.assertTrue(self.api.list_jobs(self.vault.name)['JobList'][0]['Completed'])
+
+    def test_cached_response_is_copy(self):
+        threading.Event().wait(0.3)
+        response = self.api.describe_job(self.vault.name, self.job.id)
+        body = response.read(4096)
+        response['Completed'] = False
+        cached = self.api.describe_job(self.vault.name, self.job.id)
+        self.assertGreater(self.api.cache.hits, 0)
+        self.assertTrue(cached['Completed'])
+        self.assertEqual(cached.read(4096), body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# -*- coding=UTF-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cas.api import CasAPI
+from cas.mock_server import MockCASServer
+from cas.utils.metrics import MetricsRegistry
+from cas.utils.metrics import RequestMetrics
+from cas.utils.request_hooks import RequestHooks
+from cas.vault import Vault
+
+
+class _FailingFile(io.BytesIO):
+    """
+    第一次写入时失败
+    """
+
+    def __init__(self):
+        io.BytesIO.__init__(self)
+        self.failed = False
+
+    def write(self, data):
+        if not self.failed:
+            self.failed = True
+            raise IOError('injected write error')
+        return io.BytesIO.write(self, data)
+
+
+class DownloadByRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockCASServer().start()
+        self.metrics = RequestMetrics(MetricsRegistry())
+        hooks = RequestHooks()
+        hooks.subscribe(self.metrics)
+        self.api = CasAPI(self.server.client(hooks=hooks))
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_failed_read_releases_connection(self):
+        data = os.urandom(4 * 1024 * 1024)
+        path = os.path.join(self.tmp_dir, 'src.bin')
+        with open(path, 'wb') as f:
+            f.write(data)
+        vault = Vault.create(self.api, 'test')
+        job = vault.retrieve_archive(vault.upload_archive(path))
+        threading.Event().wait(0.1)
+
+        f = _FailingFile()
+        job.download_by_range((0, len(data) - 1), file_obj=f, block=False)
+        self.assertTrue(f.failed)
+        self.assertEqual(f.getvalue(), data)
+        self.assertEqual(self.metrics.in_use.value(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# -*- coding=UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cas.utils.journal import DownloadJournal
+from cas.utils.journal import UploadJournal
+
+RANGES = [(i * 1048576, (i + 1) * 1048576 - 1) for i in xrange(4)]
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_download_journal(self):
+        path = os.path.join(self.tmp_dir, 'out.bin.cas')
+        with DownloadJournal(path, RANGES) as journal:
+            self.assertEqual(journal.load(), {})
+            journal.append(RANGES[1], 'ab' * 32)
+            journal.append(RANGES[3], 'cd' * 32)
+        # 进程异常退出时写了一半的记录
+        with open(path, 'ab') as f:
+            f.write('\x02\x00')
+        with DownloadJournal(path, RANGES) as journal:
+            self.assertEqual(journal.load(), {RANGES[1]: 'ab' * 32, RANGES[3]: 'cd' * 32})
+
+    def test_upload_journal(self):
+        identity = (1, 2, 3, 4)
+        with UploadJournal('upload', identity, RANGES, journal_dir=self.tmp_dir) as journal:
+            journal.load()
+            journal.append(RANGES[0], ('11' * 32, '22' * 32))
+        with UploadJournal('upload', identity, RANGES, journal_dir=self.tmp_dir) as journal:
+            self.assertEqual(journal.load(), {RANGES[0]: ('11' * 32, '22' * 32)})
+        # 本地文件被修改后记录失效
+        with UploadJournal('upload', (1, 2, 3, 5), RANGES, journal_dir=self.tmp_dir) as journal:
+            self.assertEqual(journal.load(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
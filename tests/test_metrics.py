@@ -0,0 +1,59 @@
+# -*- coding=UTF-8 -*-
+
+import gc
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cas.api import CasAPI
+from cas.mock_server import MockCASServer
+from cas.utils.metrics import MetricsRegistry
+from cas.utils.metrics import RequestMetrics
+from cas.utils.request_hooks import RequestHooks
+from cas.vault import Vault
+
+
+class RequestMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockCASServer().start()
+        self.metrics = RequestMetrics(MetricsRegistry())
+        hooks = RequestHooks()
+        hooks.subscribe(self.metrics)
+        self.api = CasAPI(self.server.client(hooks=hooks))
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _job(self):
+        path = os.path.join(self.tmp_dir, 'src.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(256 * 1024))
+        vault = Vault.create(self.api, 'test')
+        job = vault.retrieve_archive(vault.upload_archive(path))
+        threading.Event().wait(0.1)
+        return job
+
+    def test_abandoned_stream_releases_connection(self):
+        job = self._job()
+        response = self.api.get_job_output(job.vault.name, job.id, stream=True)
+        response.read(1024)
+        self.assertEqual(self.metrics.in_use.value(), 1)
+        del response
+        gc.collect()
+        self.assertEqual(self.metrics.in_use.value(), 0)
+
+    def test_closed_stream_releases_connection(self):
+        job = self._job()
+        response = self.api.get_job_output(job.vault.name, job.id, stream=True)
+        response.read(1024)
+        response.response.close()
+        self.assertEqual(self.metrics.in_use.value(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding=UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from cas.api import CasAPI
+from cas.client import CASClient
+from cas.mock_server import MockCASServer
+from cas.utils import http_utils
+from cas.vault import Vault
+
+# 由签名规则手工计算的已知正确签名，与SDK及模拟服务的实现无关
+SIGN_TIME = 1500000000
+SIGN_HEADERS = {
+    'Host': 'cas.ap-chengdu.myqcloud.com',
+    'x-cas-content-sha256': 'ab' * 32,
+    'x-cas-content-range': 'bytes 0-1048575/*',
+    'Content-Length': '1048576',
+}
+SIGN_PARAMS = {'marker': 'Next Page/2', 'limit': '10'}
+SIGN_URL = '/1250000000/vaults/examplevault/multipart-uploads/abc'
+SIGN_EXPECTED = ('q-sign-algorithm=sha1&q-ak=AKIDexample'
+                 '&q-sign-time=1500000000;1500001200&q-key-time=1500000000;1500001200'
+                 '&q-header-list=content-length;host;x-cas-content-range;x-cas-content-sha256'
+                 '&q-url-param-list=limit;marker'
+                 '&q-signature=cb17b696bd18cb0fa7042d05329622e7a7225453')
+
+
+class _Headers(dict):
+
+    def getheader(self, name):
+        for k, v in self.items():
+            if k.lower() == name.lower():
+                return v
+
+
+class _FixedTime(object):
+    """
+    签名与校验期间固定time.time()的返回值
+    """
+
+    def __init__(self, now):
+        self.now = now
+
+    def __enter__(self):
+        self._time = time.time
+        time.time = lambda: self.now
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        time.time = self._time
+        return False
+
+
+class SignatureTest(unittest.TestCase):
+
+    def test_create_auth(self):
+        with _FixedTime(SIGN_TIME):
+            auth = http_utils.create_auth('AKIDexample', 'secretexample', SIGN_HEADERS['Host'], 'PUT', SIGN_URL,
+                                          SIGN_HEADERS, SIGN_PARAMS, 1200)
+        self.assertEqual(auth, SIGN_EXPECTED)
+
+    def test_signer(self):
+        signer = http_utils.Signer('AKIDexample', 'secretexample', 1200)
+        with _FixedTime(SIGN_TIME):
+            auth = signer.sign('PUT', SIGN_URL, SIGN_HEADERS, SIGN_PARAMS)
+        self.assertEqual(auth, SIGN_EXPECTED)
+
+    def test_server_accepts_known_signature(self):
+        server = MockCASServer(ak='AKIDexample', sk='secretexample')
+        handler = threading.local()
+        handler.headers = _Headers(SIGN_HEADERS, Authorization=SIGN_EXPECTED)
+        try:
+            with _FixedTime(SIGN_TIME + 1):
+                server._check_signature(handler, 'PUT', SIGN_URL, SIGN_PARAMS)
+        finally:
+            server.stop()
+
+
+class MockServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockCASServer(job_delay=0.1).start()
+        self.api = CasAPI(self.server.client())
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reject_bad_signature(self):
+        Vault.create(self.api, 'test')
+        client = CASClient(self.server.host, self.server.appid, self.server.ak, 'wrong',
+                           port=self.server.port)
+        response = client.describe_vault('test')
+        self.assertEqual(response.status, 403)
+
+    def test_upload_retrieve_download(self):
+        data = os.urandom(3 * 1024 * 1024 + 123)
+        src = os.path.join(self.tmp_dir, 'src.bin')
+        dst = os.path.join(self.tmp_dir, 'dst.bin')
+        with open(src, 'wb') as f:
+            f.write(data)
+
+        vault = Vault.create(self.api, 'test')
+        archive_id = vault.upload_archive(src, desc='round-trip')
+        job = vault.retrieve_archive(archive_id)
+        threading.Event().wait(0.2)
+        job.download_to_file(dst, block=False)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
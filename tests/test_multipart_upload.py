@@ -0,0 +1,68 @@
+# -*- coding=UTF-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cas import multipart_upload
+from cas.api import CasAPI
+from cas.conf.common_conf import MEGABYTE
+from cas.exceptions.cas_client_error import UploadArchiveError
+from cas.mock_server import MockCASServer
+from cas.multipart_upload import MultipartUpload
+from cas.utils.concurrency import AdaptiveConcurrency
+from cas.vault import Vault
+
+
+class _RecordingConcurrency(AdaptiveConcurrency):
+    """
+    记录每次release后的并发数；不按延迟判断拥塞，只由请求结果触发减少
+    """
+    instances = []
+
+    def __init__(self, max_limit):
+        AdaptiveConcurrency.__init__(self, max_limit, latency_factor=float('inf'))
+        self.initial = self.limit
+        self.limits = []
+        self.instances.append(self)
+
+    def release(self, started, nbytes=0, congested=False):
+        AdaptiveConcurrency.release(self, started, nbytes, congested)
+        self.limits.append(self.limit)
+
+
+class AdaptiveUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockCASServer().start()
+        self.api = CasAPI(self.server.client())
+        self.vault = Vault.create(self.api, 'test')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'src.bin')
+        with open(self.path, 'wb') as f:
+            f.write(os.urandom(8 * MEGABYTE))
+        self._delay = MultipartUpload._StartupDelay
+        MultipartUpload._StartupDelay = None
+        multipart_upload.AdaptiveConcurrency = _RecordingConcurrency
+        del _RecordingConcurrency.instances[:]
+
+    def tearDown(self):
+        multipart_upload.AdaptiveConcurrency = AdaptiveConcurrency
+        MultipartUpload._StartupDelay = self._delay
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_backoff_on_503(self):
+        response = self.api.initiate_multipart_upload(self.vault.name, MEGABYTE)
+        upload_id = response['x-cas-multipart-upload-id']
+        uploader = MultipartUpload(self.vault, self.api.describe_multipart(self.vault.name, upload_id),
+                                   file_path=self.path)
+        self.server.inject(503, times=1, method='PUT')
+        self.assertRaises(UploadArchiveError, uploader.start, adaptive=True, threads=16)
+        controller, = _RecordingConcurrency.instances
+        self.assertLess(min(controller.limits), controller.initial)
+
+
+if __name__ == '__main__':
+    unittest.main()